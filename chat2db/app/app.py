@@ -5,6 +5,7 @@ from chat2db.app.router import sql_example
 from chat2db.app.router import sql_generate
 from chat2db.app.router import database
 from chat2db.app.router import table
+from chat2db.app.service.keyword_service import keyword_service
 from chat2db.config.config import config
 import logging
 
@@ -19,6 +20,13 @@ app.include_router(sql_generate.router)
 app.include_router(database.router)
 app.include_router(table.router)
 
+
+@app.on_event("startup")
+async def load_keywords():
+    # 关键词索引在后台加载，不阻塞服务启动
+    keyword_service.run_in_background(keyword_service.load_keywords())
+    keyword_service.run_in_background(keyword_service.refresh_periodically())
+
 if __name__ == '__main__':
     try:
         ssl_enable = config["SSL_ENABLE"]
@@ -1,87 +1,351 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
-import copy
+import json
 import logging
+import os
+import shutil
 import sys
-
-class Node:
-    def __init__(self, dep, pre_id):
-        self.dep = dep
-        self.pre_id = pre_id
-        self.pre_nearest_children_id = {}
-        self.children_id = {}
-        self.data_frame = None
-
+import uuid
+from collections import deque
+import numpy as np
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                     format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
 
 
-class DictTree:
-    def __init__(self):
-        self.root = 0
-        self.node_list = [Node(0, -1)]
+def pack_strings(strings):
+    """将字符串列表打包为(偏移量数组, utf-8字节数组)"""
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(item) for item in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8) if encoded else np.zeros(0, dtype=np.uint8)
+    return offsets, blob
 
-    def load_data(self, data_dict):
-        for key in data_dict:
-            self.insert_data(key, data_dict[key])
-        self.init_pre()
 
-    def insert_data(self, keyword, data_frame):
-        if not isinstance(keyword,str):
-            return
-        if len(keyword) == 0:
-            return
-        node_index = self.root
-        try:
-            for i in range(len(keyword)):
-                if keyword[i] not in self.node_list[node_index].children_id.keys():
-                    self.node_list.append(Node(self.node_list[node_index].dep+1, 0))
-                    self.node_list[node_index].children_id[keyword[i]] = len(self.node_list)-1
-                node_index = self.node_list[node_index].children_id[keyword[i]]
-        except Exception as e:
-            logging.error(f'关键字插入失败由于：{e}')
-            return
-        self.node_list[node_index].data_frame = data_frame
-
-    def init_pre(self):
-        q = [self.root]
-        l = 0
-        r = 1
-        try:
-            while l < r:
-                node_index = q[l]
-                self.node_list[node_index].pre_nearest_children_id = self.node_list[self.node_list[node_index].pre_id].children_id.copy()
-                l += 1
-                for key, val in self.node_list[node_index].children_id.items():
-                    q.append(val)
-                    r += 1
-                    if key in self.node_list[node_index].pre_nearest_children_id.keys():
-                        pre_id = self.node_list[node_index].pre_nearest_children_id[key]
-                        self.node_list[val].pre_id = pre_id
-                    self.node_list[node_index].pre_nearest_children_id[key] = val
-        except Exception as e:
-            logging.error(f'字典树前缀构建失败由于：{e}')
-            return
-
-    def get_results(self, content: str):
-        content = content.lower()
-        pre_node_index = self.root
-        nex_node_index = None
+def load_array(path, mmap):
+    """以内存映射方式加载.npy文件，空数组无法映射时直接读取"""
+    if not mmap:
+        return np.load(path)
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+
+def unpack_string(offsets, blob, index):
+    return bytes(blob[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+
+class KeywordAutomaton:
+    """
+    数组实现的Aho-Corasick自动机
+    节点n的转移为trans_char/trans_next[trans_start[n]:trans_start[n+1]]，同一节点的转移按字符码点有序
+    output[n]为n的后缀链上最近的终止节点，node_keyword[n]为n对应的关键词序号，非终止节点为-1
+    每个关键词对应一段倒排表，倒排项为(分组序号, 行号)
+    所有数据均为numpy数组，可以保存为.npy文件并以内存映射方式加载
+    """
+    array_names = [
+        'trans_start', 'trans_char', 'trans_next', 'fail', 'output', 'depth', 'node_keyword',
+        'keyword_offsets', 'keyword_blob', 'posting_start', 'posting_group', 'posting_row'
+    ]
+
+    def __init__(self, arrays: dict):
+        for name in KeywordAutomaton.array_names:
+            setattr(self, name, arrays[name])
+
+    @staticmethod
+    def build(entries: dict) -> 'KeywordAutomaton':
+        """
+        由关键词到倒排项列表的字典构建自动机
+        :param entries: {关键词: [(分组序号, 行号), ...]}，关键词需已转为小写
+        """
+        keywords = sorted(keyword for keyword in entries if keyword)
+        children = [{}]
+        node_keyword = [-1]
+        depth = [0]
+        for keyword_id, keyword in enumerate(keywords):
+            node = 0
+            for char in keyword:
+                next_node = children[node].get(char)
+                if next_node is None:
+                    next_node = len(children)
+                    children[node][char] = next_node
+                    children.append({})
+                    node_keyword.append(-1)
+                    depth.append(depth[node] + 1)
+                node = next_node
+            node_keyword[node] = keyword_id
+        node_cnt = len(children)
+        fail = [0] * node_cnt
+        output = [-1] * node_cnt
+        queue = deque(children[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in children[node].items():
+                fail_node = fail[node]
+                while fail_node and char not in children[fail_node]:
+                    fail_node = fail[fail_node]
+                fail[child] = children[fail_node].get(char, 0)
+                suffix = fail[child]
+                output[child] = suffix if node_keyword[suffix] >= 0 else output[suffix]
+                queue.append(child)
+
+        trans_start = np.zeros(node_cnt + 1, dtype=np.int64)
+        trans_start[1:] = np.cumsum([len(child_dict) for child_dict in children])
+        trans_char = np.zeros(int(trans_start[-1]), dtype=np.int32)
+        trans_next = np.zeros(int(trans_start[-1]), dtype=np.int32)
+        for node, child_dict in enumerate(children):
+            start = trans_start[node]
+            for i, (char, child) in enumerate(sorted(child_dict.items(), key=lambda item: ord(item[0]))):
+                trans_char[start + i] = ord(char)
+                trans_next[start + i] = child
+        del children
+
+        keyword_offsets, keyword_blob = pack_strings(keywords)
+        posting_start = np.zeros(len(keywords) + 1, dtype=np.int64)
+        posting_group = []
+        posting_row = []
+        for keyword_id, keyword in enumerate(keywords):
+            postings = sorted(set(entries[keyword]))
+            posting_group.extend(group for group, _ in postings)
+            posting_row.extend(row for _, row in postings)
+            posting_start[keyword_id + 1] = len(posting_row)
+        return KeywordAutomaton({
+            'trans_start': trans_start,
+            'trans_char': trans_char,
+            'trans_next': trans_next,
+            'fail': np.array(fail, dtype=np.int32),
+            'output': np.array(output, dtype=np.int32),
+            'depth': np.array(depth, dtype=np.int32),
+            'node_keyword': np.array(node_keyword, dtype=np.int32),
+            'keyword_offsets': keyword_offsets,
+            'keyword_blob': keyword_blob,
+            'posting_start': posting_start,
+            'posting_group': np.array(posting_group, dtype=np.int32),
+            'posting_row': np.array(posting_row, dtype=np.int32),
+        })
+
+    def step(self, node: int, code: int) -> int:
+        while True:
+            start, end = self.trans_start[node], self.trans_start[node + 1]
+            if end > start:
+                i = start + int(np.searchsorted(self.trans_char[start:end], code))
+                if i < end and self.trans_char[i] == code:
+                    return int(self.trans_next[i])
+            if node == 0:
+                return 0
+            node = int(self.fail[node])
+
+    def match(self, content: str) -> list[int]:
+        """
+        返回问题中出现的关键词序号
+        每个位置只取以该位置结尾的最长关键词，被更长的匹配覆盖的关键词不返回
+        """
+        spans = []
+        node = 0
+        for end, char in enumerate(content.lower()):
+            node = self.step(node, ord(char))
+            keyword_node = node if self.node_keyword[node] >= 0 else int(self.output[node])
+            if keyword_node >= 0:
+                spans.append((end - int(self.depth[keyword_node]) + 1, end, int(self.node_keyword[keyword_node])))
+        spans.sort(key=lambda span: (span[0], -span[1]))
+        keyword_ids = []
+        max_end = -1
+        for _, end, keyword_id in spans:
+            if end <= max_end:
+                continue
+            max_end = end
+            keyword_ids.append(keyword_id)
+        return keyword_ids
+
+    def get_keyword_cnt(self) -> int:
+        return len(self.keyword_offsets) - 1
+
+    def get_keyword(self, keyword_id: int) -> str:
+        return unpack_string(self.keyword_offsets, self.keyword_blob, keyword_id)
+
+    def get_postings(self, keyword_id: int):
+        start, end = self.posting_start[keyword_id], self.posting_start[keyword_id + 1]
+        return self.posting_group[start:end], self.posting_row[start:end]
+
+    def save(self, path: str) -> None:
+        for name in KeywordAutomaton.array_names:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> 'KeywordAutomaton':
+        return KeywordAutomaton({
+            name: load_array(os.path.join(path, f'{name}.npy'), mmap)
+            for name in KeywordAutomaton.array_names})
+
+
+class KeywordIndex:
+    """
+    关键词索引，由关键词自动机、行表和元数据组成
+    分组为(表ID, 列名)，行号指向行表中一行的主键值，同一表的多列共享行表和自动机
+    索引构建后不再修改，更新时构建新索引整体替换，读取方无需加锁
+    """
+    format_version = 1
+
+    def __init__(self, automaton: KeywordAutomaton, row_offsets, row_blob, meta: dict):
+        self.automaton = automaton
+        self.row_offsets = row_offsets
+        self.row_blob = row_blob
+        # meta: {'build_id': 构建标识, 'groups': [[表ID, 列名], ...],
+        #        'tables': {表ID: {'table_name': 表名, 'primary_key_list': [...]}}, 'sources': 合并索引的来源}
+        self.meta = meta
+
+    @staticmethod
+    def build(tables: dict, column_values: dict) -> 'KeywordIndex':
+        """
+        :param tables: {表ID: {'table_name': 表名, 'primary_key_list': [...]}}
+        :param column_values: {(表ID, 列名): {关键词: [[主键值, ...], ...]}}
+        """
+        groups = []
+        rows = []
+        row_ids = {}
+        entries = {}
+        for (table_id, column_name), keyword_value_dict in column_values.items():
+            group = len(groups)
+            groups.append([str(table_id), column_name])
+            for keyword, primary_key_value_list in keyword_value_dict.items():
+                if not isinstance(keyword, str) or len(keyword) == 0:
+                    continue
+                postings = entries.setdefault(keyword.lower(), [])
+                for primary_key_values in primary_key_value_list:
+                    row_key = (str(table_id), '\x1f'.join(primary_key_values))
+                    row_id = row_ids.get(row_key)
+                    if row_id is None:
+                        row_id = len(rows)
+                        row_ids[row_key] = row_id
+                        rows.append(row_key[1])
+                    postings.append((group, row_id))
+        del row_ids
+        automaton = KeywordAutomaton.build(entries)
+        del entries
+        row_offsets, row_blob = pack_strings(rows)
+        meta = {
+            'format_version': KeywordIndex.format_version,
+            'build_id': uuid.uuid4().hex,
+            'groups': groups,
+            'tables': {str(table_id): table for table_id, table in tables.items()},
+        }
+        return KeywordIndex(automaton, row_offsets, row_blob, meta)
+
+    @staticmethod
+    def merge(index_list: list['KeywordIndex']) -> 'KeywordIndex':
+        """
+        合并多个索引，各索引的分组序号和行号依次平移，行表直接拼接
+        合并结果的meta['sources']记录每张表来源索引的build_id，用于判断合并快照是否过期
+        """
+        groups = []
+        tables = {}
+        sources = {}
+        entries = {}
+        row_offsets_list = []
+        row_blob_list = []
+        row_base = 0
+        blob_base = 0
+        for index in index_list:
+            group_base = len(groups)
+            groups.extend(index.meta['groups'])
+            # 合并索引只用于检索，不保留单表索引的刷新基线
+            tables.update({table_id: {key: value for key, value in table.items() if key != 'refresh'}
+                           for table_id, table in index.meta['tables'].items()})
+            for table_id in index.meta['tables']:
+                sources[table_id] = index.meta.get('build_id')
+            automaton = index.automaton
+            for keyword_id in range(automaton.get_keyword_cnt()):
+                posting_groups, posting_rows = automaton.get_postings(keyword_id)
+                entries.setdefault(automaton.get_keyword(keyword_id), []).extend(
+                    zip((posting_groups + group_base).tolist(), (posting_rows + row_base).tolist()))
+            row_offsets_list.append(np.asarray(index.row_offsets[:-1], dtype=np.int64) + blob_base)
+            row_blob_list.append(np.asarray(index.row_blob, dtype=np.uint8))
+            row_base += len(index.row_offsets) - 1
+            blob_base += int(index.row_offsets[-1])
+        automaton = KeywordAutomaton.build(entries)
+        del entries
+        row_offsets = np.concatenate(row_offsets_list + [np.array([blob_base], dtype=np.int64)])
+        row_blob = np.concatenate(row_blob_list) if row_blob_list else np.zeros(0, dtype=np.uint8)
+        meta = {
+            'format_version': KeywordIndex.format_version,
+            'build_id': uuid.uuid4().hex,
+            'groups': groups,
+            'tables': tables,
+            'sources': sources,
+        }
+        return KeywordIndex(automaton, row_offsets, row_blob, meta)
+
+    def get_columns(self, table_id) -> list[str]:
+        return [column_name for group_table_id, column_name in self.meta['groups'] if group_table_id == str(table_id)]
+
+    def get_primary_key_values(self, row_id: int) -> list[str]:
+        return unpack_string(self.row_offsets, self.row_blob, row_id).split('\x1f')
+
+    def to_column_values(self) -> dict:
+        """还原为build的输入，用于增删列后重建"""
+        column_values = {}
+        groups = [tuple(group) for group in self.meta['groups']]
+        for group in groups:
+            column_values[group] = {}
+        automaton = self.automaton
+        for keyword_id in range(automaton.get_keyword_cnt()):
+            keyword = automaton.get_keyword(keyword_id)
+            posting_groups, posting_rows = automaton.get_postings(keyword_id)
+            for group, row_id in zip(posting_groups.tolist(), posting_rows.tolist()):
+                column_values[groups[group]].setdefault(keyword, []).append(self.get_primary_key_values(row_id))
+        return column_values
+
+    def match(self, content: str, table_id_list=None) -> list[tuple[str, str, list[str]]]:
+        """返回问题命中的(表ID, 列名, 主键值)，同一行只返回一次"""
+        table_id_set = None if table_id_list is None else {str(table_id) for table_id in table_id_list}
         results = []
-        logging.info(f'当前问题{content}')
-        try:
-            for i in range(len(content)):
-                if content[i] in self.node_list[pre_node_index].pre_nearest_children_id.keys():
-                    nex_node_index = self.node_list[pre_node_index].pre_nearest_children_id[content[i]]
-                else:
-                    nex_node_index = 0
-                if self.node_list[pre_node_index].dep >= self.node_list[nex_node_index].dep:
-                    if self.node_list[pre_node_index].data_frame is not None:
-                        results.extend(copy.deepcopy(self.node_list[pre_node_index].data_frame))
-                pre_node_index = nex_node_index
-                logging.info(f'当前深度{self.node_list[pre_node_index].dep}')
-            if self.node_list[pre_node_index].data_frame is not None:
-                results.extend(copy.deepcopy(self.node_list[pre_node_index].data_frame))
-        except Exception as e:
-            logging.error(f'结果获取失败由于：{e}')
+        seen = set()
+        groups = self.meta['groups']
+        for keyword_id in self.automaton.match(content):
+            posting_groups, posting_rows = self.automaton.get_postings(keyword_id)
+            for group, row_id in zip(posting_groups.tolist(), posting_rows.tolist()):
+                table_id, column_name = groups[group]
+                if table_id_set is not None and table_id not in table_id_set:
+                    continue
+                if (table_id, row_id) in seen:
+                    continue
+                seen.add((table_id, row_id))
+                results.append((table_id, column_name, self.get_primary_key_values(row_id)))
         return results
+
+    def save(self, path: str) -> None:
+        """先写入临时目录再替换，读取方不会看到写了一半的快照"""
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+        old_path = f'{path}.old-{uuid.uuid4().hex}'
+        os.makedirs(tmp_path)
+        try:
+            self.automaton.save(tmp_path)
+            np.save(os.path.join(tmp_path, 'row_offsets.npy'), self.row_offsets)
+            np.save(os.path.join(tmp_path, 'row_blob.npy'), self.row_blob)
+            with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.meta, f, ensure_ascii=False)
+            if os.path.exists(path):
+                os.rename(path, old_path)
+            os.rename(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> 'KeywordIndex':
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != KeywordIndex.format_version:
+            raise ValueError(f'不支持的关键词索引版本{meta.get("format_version")}')
+        return KeywordIndex(
+            KeywordAutomaton.load(path, mmap),
+            load_array(os.path.join(path, 'row_offsets.npy'), mmap),
+            load_array(os.path.join(path, 'row_blob.npy'), mmap),
+            meta)
+
+    @staticmethod
+    def remove(path: str) -> None:
+        shutil.rmtree(path, ignore_errors=True)
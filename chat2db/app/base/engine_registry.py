@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import logging
+import sys
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from chat2db.config.config import config
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
+
+
+class EngineRegistry:
+    """
+    目标数据库的异步引擎注册表
+    每个数据库连接串对应一个带连接池的引擎，长时间未使用的引擎被回收，引擎总数有上限
+    注册表以连接串的哈希为键，连接串本身不会出现在日志中
+    """
+    # 数据库类型 -> 异步驱动
+    async_drivers = {
+        'postgresql': 'postgresql+asyncpg',
+        'opengauss': 'opengauss+asyncpg',
+        'mysql': 'mysql+aiomysql',
+    }
+    # 键 -> [引擎, 最近使用时间]
+    engines = {}
+
+    @staticmethod
+    def get_key(database_url: str) -> str:
+        return hashlib.sha256(database_url.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def create_engine(database_url: str) -> AsyncEngine:
+        url = make_url(database_url)
+        database_type = url.get_backend_name().lower()
+        url = url.set(drivername=EngineRegistry.async_drivers[database_type])
+        statement_timeout = config['TARGET_DATABASE_STATEMENT_TIMEOUT']
+        if database_type == 'mysql':
+            # MAX_EXECUTION_TIME只对SELECT生效，单位为毫秒
+            connect_args = {'init_command': f'SET SESSION MAX_EXECUTION_TIME={statement_timeout}'}
+        else:
+            connect_args = {'server_settings': {'statement_timeout': str(statement_timeout)}}
+        return create_async_engine(
+            url,
+            pool_size=config['TARGET_DATABASE_POOL_SIZE'],
+            max_overflow=config['TARGET_DATABASE_MAX_OVERFLOW'],
+            pool_timeout=config['TARGET_DATABASE_POOL_TIMEOUT'],
+            pool_recycle=300,
+            pool_pre_ping=True,
+            connect_args=connect_args
+        )
+
+    @staticmethod
+    async def evict_idle_engines() -> None:
+        """回收空闲超时的引擎，引擎数超过上限时回收最久未使用的引擎"""
+        now = time.monotonic()
+        idle_timeout = config['TARGET_DATABASE_IDLE_TIMEOUT']
+        evict_keys = [key for key, (_, last_used_time) in EngineRegistry.engines.items()
+                      if now - last_used_time > idle_timeout]
+        # 为即将创建的引擎预留一个位置
+        overflow = len(EngineRegistry.engines) - len(evict_keys) + 1 - config['TARGET_DATABASE_MAX_ENGINES']
+        if overflow > 0:
+            lru_keys = sorted((key for key in EngineRegistry.engines if key not in evict_keys),
+                              key=lambda key: EngineRegistry.engines[key][1])
+            evict_keys += lru_keys[:overflow]
+        for key in evict_keys:
+            engine, _ = EngineRegistry.engines.pop(key)
+            try:
+                await engine.dispose()
+            except Exception as e:
+                logging.error(f'目标数据库连接池回收失败由于{e}')
+
+    @staticmethod
+    async def get_engine(database_url: str) -> AsyncEngine:
+        key = EngineRegistry.get_key(database_url)
+        item = EngineRegistry.engines.get(key)
+        if item is None:
+            await EngineRegistry.evict_idle_engines()
+            item = EngineRegistry.engines.setdefault(key, [EngineRegistry.create_engine(database_url), 0])
+        item[1] = time.monotonic()
+        return item[0]
+
+    @staticmethod
+    @asynccontextmanager
+    async def connect(database_url: str) -> AsyncConnection:
+        """获取只读用途的连接，退出时回滚"""
+        engine = await EngineRegistry.get_engine(database_url)
+        async with engine.connect() as conn:
+            yield conn
+
+    @staticmethod
+    @asynccontextmanager
+    async def begin(database_url: str) -> AsyncConnection:
+        """获取在事务中执行的连接，正常退出时提交"""
+        engine = await EngineRegistry.get_engine(database_url)
+        async with engine.begin() as conn:
+            yield conn
+
+    @staticmethod
+    async def ping(database_url: str) -> bool:
+        async with EngineRegistry.connect(database_url) as conn:
+            await conn.execute(text('SELECT 1'))
+        return True
+
+    @staticmethod
+    async def dispose(database_url: str) -> None:
+        """数据库配置删除后回收对应的连接池"""
+        item = EngineRegistry.engines.pop(EngineRegistry.get_key(database_url), None)
+        if item is not None:
+            await item[0].dispose()
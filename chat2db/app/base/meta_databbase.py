@@ -5,6 +5,20 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO,
 
 
 class MetaDatabase:
+    # 单次查询中按主键范围读取的最大区间数
+    max_page_range_cnt = 100
+
+    @staticmethod
+    def get_page_ranges(page_list):
+        """将页号合并为连续的区间[(起始页, 结束页), ...]，区间两端都包含"""
+        page_ranges = []
+        for page in sorted(set(page_list)):
+            if page_ranges and page_ranges[-1][1] + 1 == page:
+                page_ranges[-1][1] = page
+            else:
+                page_ranges.append([page, page])
+        return [tuple(page_range) for page_range in page_ranges]
+
     @staticmethod
     def result_to_json(results):
         """
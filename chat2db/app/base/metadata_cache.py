@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from chat2db.config.config import config
+
+
+class MetadataCache:
+    """
+    进程内的元数据缓存，带过期时间和容量上限
+    database_url: 数据库ID -> 解密后的连接串，避免每次请求都查询并解密，连接串不会写入日志
+    table_schema: 表ID -> (数据库ID, 表信息, 列信息, 渲染后的表结构说明)
+    row_count: 连接串哈希:表名 -> 统计信息中的估算行数，-1表示没有统计信息，只随过期时间失效
+    table_choice: 数据库ID:选表数量:归一化的问题 -> (数据库ID, 选出的表ID列表)
+    数据库或表的配置变化时由路由主动失效
+    """
+    database_url = OrderedDict()
+    table_schema = OrderedDict()
+    row_count = OrderedDict()
+    table_choice = OrderedDict()
+
+    @staticmethod
+    def _get(cache: OrderedDict, key):
+        item = cache.get(key)
+        if item is None:
+            return None
+        expire_time, value = item
+        if expire_time < time.monotonic():
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+
+    @staticmethod
+    def _set(cache: OrderedDict, key, value) -> None:
+        cache[key] = (time.monotonic() + config['METADATA_CACHE_TTL'], value)
+        cache.move_to_end(key)
+        while len(cache) > config['METADATA_CACHE_MAX_SIZE']:
+            cache.popitem(last=False)
+
+    @staticmethod
+    def get_database_url(database_id):
+        return MetadataCache._get(MetadataCache.database_url, str(database_id))
+
+    @staticmethod
+    def set_database_url(database_id, database_url) -> None:
+        MetadataCache._set(MetadataCache.database_url, str(database_id), database_url)
+
+    @staticmethod
+    def get_table_schema(table_id):
+        return MetadataCache._get(MetadataCache.table_schema, str(table_id))
+
+    @staticmethod
+    def set_table_schema(table_id, database_id, table_info, column_info_list, note) -> None:
+        MetadataCache._set(MetadataCache.table_schema, str(table_id),
+                           (str(database_id), table_info, column_info_list, note))
+
+    @staticmethod
+    def get_row_count(key):
+        return MetadataCache._get(MetadataCache.row_count, key)
+
+    @staticmethod
+    def set_row_count(key, row_cnt) -> None:
+        MetadataCache._set(MetadataCache.row_count, key, row_cnt)
+
+    @staticmethod
+    def get_table_choice(database_id, question, table_choose_cnt):
+        key = f'{database_id}:{table_choose_cnt}:{" ".join(question.lower().split())}'
+        return MetadataCache._get(MetadataCache.table_choice, key)
+
+    @staticmethod
+    def set_table_choice(database_id, question, table_choose_cnt, table_id_list) -> None:
+        key = f'{database_id}:{table_choose_cnt}:{" ".join(question.lower().split())}'
+        MetadataCache._set(MetadataCache.table_choice, key, (str(database_id), table_id_list))
+
+    @staticmethod
+    def invalidate_table(table_id) -> None:
+        MetadataCache.table_schema.pop(str(table_id), None)
+        keys = [key for key, (_, (_, table_id_list)) in MetadataCache.table_choice.items()
+                if str(table_id) in {str(choice_table_id) for choice_table_id in table_id_list}]
+        for key in keys:
+            MetadataCache.table_choice.pop(key, None)
+
+    @staticmethod
+    def invalidate_database(database_id) -> None:
+        """失效数据库的连接串、其下所有表的结构说明和选表结果"""
+        database_id = str(database_id)
+        MetadataCache.database_url.pop(database_id, None)
+        table_ids = [table_id for table_id, (_, (table_database_id, _, _, _)) in MetadataCache.table_schema.items()
+                     if table_database_id == database_id]
+        for table_id in table_ids:
+            MetadataCache.table_schema.pop(table_id, None)
+        keys = [key for key, (_, (choice_database_id, _)) in MetadataCache.table_choice.items()
+                if choice_database_id == database_id]
+        for key in keys:
+            MetadataCache.table_choice.pop(key, None)
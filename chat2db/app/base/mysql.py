@@ -1,14 +1,14 @@
 
 import asyncio
-import aiomysql
-import concurrent.futures
 import logging
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, text
+import random
+from sqlalchemy import text
 import sys
 from concurrent.futures import ThreadPoolExecutor
-from urllib.parse import urlparse
 from chat2db.app.base.meta_databbase import MetaDatabase
+from chat2db.app.base.engine_registry import EngineRegistry
+from chat2db.app.base.metadata_cache import MetadataCache
+from chat2db.config.config import config
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                     format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
 
@@ -18,107 +18,136 @@ class Mysql(MetaDatabase):
 
     async def test_database_connection(database_url):
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(Mysql._connect_and_query, database_url)
-                result = future.result(timeout=5)
-                return result
-        except concurrent.futures.TimeoutError:
+            return await asyncio.wait_for(EngineRegistry.ping(database_url), timeout=5)
+        except asyncio.TimeoutError:
             logging.error('mysql数据库连接超时')
+            await EngineRegistry.dispose(database_url)
             return False
         except Exception as e:
             logging.error(f'mysql数据库连接失败由于{e}')
+            await EngineRegistry.dispose(database_url)
             return False
 
-    @staticmethod
-    def _connect_and_query(database_url):
-        try:
-            engine = create_engine(
-                database_url,
-                pool_size=20,
-                max_overflow=80,
-                pool_recycle=300,
-                pool_pre_ping=True
-            )
-            session = sessionmaker(bind=engine)()
-            session.execute(text("SELECT 1"))
-            session.close()
-            return True
-        except Exception as e:
-            raise e
-
     @staticmethod
     async def drop_table(database_url, table_name):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with sessionmaker(engine)() as session:
+        async with EngineRegistry.begin(database_url) as conn:
             sql_str = f"DROP TABLE IF EXISTS {table_name};"
-            session.execute(text(sql_str))
+            await conn.execute(text(sql_str))
 
     @staticmethod
     async def select_primary_key_and_keyword_from_table(database_url, table_name, keyword):
         try:
-            url = urlparse(database_url)
-            db_config = {
-                'host': url.hostname or 'localhost',
-                'port': int(url.port or 3306),
-                'user': url.username or 'root',
-                'password': url.password or '',
-                'db': url.path.strip('/')
-            }
-
-            async with aiomysql.create_pool(**db_config) as pool:
-                async with pool.acquire() as conn:
-                    async with conn.cursor() as cur:
-                        primary_key_query = """
-                        SELECT 
-                            COLUMNS.column_name 
-                        FROM
-                            information_schema.tables AS TABLES
-                            INNER JOIN information_schema.columns AS COLUMNS ON TABLES.table_name = COLUMNS.table_name
-                        WHERE
-                            TABLES.table_schema = %s AND TABLES.table_name = %s AND COLUMNS.column_key = 'PRI';
-                        """
-
-                        # 尝试执行查询
-                        await cur.execute(primary_key_query, (db_config['db'], table_name))
-                        primary_key_list = await cur.fetchall()
-                        if not primary_key_list:
-                            return []
-                        primary_key_names = ', '.join([record[0] for record in primary_key_list])
-                        columns = f'{primary_key_names}, {keyword}'
-                        query = f'SELECT {columns} FROM {table_name};'
-                        await cur.execute(query)
-                        results = await cur.fetchall()
-
-                        def _process_results(results, primary_key_list):
-                            tmp_dict = {}
-                            for row in results:
-                                key = str(row[-1])
-                                if key not in tmp_dict:
-                                    tmp_dict[key] = []
-                                pk_values = [str(row[i]) for i in range(len(primary_key_list))]
-                                tmp_dict[key].append(pk_values)
-
-                            return {
-                                'primary_key_list': [record[0] for record in primary_key_list],
-                                'keyword_value_dict': tmp_dict
-                            }
-                        result = await asyncio.get_event_loop().run_in_executor(
-                            Mysql.executor,
-                            _process_results,
-                            results,
-                            primary_key_list
-                        )
-                    return result
+            async with EngineRegistry.connect(database_url) as conn:
+                primary_key_query = """
+                SELECT 
+                    COLUMNS.column_name 
+                FROM
+                    information_schema.tables AS TABLES
+                    INNER JOIN information_schema.columns AS COLUMNS ON TABLES.table_name = COLUMNS.table_name
+                WHERE
+                    TABLES.table_schema = DATABASE() AND TABLES.table_name = :table_name AND COLUMNS.column_key = 'PRI';
+                """
+
+                # 尝试执行查询
+                primary_key_list = (await conn.execute(text(primary_key_query), {'table_name': table_name})).all()
+                if not primary_key_list:
+                    return []
+                primary_key_names = ', '.join([record[0] for record in primary_key_list])
+                columns = f'{primary_key_names}, {keyword}'
+                query = f'SELECT {columns} FROM {table_name};'
+                results = (await conn.execute(text(query))).all()
+
+            def _process_results(results, primary_key_list):
+                tmp_dict = {}
+                for row in results:
+                    key = str(row[-1])
+                    if key not in tmp_dict:
+                        tmp_dict[key] = []
+                    pk_values = [str(row[i]) for i in range(len(primary_key_list))]
+                    tmp_dict[key].append(pk_values)
+
+                return {
+                    'primary_key_list': [record[0] for record in primary_key_list],
+                    'keyword_value_dict': tmp_dict
+                }
+            result = await asyncio.get_event_loop().run_in_executor(
+                Mysql.executor,
+                _process_results,
+                results,
+                primary_key_list
+            )
+            return result
 
         except Exception as e:
             logging.error(f'mysql数据检索失败由于 {e}')
 
+    @staticmethod
+    async def get_primary_key_info(conn, table_name):
+        """返回主键的[(列名, 类型), ...]"""
+        primary_key_query = """
+        SELECT
+            COLUMNS.column_name, COLUMNS.data_type
+        FROM
+            information_schema.columns AS COLUMNS
+        WHERE
+            COLUMNS.table_schema = DATABASE() AND COLUMNS.table_name = :table_name AND COLUMNS.column_key = 'PRI'
+        ORDER BY COLUMNS.ordinal_position;
+        """
+        return (await conn.execute(text(primary_key_query), {'table_name': table_name})).all()
+
+    @staticmethod
+    def is_integer_primary_key(primary_key_info):
+        return len(primary_key_info) == 1 and primary_key_info[0][1].lower() in (
+            'tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+
+    @staticmethod
+    async def get_page_checksums(database_url, table_name, column_name_list, page_size):
+        """
+        按主键分页计算每个关键词列的校验和，用于关键词索引的增量刷新
+        表只有一个整数主键时按主键范围分页，否则整张表视为一页，表没有主键时返回None
+        """
+        async with EngineRegistry.connect(database_url) as conn:
+            primary_key_info = await Mysql.get_primary_key_info(conn, table_name)
+            if not primary_key_info:
+                return None
+            primary_key_list = [record[0] for record in primary_key_info]
+            if Mysql.is_integer_primary_key(primary_key_info):
+                page_expression = f'FLOOR({primary_key_list[0]} / {int(page_size)})'
+            else:
+                page_size = None
+                page_expression = '0'
+            primary_key_names = ', '.join(primary_key_list)
+            # 行的哈希取前64位后异或，与行的顺序无关
+            checksum_expressions = [
+                f"CONCAT(COUNT(*), '-', BIT_XOR(CAST(CONV(SUBSTRING(MD5(CONCAT_WS(CHAR(31), {primary_key_names}, "
+                f"COALESCE(CAST({column_name} AS CHAR), CHAR(0)))), 1, 16), 16, 10) AS UNSIGNED)))"
+                for column_name in column_name_list]
+            sql_str = f'SELECT {page_expression} AS page, {", ".join(checksum_expressions)} FROM {table_name} GROUP BY 1;'
+            results = (await conn.execute(text(sql_str))).all()
+        checksums = {column_name: {} for column_name in column_name_list}
+        for row in results:
+            for i, column_name in enumerate(column_name_list):
+                checksums[column_name][str(int(row[0]))] = row[i + 1]
+        return {'primary_key_list': primary_key_list, 'page_size': page_size, 'checksums': checksums}
+
+    @staticmethod
+    async def select_keyword_by_pages(database_url, table_name, primary_key, column_name_list, page_size, page_list):
+        """读取指定页内各行的主键和关键词列，返回[(主键值, [列值, ...]), ...]"""
+        page_ranges = Mysql.get_page_ranges(page_list)
+        columns = ', '.join([primary_key] + column_name_list)
+        results = []
+        async with EngineRegistry.connect(database_url) as conn:
+            for i in range(0, len(page_ranges), Mysql.max_page_range_cnt):
+                conditions = []
+                params = {}
+                for j, (start_page, end_page) in enumerate(page_ranges[i:i + Mysql.max_page_range_cnt]):
+                    conditions.append(f'({primary_key} >= :start_{j} AND {primary_key} < :end_{j})')
+                    params[f'start_{j}'] = start_page * page_size
+                    params[f'end_{j}'] = (end_page + 1) * page_size
+                sql_str = f'SELECT {columns} FROM {table_name} WHERE {" OR ".join(conditions)};'
+                results += (await conn.execute(text(sql_str), params)).all()
+        return [(str(row[0]), [str(value) for value in row[1:]]) for row in results]
+
     @staticmethod
     async def assemble_sql_query_base_on_primary_key(table_name, primary_key_list, primary_key_value_list):
         sql_str = f'SELECT * FROM {table_name} where '
@@ -131,16 +160,9 @@ class Mysql(MetaDatabase):
 
     @staticmethod
     async def get_table_info(database_url, table_name):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with sessionmaker(engine)() as session:
-            sql_str = f"""SELECT TABLE_COMMENT FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = '{table_name}';"""
-            table_note = session.execute(text(sql_str)).one()[0]
+        async with EngineRegistry.connect(database_url) as conn:
+            sql_str = """SELECT TABLE_COMMENT FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = :table_name;"""
+            table_note = (await conn.execute(text(sql_str), {'table_name': table_name})).one()[0]
         if table_note == '':
             table_note = table_name
         table_note = {
@@ -151,18 +173,11 @@ class Mysql(MetaDatabase):
 
     @staticmethod
     async def get_column_info(database_url, table_name):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with engine.connect() as conn:
-            sql_str = f"""
-            SELECT column_name, column_type, column_comment  FROM information_schema.columns where TABLE_NAME='{table_name}';
+        async with EngineRegistry.connect(database_url) as conn:
+            sql_str = """
+            SELECT column_name, column_type, column_comment  FROM information_schema.columns where TABLE_NAME=:table_name;
             """
-            results = conn.execute(text(sql_str), {'table_name': table_name}).all()
+            results = (await conn.execute(text(sql_str), {'table_name': table_name})).all()
         column_info_list = []
         for result in results:
             column_info_list.append({'column_name': result[0], 'column_type': result[1], 'column_note': result[2]})
@@ -170,34 +185,63 @@ class Mysql(MetaDatabase):
 
     @staticmethod
     async def get_all_table_name_from_database_url(database_url):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with engine.connect() as connection:
-            result = connection.execute(text("SHOW TABLES"))
+        async with EngineRegistry.connect(database_url) as connection:
+            result = await connection.execute(text("SHOW TABLES"))
             table_name_list = [row[0] for row in result]
         return table_name_list
 
+    @staticmethod
+    async def get_row_count_estimate(conn, database_url, table_name):
+        """从information_schema.tables读取表的估算行数并缓存，没有统计信息时返回None"""
+        key = f'{EngineRegistry.get_key(database_url)}:{table_name}'
+        row_cnt = MetadataCache.get_row_count(key)
+        if row_cnt is None:
+            sql_str = """
+            SELECT TABLE_ROWS
+            FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = :table_name;
+            """
+            row = (await conn.execute(text(sql_str), {'table_name': table_name})).first()
+            row_cnt = int(row[0]) if row is not None and row[0] is not None else -1
+            MetadataCache.set_row_count(key, row_cnt)
+        return row_cnt if row_cnt >= 0 else None
+
     @staticmethod
     async def get_rand_data(database_url, table_name, cnt=10):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
+        """
+        随机抽取表中的数据
+        小表直接随机排序；大表有整数主键时在主键的取值范围内随机取点，按索引各读一行；否则取表的前若干行再随机挑选
+        """
         try:
-            with sessionmaker(engine)() as session:
-                sql_str = f'''SELECT * 
-                    FROM {table_name}
-                    ORDER BY RAND()
-                    LIMIT {cnt};'''
-                dataframe = str(session.execute(text(sql_str)).all())
+            async with EngineRegistry.connect(database_url) as conn:
+                row_cnt = await Mysql.get_row_count_estimate(conn, database_url, table_name)
+                if row_cnt is not None and row_cnt <= config['RAND_DATA_SMALL_TABLE_ROWS']:
+                    sql_str = f'''SELECT * 
+                        FROM {table_name}
+                        ORDER BY RAND()
+                        LIMIT {cnt};'''
+                    rows = (await conn.execute(text(sql_str))).all()
+                else:
+                    rows = []
+                    primary_key_info = await Mysql.get_primary_key_info(conn, table_name)
+                    if Mysql.is_integer_primary_key(primary_key_info):
+                        primary_key = primary_key_info[0][0]
+                        sql_str = f'SELECT MIN({primary_key}), MAX({primary_key}) FROM {table_name};'
+                        min_value, max_value = (await conn.execute(text(sql_str))).first()
+                        if min_value is not None:
+                            # 主键不连续时取点会落在空洞上，多取几个点后去重
+                            points = [random.randint(int(min_value), int(max_value)) for _ in range(cnt * 2)]
+                            sql_str = ' UNION ALL '.join(
+                                f'(SELECT * FROM {table_name} WHERE {primary_key} >= :point_{i} '
+                                f'ORDER BY {primary_key} LIMIT 1)' for i in range(len(points)))
+                            results = (await conn.execute(
+                                text(sql_str), {f'point_{i}': point for i, point in enumerate(points)})).all()
+                            rows = list({row._mapping[primary_key]: row for row in results}.values())
+                    if not rows:
+                        sql_str = f'SELECT * FROM {table_name} LIMIT {cnt * 10};'
+                        rows = (await conn.execute(text(sql_str))).all()
+                    rows = random.sample(rows, min(cnt, len(rows)))
+                dataframe = str(rows)
         except Exception as e:
             dataframe = ''
             logging.error(f'随机从数据库中获取数据失败由于{e}')
@@ -205,13 +249,28 @@ class Mysql(MetaDatabase):
 
     @staticmethod
     async def try_excute(database_url, sql_str):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with sessionmaker(engine)() as session:
-            result = session.execute(text(sql_str)).all()
+        async with EngineRegistry.connect(database_url) as conn:
+            result = (await conn.execute(text(sql_str))).all()
         return Mysql.result_to_json(result)
+
+    @staticmethod
+    async def explain_sql(database_url, sql_str):
+        """用EXPLAIN检查sql能否在目标数据库上执行，sql本身不会被执行"""
+        async with EngineRegistry.connect(database_url) as conn:
+            await conn.execute(text(f'EXPLAIN {sql_str.strip().rstrip(";")}'))
+
+    @staticmethod
+    async def stream_excute(database_url, sql_str, fetch_size):
+        """以服务端游标执行sql，先产出列名，再按批产出行，结果集不会整体读入内存"""
+        async with EngineRegistry.connect(database_url) as conn:
+            result = await conn.stream(text(sql_str))
+            completed = False
+            try:
+                yield list(result.keys())
+                async for rows in result.partitions(fetch_size):
+                    yield Mysql.result_to_json(rows)
+                completed = True
+            finally:
+                # 提前退出时关闭服务端游标会读完剩余的行，直接废弃连接，服务端随连接断开中止查询
+                if not completed:
+                    await conn.invalidate()
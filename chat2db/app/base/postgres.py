@@ -1,12 +1,13 @@
 import asyncio
-import asyncpg
-import concurrent.futures
 import logging
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, text
+import random
+from sqlalchemy import text
 import sys
 from concurrent.futures import ThreadPoolExecutor
 from chat2db.app.base.meta_databbase import MetaDatabase
+from chat2db.app.base.engine_registry import EngineRegistry
+from chat2db.app.base.metadata_cache import MetadataCache
+from chat2db.config.config import config
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                     format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
 
@@ -20,69 +21,43 @@ class Postgres(MetaDatabase):
 
     async def test_database_connection(database_url):
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(Postgres._connect_and_query, database_url)
-                result = future.result(timeout=5) 
-                return result
-        except concurrent.futures.TimeoutError:
+            return await asyncio.wait_for(EngineRegistry.ping(database_url), timeout=5)
+        except asyncio.TimeoutError:
             logging.error('postgres数据库连接超时')
+            await EngineRegistry.dispose(database_url)
             return False
         except Exception as e:
             logging.error(f'postgres数据库连接失败由于{e}')
+            await EngineRegistry.dispose(database_url)
             return False
 
-    @staticmethod
-    def _connect_and_query(database_url):
-        try:
-            engine = create_engine(
-                database_url,
-                pool_size=20,
-                max_overflow=80,
-                pool_recycle=300,
-                pool_pre_ping=True
-            )
-            session = sessionmaker(bind=engine)()
-            session.execute(text("SELECT 1"))
-            session.close()
-            return True
-        except Exception as e:
-            raise e
-
     @staticmethod
     async def drop_table(database_url, table_name):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with sessionmaker(engine)() as session:
+        async with EngineRegistry.begin(database_url) as conn:
             sql_str = f"DROP TABLE IF EXISTS {table_name};"
-            session.execute(text(sql_str))
+            await conn.execute(text(sql_str))
 
     @staticmethod
     async def select_primary_key_and_keyword_from_table(database_url, table_name, keyword):
         try:
-            dsn = database_url.replace('+psycopg2', '')
-            conn = await asyncpg.connect(dsn=dsn)
-            primary_key_query = """
-            SELECT 
-                kcu.column_name
-            FROM 
-                information_schema.table_constraints AS tc
-                JOIN information_schema.key_column_usage AS kcu
-                    ON tc.constraint_name = kcu.constraint_name
-            WHERE 
-                tc.constraint_type = 'PRIMARY KEY'
-                AND tc.table_name = $1;
-            """
-            primary_key_list = await conn.fetch(primary_key_query, table_name)
-            if not primary_key_list:
-                return []
-            columns = ', '.join([record['column_name'] for record in primary_key_list]) + f', {keyword}'
-            query = f'SELECT {columns} FROM {table_name};'
-            results = await conn.fetch(query)
+            async with EngineRegistry.connect(database_url) as conn:
+                primary_key_query = """
+                SELECT 
+                    kcu.column_name
+                FROM 
+                    information_schema.table_constraints AS tc
+                    JOIN information_schema.key_column_usage AS kcu
+                        ON tc.constraint_name = kcu.constraint_name
+                WHERE 
+                    tc.constraint_type = 'PRIMARY KEY'
+                    AND tc.table_name = :table_name;
+                """
+                primary_key_list = (await conn.execute(text(primary_key_query), {'table_name': table_name})).all()
+                if not primary_key_list:
+                    return []
+                columns = ', '.join([record[0] for record in primary_key_list]) + f', {keyword}'
+                query = f'SELECT {columns} FROM {table_name};'
+                results = (await conn.execute(text(query))).all()
 
             def _process_results(results, primary_key_list):
                 tmp_dict = {}
@@ -94,7 +69,7 @@ class Postgres(MetaDatabase):
                     tmp_dict[key].append(pk_values)
 
                 return {
-                    'primary_key_list': [record['column_name'] for record in primary_key_list],
+                    'primary_key_list': [record[0] for record in primary_key_list],
                     'keyword_value_dict': tmp_dict
                 }
             result = await asyncio.get_event_loop().run_in_executor(
@@ -103,13 +78,74 @@ class Postgres(MetaDatabase):
                 results,
                 primary_key_list
             )
-            await conn.close()
 
             return result
         except Exception as e:
             logging.error(f'postgres数据检索失败由于 {e}')
         return None
 
+    @staticmethod
+    async def get_page_checksums(database_url, table_name, column_name_list, page_size):
+        """
+        按主键分页计算每个关键词列的校验和，用于关键词索引的增量刷新
+        表只有一个整数主键时按主键范围分页，否则整张表视为一页，表没有主键时返回None
+        """
+        async with EngineRegistry.connect(database_url) as conn:
+            primary_key_query = """
+            SELECT
+                kcu.column_name, c.data_type
+            FROM
+                information_schema.table_constraints AS tc
+                JOIN information_schema.key_column_usage AS kcu
+                    ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema
+                JOIN information_schema.columns AS c
+                    ON c.table_schema = kcu.table_schema AND c.table_name = kcu.table_name
+                    AND c.column_name = kcu.column_name
+            WHERE
+                tc.constraint_type = 'PRIMARY KEY'
+                AND tc.table_name = :table_name
+            ORDER BY kcu.ordinal_position;
+            """
+            primary_key_info = (await conn.execute(text(primary_key_query), {'table_name': table_name})).all()
+            if not primary_key_info:
+                return None
+            primary_key_list = [record[0] for record in primary_key_info]
+            if len(primary_key_info) == 1 and primary_key_info[0][1] in ('smallint', 'integer', 'bigint'):
+                page_expression = f'FLOOR({primary_key_list[0]}::numeric / {int(page_size)})::bigint'
+            else:
+                page_size = None
+                page_expression = '0'
+            primary_key_names = ', '.join(primary_key_list)
+            checksum_expressions = [
+                f"COUNT(*)::text || '-' || md5(string_agg(ROW({primary_key_names}, {column_name})::text, ',' "
+                f"ORDER BY {primary_key_names}))"
+                for column_name in column_name_list]
+            sql_str = f'SELECT {page_expression} AS page, {", ".join(checksum_expressions)} FROM {table_name} GROUP BY 1;'
+            results = (await conn.execute(text(sql_str))).all()
+        checksums = {column_name: {} for column_name in column_name_list}
+        for row in results:
+            for i, column_name in enumerate(column_name_list):
+                checksums[column_name][str(row[0])] = row[i + 1]
+        return {'primary_key_list': primary_key_list, 'page_size': page_size, 'checksums': checksums}
+
+    @staticmethod
+    async def select_keyword_by_pages(database_url, table_name, primary_key, column_name_list, page_size, page_list):
+        """读取指定页内各行的主键和关键词列，返回[(主键值, [列值, ...]), ...]"""
+        page_ranges = Postgres.get_page_ranges(page_list)
+        columns = ', '.join([primary_key] + column_name_list)
+        results = []
+        async with EngineRegistry.connect(database_url) as conn:
+            for i in range(0, len(page_ranges), Postgres.max_page_range_cnt):
+                conditions = []
+                params = {}
+                for j, (start_page, end_page) in enumerate(page_ranges[i:i + Postgres.max_page_range_cnt]):
+                    conditions.append(f'({primary_key} >= :start_{j} AND {primary_key} < :end_{j})')
+                    params[f'start_{j}'] = start_page * page_size
+                    params[f'end_{j}'] = (end_page + 1) * page_size
+                sql_str = f'SELECT {columns} FROM {table_name} WHERE {" OR ".join(conditions)};'
+                results += (await conn.execute(text(sql_str), params)).all()
+        return [(str(row[0]), [str(value) for value in row[1:]]) for row in results]
+
     @staticmethod
     async def assemble_sql_query_base_on_primary_key(table_name, primary_key_list, primary_key_value_list):
         sql_str = f'SELECT * FROM {table_name} where '
@@ -122,14 +158,7 @@ class Postgres(MetaDatabase):
 
     @staticmethod
     async def get_table_info(database_url, table_name):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with engine.connect() as conn:
+        async with EngineRegistry.connect(database_url) as conn:
             sql_str = """
             SELECT
                 d.description AS table_description
@@ -141,7 +170,7 @@ class Postgres(MetaDatabase):
                     t.relkind = 'r' AND
                     d.objsubid = 0 AND
                     t.relname = :table_name; """
-            result = conn.execute(text(sql_str), {'table_name': table_name}).one_or_none()
+            result = (await conn.execute(text(sql_str), {'table_name': table_name})).one_or_none()
             if result is None:
                 table_note = table_name
             else:
@@ -154,14 +183,7 @@ class Postgres(MetaDatabase):
 
     @staticmethod
     async def get_column_info(database_url, table_name):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with engine.connect() as conn:
+        async with EngineRegistry.connect(database_url) as conn:
             sql_str = """
             SELECT
             a.attname as 字段名,
@@ -176,7 +198,7 @@ class Postgres(MetaDatabase):
             and
             c.relname = :table_name;
             """
-            results = conn.execute(text(sql_str), {'table_name': table_name}).all()
+            results = (await conn.execute(text(sql_str), {'table_name': table_name})).all()
         column_info_list = []
         for result in results:
             column_info_list.append({'column_name': result[0], 'column_type': result[1], 'column_note': result[2]})
@@ -184,39 +206,60 @@ class Postgres(MetaDatabase):
 
     @staticmethod
     async def get_all_table_name_from_database_url(database_url):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with engine.connect() as connection:
+        async with EngineRegistry.connect(database_url) as connection:
             sql_str = '''
             SELECT table_name 
             FROM information_schema.tables 
             WHERE table_schema = 'public';
             '''
-            result = connection.execute(text(sql_str))
+            result = await connection.execute(text(sql_str))
             table_name_list = [row[0] for row in result]
         return table_name_list
 
+    @staticmethod
+    async def get_row_count_estimate(conn, database_url, table_name):
+        """从pg_class读取表的估算行数并缓存，表没有统计信息时返回None"""
+        key = f'{EngineRegistry.get_key(database_url)}:{table_name}'
+        row_cnt = MetadataCache.get_row_count(key)
+        if row_cnt is None:
+            sql_str = """
+            SELECT c.reltuples
+            FROM pg_class c
+            WHERE c.relname = :table_name AND c.relkind IN ('r', 'p') AND pg_table_is_visible(c.oid);
+            """
+            row = (await conn.execute(text(sql_str), {'table_name': table_name})).first()
+            row_cnt = int(row[0]) if row is not None and row[0] is not None and row[0] > 0 else -1
+            MetadataCache.set_row_count(key, row_cnt)
+        return row_cnt if row_cnt >= 0 else None
+
     @staticmethod
     async def get_rand_data(database_url, table_name, cnt=10):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
+        """
+        随机抽取表中的数据
+        小表直接随机排序；大表按估算行数用TABLESAMPLE抽样，不做全表排序；没有统计信息时取表的前若干行再随机挑选
+        """
         try:
-            with sessionmaker(engine)() as session:
-                sql_str = f'''SELECT * 
-                    FROM {table_name}
-                    ORDER BY RANDOM()
-                    LIMIT {cnt};'''
-                dataframe = str(session.execute(text(sql_str)).all())
+            async with EngineRegistry.connect(database_url) as conn:
+                row_cnt = await Postgres.get_row_count_estimate(conn, database_url, table_name)
+                if row_cnt is not None and row_cnt <= config['RAND_DATA_SMALL_TABLE_ROWS']:
+                    sql_str = f'''SELECT * 
+                        FROM {table_name}
+                        ORDER BY RANDOM()
+                        LIMIT {cnt};'''
+                    rows = (await conn.execute(text(sql_str))).all()
+                else:
+                    rows = []
+                    if row_cnt is not None:
+                        # 多抽样几倍，数据页中行数不均时也能取够
+                        percent = min(100.0, cnt * 10 * 100.0 / row_cnt)
+                        method = 'BERNOULLI' if row_cnt <= config['RAND_DATA_BERNOULLI_MAX_ROWS'] else 'SYSTEM'
+                        sql_str = f'SELECT * FROM {table_name} TABLESAMPLE {method} ({percent:.6f}) LIMIT {cnt * 10};'
+                        rows = (await conn.execute(text(sql_str))).all()
+                    if not rows:
+                        sql_str = f'SELECT * FROM {table_name} LIMIT {cnt * 10};'
+                        rows = (await conn.execute(text(sql_str))).all()
+                    rows = random.sample(rows, min(cnt, len(rows)))
+                dataframe = str(rows)
         except Exception as e:
             dataframe = ''
             logging.error(f'随机从数据库中获取数据失败由于{e}')
@@ -224,13 +267,21 @@ class Postgres(MetaDatabase):
 
     @staticmethod
     async def try_excute(database_url, sql_str):
-        engine = create_engine(
-            database_url,
-            pool_size=20,
-            max_overflow=80,
-            pool_recycle=300,
-            pool_pre_ping=True
-        )
-        with sessionmaker(engine)() as session:
-            result=session.execute(text(sql_str)).all()
+        async with EngineRegistry.connect(database_url) as conn:
+            result = (await conn.execute(text(sql_str))).all()
         return Postgres.result_to_json(result)
+
+    @staticmethod
+    async def explain_sql(database_url, sql_str):
+        """用EXPLAIN检查sql能否在目标数据库上执行，sql本身不会被执行"""
+        async with EngineRegistry.connect(database_url) as conn:
+            await conn.execute(text(f'EXPLAIN {sql_str.strip().rstrip(";")}'))
+
+    @staticmethod
+    async def stream_excute(database_url, sql_str, fetch_size):
+        """以服务端游标执行sql，先产出列名，再按批产出行，结果集不会整体读入内存"""
+        async with EngineRegistry.connect(database_url) as conn:
+            result = await conn.stream(text(sql_str))
+            yield list(result.keys())
+            async for rows in result.partitions(fetch_size):
+                yield Postgres.result_to_json(rows)
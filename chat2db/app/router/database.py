@@ -11,6 +11,8 @@ from chat2db.manager.database_info_manager import DatabaseInfoManager
 from chat2db.manager.table_info_manager import TableInfoManager
 from chat2db.manager.column_info_manager import ColumnInfoManager
 from chat2db.app.service.diff_database_service import DiffDatabaseService
+from chat2db.app.base.engine_registry import EngineRegistry
+from chat2db.app.base.metadata_cache import MetadataCache
 from chat2db.app.service.sql_generate_service import SqlGenerateService
 from chat2db.app.service.keyword_service import keyword_service
 from chat2db.app.base.vectorize import Vectorize
@@ -59,9 +61,17 @@ async def del_database_info(request: DatabaseDelRequest):
     database_id = request.database_id
     database_url = request.database_url
     if database_id:
+        database_url = await DatabaseInfoManager.get_database_url_by_id(database_id)
         flag = await DatabaseInfoManager.del_database_by_id(database_id)
     else:
+        database_id = await DatabaseInfoManager.get_database_id_by_url(database_url)
         flag = await DatabaseInfoManager.del_database_by_url(database_url)
+    if database_id:
+        MetadataCache.invalidate_database(database_id)
+    if flag and database_id:
+        await keyword_service.drop_database(database_id)
+    if flag and database_url:
+        await EngineRegistry.dispose(database_url)
     if not flag:
         return ResponseData(
             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
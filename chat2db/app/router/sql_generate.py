@@ -2,14 +2,16 @@
 
 import logging
 from fastapi import APIRouter, status
+from fastapi.responses import StreamingResponse
 import sys
 
 from chat2db.manager.database_info_manager import DatabaseInfoManager
 from chat2db.manager.table_info_manager import TableInfoManager
 from chat2db.manager.column_info_manager import ColumnInfoManager
 from chat2db.model.request import SqlGenerateRequest, SqlRepairRequest, SqlExcuteRequest
-from chat2db.model.response import ResponseData
+from chat2db.model.response import ResponseData, SqlExcuteResponseData
 from chat2db.app.service.sql_generate_service import SqlGenerateService
+from chat2db.app.service.sql_execute_service import SqlExecuteService
 from chat2db.app.service.keyword_service import keyword_service
 from chat2db.app.service.diff_database_service import DiffDatabaseService
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
@@ -60,20 +62,20 @@ async def repair_sql(request: SqlRepairRequest):
             message="当前数据库配置不存在",
             result={}
         )
-    table_info = await TableInfoManager.get_table_info_by_table_id(table_id)
-    if table_info is None:
+    table_schema = await SqlGenerateService.get_table_schema(table_id)
+    if table_schema is None:
         return ResponseData(
             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             message="表格不存在",
             result={}
         )
+    table_info, column_info_list, _ = table_schema
     if table_info['database_id'] != database_id:
         return ResponseData(
             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             message="表格不属于当前数据库",
             result={}
         )
-    column_info_list = await ColumnInfoManager.get_column_info_by_table_id(table_id)
     sql = request.sql
     message = request.message
     question = request.question
@@ -95,7 +97,7 @@ async def repair_sql(request: SqlRepairRequest):
     )
 
 
-@router.post("/execute", response_model=ResponseData)
+@router.post("/execute", response_model=SqlExcuteResponseData)
 async def execute_sql(request: SqlExcuteRequest):
     database_id = request.database_id
     sql = request.sql
@@ -106,9 +108,11 @@ async def execute_sql(request: SqlExcuteRequest):
             message="当前数据库配置不存在",
             result={}
         )
-    database_type = DiffDatabaseService.get_database_type_from_url(database_url)
     try:
-        results = await DiffDatabaseService.database_map[database_type].try_excute(database_url, sql)
+        if request.stream:
+            lines = await SqlExecuteService.execute_ndjson(database_url, sql, request.offset, request.limit)
+            return StreamingResponse(lines, media_type='application/x-ndjson')
+        results, end = await SqlExecuteService.execute(database_url, sql, request.offset, request.limit)
     except Exception as e:
         import traceback
         logging.error(f'sql执行失败由于{traceback.format_exc()}')
@@ -117,8 +121,11 @@ async def execute_sql(request: SqlExcuteRequest):
             message="sql执行失败",
             result={'Error': str(e)}
         )
-    return ResponseData(
+    return SqlExcuteResponseData(
         code=status.HTTP_200_OK,
-        message="sql执行成功",
-        result=results
+        message="sql执行成功，结果超出上限已截断" if end['truncated'] else "sql执行成功",
+        result=results,
+        truncated=end['truncated'],
+        truncated_reason=end['truncated_reason'],
+        next_offset=end['next_offset']
     )
@@ -13,6 +13,7 @@ from chat2db.manager.column_info_manager import ColumnInfoManager
 from chat2db.app.service.diff_database_service import DiffDatabaseService
 from chat2db.app.base.vectorize import Vectorize
 from chat2db.app.service.keyword_service import keyword_service
+from chat2db.app.base.metadata_cache import MetadataCache
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                     format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
 
@@ -63,6 +64,8 @@ async def add_database_info(request: TableAddRequest):
             table_id, column_info['column_name'],
             column_info['column_type'],
             column_info['column_note'])
+    # 列信息写入完成后再失效，避免并发请求缓存不完整的表结构
+    MetadataCache.invalidate_database(database_id)
     return ResponseData(
         code=status.HTTP_200_OK,
         message="success",
@@ -74,6 +77,7 @@ async def add_database_info(request: TableAddRequest):
 async def del_table_info(request: TableDelRequest):
     table_id = request.table_id
     flag = await TableInfoManager.del_table_by_id(table_id)
+    MetadataCache.invalidate_table(table_id)
     if not flag:
         return ResponseData(
             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -128,6 +132,7 @@ async def enable_column(request: EnableColumnRequest):
     column_info = await ColumnInfoManager.get_column_info_by_column_id(column_id)
     column_name = column_info['column_name']
     table_id = column_info['table_id']
+    MetadataCache.invalidate_table(table_id)
     table_info = await TableInfoManager.get_table_info_by_table_id(table_id)
     database_id = table_info['database_id']
     if enable:
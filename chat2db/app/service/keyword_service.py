@@ -1,12 +1,12 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
 import asyncio
-import copy
-import uuid
+import os
 import sys
-import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
+from chat2db.config.config import config
 from chat2db.app.service.diff_database_service import DiffDatabaseService
-from chat2db.app.base.ac_automation import DictTree
+from chat2db.app.base.ac_automation import KeywordIndex
 from chat2db.manager.database_info_manager import DatabaseInfoManager
 from chat2db.manager.table_info_manager import TableInfoManager
 from chat2db.manager.column_info_manager import ColumnInfoManager
@@ -17,115 +17,445 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO,
 
 
 class KeywordManager():
+    """
+    关键词检索
+    每张表的已启用列共享一个单表索引，同一数据库的单表索引再合并为一个只读的数据库索引，问题只需扫描一遍
+    索引在线程池中构建，保存到磁盘后以内存映射方式加载
+    索引字典只在事件循环中整体替换(写时复制)，检索时不加锁
+    单表索引记录各关键词列按主键分页的校验和，定时刷新时只重新读取校验和变化的页
+    """
+
     def __init__(self):
+        # 数据库ID -> 表ID -> 单表索引，用于增删列时重建和合并
+        self.table_index_dict = {}
+        # 数据库ID -> 合并后的数据库索引，供检索使用
         self.keyword_asset_dict = {}
-        self.lock = threading.Lock()
-        self.data_frame_dict = {}
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        # 同一张表的索引重建串行执行，避免并发增删列时互相覆盖
+        self.table_locks = {}
+        self.database_locks = {}
+        # 等待合并的数据库，合并开始前再次触发的合并请求直接复用
+        self.merge_pending = set()
+        # 数据库ID -> 上次刷新时间，同一数据库两次刷新的间隔不小于KEYWORD_REFRESH_MIN_INTERVAL
+        self.refresh_time = {}
+        self.background_tasks = set()
+
+    @staticmethod
+    def get_index_path(database_id, table_id):
+        return os.path.join(config['KEYWORD_INDEX_PATH'], str(database_id), str(table_id))
+
+    @staticmethod
+    def get_merged_index_path(database_id):
+        return os.path.join(config['KEYWORD_INDEX_PATH'], str(database_id), '_merged')
+
+    @staticmethod
+    def get_lock(locks, key):
+        if key not in locks:
+            locks[key] = asyncio.Lock()
+        return locks[key]
+
+    def get_table_index(self, database_id, table_id):
+        return self.table_index_dict.get(str(database_id), {}).get(str(table_id))
+
+    def set_table_index(self, database_id, table_id, keyword_index):
+        database_id = str(database_id)
+        table_index_dict = dict(self.table_index_dict.get(database_id, {}))
+        if keyword_index is None:
+            table_index_dict.pop(str(table_id), None)
+        else:
+            table_index_dict[str(table_id)] = keyword_index
+        self.table_index_dict = {**self.table_index_dict, database_id: table_index_dict}
+
+    def set_database_index(self, database_id, keyword_index):
+        keyword_asset_dict = dict(self.keyword_asset_dict)
+        if keyword_index is None:
+            keyword_asset_dict.pop(str(database_id), None)
+        else:
+            keyword_asset_dict[str(database_id)] = keyword_index
+        self.keyword_asset_dict = keyword_asset_dict
+
+    def run_in_background(self, coro):
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    @staticmethod
+    async def fetch_column_values(database_id, table_name, column_name):
+        """从目标数据库读取列中每个取值对应的主键值"""
+        database_url = await DatabaseInfoManager.get_database_url_by_id(database_id)
+        database_type = DiffDatabaseService.get_database_type_from_url(database_url)
+        tmp_dict = await DiffDatabaseService.get_database_service(
+            database_type).select_primary_key_and_keyword_from_table(database_url, table_name, column_name)
+        del database_url
+        return tmp_dict
+
+    @staticmethod
+    async def get_page_checksums(database_id, table_name, column_name_list):
+        """获取各关键词列的分页校验和，失败时返回None，之后的刷新会整表重新读取"""
+        try:
+            database_url = await DatabaseInfoManager.get_database_url_by_id(database_id)
+            database_type = DiffDatabaseService.get_database_type_from_url(database_url)
+            return await DiffDatabaseService.get_database_service(database_type).get_page_checksums(
+                database_url, table_name, column_name_list, config['KEYWORD_REFRESH_PAGE_SIZE'])
+        except Exception as e:
+            logging.error(f'关键字列校验和获取失败由于{e}')
+            return None
+
+    @staticmethod
+    def patch_and_save(path, keyword_index, tables, column_name_list, changed_pages, rows):
+        """去掉变化页内的旧行，加入重新读取的行，再构建并保存单表索引"""
+        table_id = next(iter(tables))
+        page_size = tables[table_id]['refresh']['page_size']
+        column_values = {}
+        for group, keyword_value_dict in keyword_index.to_column_values().items():
+            column_values[group] = {}
+            for keyword, primary_key_value_list in keyword_value_dict.items():
+                primary_key_value_list = [primary_key_values for primary_key_values in primary_key_value_list
+                                          if int(primary_key_values[0]) // page_size not in changed_pages]
+                if primary_key_value_list:
+                    column_values[group][keyword] = primary_key_value_list
+        for primary_key_value, values in rows:
+            for column_name, value in zip(column_name_list, values):
+                column_values.setdefault((table_id, column_name), {}).setdefault(value, []).append([primary_key_value])
+        return KeywordManager.build_and_save(path, tables, column_values)
+
+    @staticmethod
+    def build_and_save(path, tables, column_values):
+        keyword_index = KeywordIndex.build(tables, column_values)
+        keyword_index.save(path)
+        del keyword_index
+        # 重新以内存映射方式加载，构建时占用的内存随之释放
+        return KeywordIndex.load(path)
+
+    @staticmethod
+    def merge_and_save(path, index_list):
+        keyword_index = KeywordIndex.merge(index_list)
+        keyword_index.save(path)
+        del keyword_index
+        return KeywordIndex.load(path)
+
+    async def rebuild_table(self, database_id, table_id, table_info, column_values, primary_key_list, refresh=None):
+        path = KeywordManager.get_index_path(database_id, table_id)
+        if not column_values:
+            await asyncio.get_running_loop().run_in_executor(self.executor, KeywordIndex.remove, path)
+            self.set_table_index(database_id, table_id, None)
+            return
+        tables = {str(table_id): {'table_name': table_info['table_name'], 'primary_key_list': primary_key_list}}
+        if refresh is not None:
+            tables[str(table_id)]['refresh'] = refresh
+        keyword_index = await asyncio.get_running_loop().run_in_executor(
+            self.executor, KeywordManager.build_and_save, path, tables, column_values)
+        self.set_table_index(database_id, table_id, keyword_index)
+
+    async def merge_database(self, database_id):
+        """合并数据库下所有单表索引并替换数据库索引"""
+        database_id = str(database_id)
+        if database_id in self.merge_pending:
+            return
+        self.merge_pending.add(database_id)
+        async with KeywordManager.get_lock(self.database_locks, database_id):
+            # 在取单表索引之前移出，之后的变更会再触发一次合并
+            self.merge_pending.discard(database_id)
+            index_list = list(self.table_index_dict.get(database_id, {}).values())
+            path = KeywordManager.get_merged_index_path(database_id)
+            try:
+                if not index_list:
+                    await asyncio.get_running_loop().run_in_executor(self.executor, KeywordIndex.remove, path)
+                    self.set_database_index(database_id, None)
+                    return
+                keyword_index = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, KeywordManager.merge_and_save, path, index_list)
+                self.set_database_index(database_id, keyword_index)
+            except Exception as e:
+                logging.error(f'关键字索引合并失败由于{e}')
+
+    async def load_merged(self, database_id):
+        """合并快照的来源与当前单表索引一致时直接加载，否则重新合并"""
+        sources = {table_id: keyword_index.meta.get('build_id')
+                   for table_id, keyword_index in self.table_index_dict.get(str(database_id), {}).items()}
+        if sources:
+            try:
+                keyword_index = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, KeywordIndex.load, KeywordManager.get_merged_index_path(database_id))
+                if keyword_index.meta.get('sources') == sources:
+                    self.set_database_index(database_id, keyword_index)
+                    return
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.error(f'关键字索引快照加载失败由于{e}')
+        await self.merge_database(database_id)
+
+    async def load_table(self, database_id, table_id, column_name_list):
+        """优先加载磁盘上的快照，快照缺失或列不一致时从目标数据库重建"""
+        path = KeywordManager.get_index_path(database_id, table_id)
+        try:
+            keyword_index = await asyncio.get_running_loop().run_in_executor(self.executor, KeywordIndex.load, path)
+            if set(keyword_index.get_columns(table_id)) == set(column_name_list):
+                self.set_table_index(database_id, table_id, keyword_index)
+                return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f'关键字索引快照加载失败由于{e}')
+        table_info = await TableInfoManager.get_table_info_by_table_id(table_id)
+        async with KeywordManager.get_lock(self.table_locks, str(table_id)):
+            await self.reload_table(database_id, table_id, table_info, column_name_list)
+
+    async def reload_table(self, database_id, table_id, table_info, column_name_list):
+        """从目标数据库重新读取所有已启用列，读取前记录的校验和作为之后增量刷新的基线"""
+        refresh = await KeywordManager.get_page_checksums(database_id, table_info['table_name'], column_name_list)
+        column_values = {}
+        primary_key_list = []
+        for column_name in column_name_list:
+            tmp_dict = await KeywordManager.fetch_column_values(database_id, table_info['table_name'], column_name)
+            if not tmp_dict:
+                continue
+            primary_key_list = tmp_dict['primary_key_list']
+            column_values[(str(table_id), column_name)] = tmp_dict['keyword_value_dict']
+        await self.rebuild_table(database_id, table_id, table_info, column_values, primary_key_list, refresh)
+
+    async def refresh_table(self, database_id, table_id, keyword_index):
+        """
+        增量刷新单表索引，返回索引是否变化
+        与上次的分页校验和比较，只重新读取变化的页；没有基线、主键不是单个整数或变化的页超过一半时整表重新读取
+        """
+        table_meta = keyword_index.meta['tables'][str(table_id)]
+        table_info = {'table_name': table_meta['table_name']}
+        column_name_list = keyword_index.get_columns(table_id)
+        old_refresh = table_meta.get('refresh')
+        refresh = await KeywordManager.get_page_checksums(database_id, table_info['table_name'], column_name_list)
+        if refresh is None:
+            return False
+        comparable = (old_refresh is not None and old_refresh['page_size'] == refresh['page_size']
+                      and old_refresh['primary_key_list'] == refresh['primary_key_list']
+                      and all(column_name in old_refresh['checksums'] for column_name in column_name_list))
+        if comparable:
+            page_set = set()
+            changed_pages = set()
+            for column_name in column_name_list:
+                old_checksums = old_refresh['checksums'][column_name]
+                checksums = refresh['checksums'][column_name]
+                for page in set(old_checksums) | set(checksums):
+                    page_set.add(page)
+                    if old_checksums.get(page) != checksums.get(page):
+                        changed_pages.add(page)
+            if not changed_pages:
+                return False
+            if refresh['page_size'] is not None and len(changed_pages) * 2 <= len(page_set):
+                database_url = await DatabaseInfoManager.get_database_url_by_id(database_id)
+                database_type = DiffDatabaseService.get_database_type_from_url(database_url)
+                rows = await DiffDatabaseService.get_database_service(database_type).select_keyword_by_pages(
+                    database_url, table_info['table_name'], refresh['primary_key_list'][0], column_name_list,
+                    refresh['page_size'], [int(page) for page in changed_pages])
+                del database_url
+                tables = {str(table_id): {**table_meta, 'refresh': refresh}}
+                keyword_index = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, KeywordManager.patch_and_save, KeywordManager.get_index_path(database_id, table_id),
+                    keyword_index, tables, column_name_list, {int(page) for page in changed_pages}, rows)
+                self.set_table_index(database_id, table_id, keyword_index)
+                logging.info(f'关键字索引增量刷新完成，重新读取{len(changed_pages)}页')
+                return True
+        await self.reload_table(database_id, table_id, table_info, column_name_list)
+        return True
 
     async def load_keywords(self):
         database_info_list = await DatabaseInfoManager.get_all_database_info()
         for database_info in database_info_list:
             database_id = database_info['database_id']
             table_info_list = await TableInfoManager.get_table_info_by_database_id(database_id)
-            cnt=0
             for table_info in table_info_list:
                 table_id = table_info['table_id']
                 column_info_list = await ColumnInfoManager.get_column_info_by_table_id(table_id, True)
-                for i in range(len(column_info_list)):
-                    column_info = column_info_list[i]
-                    cnt+=1
-                    try:
-                        column_name = column_info['column_name']
-                        await self.add(database_id, table_id, column_name)
-                    except Exception as e:
-                        logging.error('关键字数据结构生成失败')
-    def add_excutor(self, rd_id, database_id, table_id, table_info, column_info_list, column_name):
-        tmp_dict = self.data_frame_dict[rd_id]
-        tmp_dict_tree = DictTree()
-        tmp_dict_tree.load_data(tmp_dict['keyword_value_dict'])
-        if database_id not in self.keyword_asset_dict.keys():
-            self.keyword_asset_dict[database_id] = {}
-        with self.lock:
-            if table_id not in self.keyword_asset_dict[database_id].keys():
-                self.keyword_asset_dict[database_id][table_id] = {}
-                self.keyword_asset_dict[database_id][table_id]['table_info'] = table_info
-                self.keyword_asset_dict[database_id][table_id]['column_info_list'] = column_info_list
-                self.keyword_asset_dict[database_id][table_id]['primary_key_list'] = copy.deepcopy(
-                    tmp_dict['primary_key_list'])
-                self.keyword_asset_dict[database_id][table_id]['dict_tree_dict'] = {}
-            self.keyword_asset_dict[database_id][table_id]['dict_tree_dict'][column_name] = tmp_dict_tree
-        del self.data_frame_dict[rd_id]
+                if not column_info_list:
+                    continue
+                try:
+                    await self.load_table(
+                        database_id, table_id, [column_info['column_name'] for column_info in column_info_list])
+                except Exception as e:
+                    logging.error(f'关键字数据结构生成失败由于{e}')
+            await self.load_merged(database_id)
+
+    async def add_excutor(self, database_id, table_id, table_info, column_name, tmp_dict, refresh):
+        async with KeywordManager.get_lock(self.table_locks, str(table_id)):
+            try:
+                keyword_index = self.get_table_index(database_id, table_id)
+                column_values = keyword_index.to_column_values() if keyword_index is not None else {}
+                column_values[(str(table_id), column_name)] = tmp_dict['keyword_value_dict']
+                # 其余列沿用原有的校验和，只有新启用的列需要新的基线
+                old_refresh = None
+                if keyword_index is not None:
+                    old_refresh = keyword_index.meta['tables'][str(table_id)].get('refresh')
+                if refresh is not None and old_refresh is not None and \
+                        old_refresh['page_size'] == refresh['page_size'] and \
+                        old_refresh['primary_key_list'] == refresh['primary_key_list']:
+                    refresh = {**refresh, 'checksums': {**old_refresh['checksums'], **refresh['checksums']}}
+                await self.rebuild_table(
+                    database_id, table_id, table_info, column_values, tmp_dict['primary_key_list'], refresh)
+            except Exception as e:
+                logging.error(f'关键字索引构建失败由于{e}')
+                return
+        await self.merge_database(database_id)
 
     async def add(self, database_id, table_id, column_name):
-        database_url = await DatabaseInfoManager.get_database_url_by_id(database_id)
-        database_type = DiffDatabaseService.get_database_type_from_url(database_url)
         table_info = await TableInfoManager.get_table_info_by_table_id(table_id)
         table_name = table_info['table_name']
-        tmp_dict = await DiffDatabaseService.get_database_service(
-            database_type).select_primary_key_and_keyword_from_table(database_url, table_name, column_name)
-        if tmp_dict is None:
-            return
-        rd_id = str(uuid.uuid4)
-        self.data_frame_dict[rd_id] = tmp_dict
-        del database_url
-        column_info_list = await ColumnInfoManager.get_column_info_by_table_id(table_id)
+        refresh = await KeywordManager.get_page_checksums(database_id, table_name, [column_name])
+        tmp_dict = await KeywordManager.fetch_column_values(database_id, table_name, column_name)
+        if not tmp_dict:
+            return False
         try:
-            thread = threading.Thread(target=self.add_excutor, args=(rd_id, database_id, table_id,
-                                      table_info, column_info_list, column_name,))
-            thread.start()
+            self.run_in_background(
+                self.add_excutor(database_id, table_id, table_info, column_name, tmp_dict, refresh))
         except Exception as e:
-            logging.error(f'创建增加线程失败由于{e}')
+            logging.error(f'创建增加任务失败由于{e}')
+            return False
+        return True
+
+    async def refresh_database(self, database_id):
+        """
+        刷新数据库下所有表的关键词索引，返回是否刷新
+        同一数据库在KEYWORD_REFRESH_MIN_INTERVAL内只刷新一次，各表依次刷新，任一表变化后重新合并
+        """
+        now = time.monotonic()
+        last_refresh_time = self.refresh_time.get(str(database_id))
+        if last_refresh_time is not None and now - last_refresh_time < config['KEYWORD_REFRESH_MIN_INTERVAL']:
             return False
+        self.refresh_time[str(database_id)] = now
+        changed = False
+        table_id_set = set()
+        table_info_list = await TableInfoManager.get_table_info_by_database_id(database_id)
+        for table_info in table_info_list:
+            table_id = table_info['table_id']
+            column_info_list = await ColumnInfoManager.get_column_info_by_table_id(table_id, True)
+            column_name_list = [column_info['column_name'] for column_info in column_info_list]
+            if not column_name_list:
+                continue
+            table_id_set.add(str(table_id))
+            try:
+                async with KeywordManager.get_lock(self.table_locks, str(table_id)):
+                    keyword_index = self.get_table_index(database_id, table_id)
+                    if keyword_index is None or set(keyword_index.get_columns(table_id)) != set(column_name_list):
+                        await self.reload_table(database_id, table_id, table_info, column_name_list)
+                        changed = True
+                    else:
+                        changed = await self.refresh_table(database_id, table_id, keyword_index) or changed
+            except Exception as e:
+                logging.error(f'关键字索引刷新失败由于{e}')
+        # 表已删除或已没有启用的列
+        for table_id in set(self.table_index_dict.get(str(database_id), {})) - table_id_set:
+            async with KeywordManager.get_lock(self.table_locks, table_id):
+                await self.rebuild_table(database_id, table_id, None, {}, [])
+            changed = True
+        if changed:
+            await self.merge_database(database_id)
         return True
 
+    async def drop_database(self, database_id):
+        """数据库配置删除后移除其关键词索引"""
+        database_id = str(database_id)
+        table_index_dict = dict(self.table_index_dict)
+        table_index_dict.pop(database_id, None)
+        self.table_index_dict = table_index_dict
+        self.set_database_index(database_id, None)
+        self.refresh_time.pop(database_id, None)
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor, KeywordIndex.remove, os.path.join(config['KEYWORD_INDEX_PATH'], database_id))
+
     async def update_keyword_asset(self):
-        database_info_list = DatabaseInfoManager.get_all_database_info()
+        database_info_list = await DatabaseInfoManager.get_all_database_info()
+        database_id_set = set()
         for database_info in database_info_list:
             database_id = database_info['database_id']
-            table_info_list = TableInfoManager.get_table_info_by_database_id(database_id)
-            for table_info in table_info_list:
-                table_id = table_info['table_id']
-                column_info_list = ColumnInfoManager.get_column_info_by_table_id(table_id, True)
-                for column_info in column_info_list:
-                    await self.add(database_id, table_id, column_info['column_name'])
+            database_id_set.add(str(database_id))
+            try:
+                await self.refresh_database(database_id)
+            except Exception as e:
+                logging.error(f'关键字索引刷新失败由于{e}')
+        for database_id in (set(self.table_index_dict) | set(self.keyword_asset_dict)) - database_id_set:
+            await self.drop_database(database_id)
+
+    async def refresh_periodically(self):
+        """按KEYWORD_REFRESH_INTERVAL定时刷新关键词索引，间隔不大于0时不刷新"""
+        interval = config['KEYWORD_REFRESH_INTERVAL']
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.update_keyword_asset()
+            except Exception as e:
+                logging.error(f'关键字索引定时刷新失败由于{e}')
+
+    async def del_excutor(self, database_id, table_id, column_name):
+        async with KeywordManager.get_lock(self.table_locks, str(table_id)):
+            try:
+                keyword_index = self.get_table_index(database_id, table_id)
+                if keyword_index is None:
+                    return
+                column_values = keyword_index.to_column_values()
+                column_values.pop((str(table_id), column_name), None)
+                table_meta = keyword_index.meta['tables'][str(table_id)]
+                table_info = {'table_name': table_meta['table_name']}
+                refresh = table_meta.get('refresh')
+                if refresh is not None:
+                    checksums = {key: value for key, value in refresh['checksums'].items() if key != column_name}
+                    refresh = {**refresh, 'checksums': checksums}
+                await self.rebuild_table(
+                    database_id, table_id, table_info, column_values, table_meta['primary_key_list'], refresh)
+            except Exception as e:
+                logging.error(f'关键字索引删除列失败由于{e}')
+                return
+        await self.merge_database(database_id)
 
     async def del_by_column_name(self, database_id, table_id, column_name):
+        keyword_index = self.get_table_index(database_id, table_id)
+        if keyword_index is None or column_name not in keyword_index.get_columns(table_id):
+            return True
         try:
-            with self.lock:
-                if database_id in self.keyword_asset_dict.keys():
-                    if table_id in self.keyword_asset_dict[database_id].keys():
-                        if column_name in self.keyword_asset_dict[database_id][table_id]['dict_tree_dict'].keys():
-                            del self.keyword_asset_dict[database_id][table_id]['dict_tree_dict'][column_name]
+            self.run_in_background(self.del_excutor(database_id, table_id, column_name))
         except Exception as e:
             logging.error(f'字典树删除失败由于{e}')
             return False
         return True
 
+    def get_table_hit_cnt(self, question, database_id):
+        """统计问题在各表中命中的行数，{表ID: 命中行数}，用于选表时的排序"""
+        keyword_index = self.keyword_asset_dict.get(str(database_id))
+        if keyword_index is None:
+            return {}
+        table_hit_cnt = {}
+        try:
+            for table_id, _, _ in keyword_index.match(question):
+                table_hit_cnt[table_id] = table_hit_cnt.get(table_id, 0) + 1
+        except Exception as e:
+            logging.error(f'从关键字索引中获取结果失败由于{e}')
+        return table_hit_cnt
+
     async def generate_sql(self, question, database_id, table_id_list=None):
-        with self.lock:
-            results = []
-            if database_id in self.keyword_asset_dict.keys():
-                database_url = await DatabaseInfoManager.get_database_url_by_id(database_id)
-                database_type = DiffDatabaseService.get_database_type_from_url(database_url)
-                for table_id in self.keyword_asset_dict[database_id].keys():
-                    if table_id_list is None or table_id in table_id_list:
-                        table_info = self.keyword_asset_dict[database_id][table_id]['table_info']
-                        primary_key_list = self.keyword_asset_dict[database_id][table_id]['primary_key_list']
-                        primary_key_value_list = []
-                        try:
-                            for dict_tree in self.keyword_asset_dict[database_id][table_id]['dict_tree_dict'].values():
-                                primary_key_value_list += dict_tree.get_results(question)
-                        except Exception as e:
-                            logging.error(f'从字典树中获取结果失败由于{e}')
-                            continue
-                        for i in range(len(primary_key_value_list)):
-                            sql_str = await DiffDatabaseService.get_database_service(database_type).assemble_sql_query_base_on_primary_key(
-                                table_info['table_name'], primary_key_list, primary_key_value_list[i])
-                            tmp_dict = {'database_id': database_id, 'table_id': table_id, 'sql': sql_str}
-                            results.append(tmp_dict)
-                del database_url
+        # 只读取一次引用，检索期间索引被替换也不影响本次结果
+        keyword_index = self.keyword_asset_dict.get(str(database_id))
+        if keyword_index is None:
+            return []
+        try:
+            matches = keyword_index.match(question, table_id_list)
+        except Exception as e:
+            logging.error(f'从关键字索引中获取结果失败由于{e}')
+            return []
+        if not matches:
+            return []
+        database_url = await DatabaseInfoManager.get_database_url_by_id(database_id)
+        database_type = DiffDatabaseService.get_database_type_from_url(database_url)
+        del database_url
+        database_service = DiffDatabaseService.get_database_service(database_type)
+        results = []
+        for table_id, _, primary_key_values in matches:
+            table_meta = keyword_index.meta['tables'][table_id]
+            sql_str = await database_service.assemble_sql_query_base_on_primary_key(
+                table_meta['table_name'], table_meta['primary_key_list'], primary_key_values)
+            results.append({'database_id': database_id, 'table_id': table_id, 'sql': sql_str})
         return results
 
 
 keyword_service = KeywordManager()
-asyncio.run(keyword_service.load_keywords())
@@ -0,0 +1,112 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
+import asyncio
+import json
+import sys
+import time
+import logging
+
+from chat2db.app.service.diff_database_service import DiffDatabaseService
+from chat2db.config.config import config
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
+
+
+class SqlExecuteService():
+    """
+    以服务端游标执行sql，结果逐批读取，返回的行数、字节数和执行时间都有上限
+    超出上限时结果被截断，并返回下一页的offset，调用方可以继续分页读取
+    """
+
+    @staticmethod
+    async def iter_rows(database_url, sql, offset=0, limit=None):
+        """
+        依次产出('columns', 列名列表)、若干('row', (行, 行的json))和('end', 执行结果信息)
+        sql执行失败或超时前没有读取到任何一行时直接抛出异常
+        """
+        max_rows = config['SQL_EXECUTE_MAX_ROWS'] if limit is None else min(limit, config['SQL_EXECUTE_MAX_ROWS'])
+        max_bytes = config['SQL_EXECUTE_MAX_BYTES']
+        deadline = time.monotonic() + config['SQL_EXECUTE_TIMEOUT']
+        database_type = DiffDatabaseService.get_database_type_from_url(database_url)
+        batches = DiffDatabaseService.get_database_service(database_type).stream_excute(
+            database_url, sql, config['SQL_EXECUTE_FETCH_SIZE'])
+        row_cnt = 0
+        byte_cnt = 0
+        skip_cnt = 0
+        truncated_reason = None
+        try:
+            try:
+                columns = await asyncio.wait_for(batches.__anext__(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise TimeoutError('sql执行超时')
+            yield 'columns', columns
+            while truncated_reason is None:
+                try:
+                    batch = await asyncio.wait_for(batches.__anext__(), max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    truncated_reason = 'timeout'
+                    break
+                for row in batch:
+                    if skip_cnt < offset:
+                        skip_cnt += 1
+                        continue
+                    # 多读到一行才说明结果被截断
+                    if row_cnt >= max_rows:
+                        truncated_reason = 'row_limit'
+                        break
+                    row_json = json.dumps(row, ensure_ascii=False, default=str)
+                    if byte_cnt + len(row_json.encode('utf-8')) > max_bytes:
+                        truncated_reason = 'byte_limit'
+                        break
+                    byte_cnt += len(row_json.encode('utf-8'))
+                    row_cnt += 1
+                    yield 'row', (row, row_json)
+        finally:
+            await batches.aclose()
+        if truncated_reason == 'timeout' and row_cnt == 0:
+            # 超时前还没有越过offset之前的行，返回的next_offset不会前进，直接报错
+            raise TimeoutError('sql执行超时，未读取到offset之后的结果')
+        yield 'end', {
+            'row_cnt': row_cnt,
+            'truncated': truncated_reason is not None,
+            'truncated_reason': truncated_reason,
+            'next_offset': offset + row_cnt if truncated_reason is not None else None
+        }
+
+    @staticmethod
+    async def execute(database_url, sql, offset=0, limit=None):
+        """返回(行列表, 执行结果信息)"""
+        rows = []
+        end = None
+        async for event, value in SqlExecuteService.iter_rows(database_url, sql, offset, limit):
+            if event == 'row':
+                rows.append(value[0])
+            elif event == 'end':
+                end = value
+        return rows, end
+
+    @staticmethod
+    async def execute_ndjson(database_url, sql, offset=0, limit=None):
+        """
+        先执行sql并取得列名，执行失败时直接抛出异常，成功后返回逐行产出NDJSON的异步生成器
+        每行为{"type": "columns"|"row"|"end"|"error", ...}
+        """
+        events = SqlExecuteService.iter_rows(database_url, sql, offset, limit)
+        _, columns = await events.__anext__()
+
+        async def generate():
+            try:
+                yield json.dumps({'type': 'columns', 'columns': columns}, ensure_ascii=False) + '\n'
+                async for event, value in events:
+                    if event == 'row':
+                        yield '{"type": "row", "data": ' + value[1] + '}\n'
+                    else:
+                        yield json.dumps({'type': 'end', **value}, ensure_ascii=False) + '\n'
+            except Exception as e:
+                logging.error(f'sql执行失败由于{e}')
+                yield json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False) + '\n'
+            finally:
+                await events.aclose()
+        return generate()
@@ -1,12 +1,11 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
 import asyncio
-import yaml
 import re
 import json
-import random
 import sys
 import uuid
 import logging
+import tiktoken
 from pandas.core.api import DataFrame as DataFrame
 
 from chat2db.manager.database_info_manager import DatabaseInfoManager
@@ -15,8 +14,11 @@ from chat2db.manager.column_info_manager import ColumnInfoManager
 from chat2db.manager.sql_example_manager import SqlExampleManager
 from chat2db.app.service.diff_database_service import DiffDatabaseService
 from chat2db.llm.chat_with_model import LLM
+from chat2db.llm.prompt_registry import prompt_registry
 from chat2db.config.config import config
 from chat2db.app.base.vectorize import Vectorize
+from chat2db.app.base.metadata_cache import MetadataCache
+from chat2db.app.service.keyword_service import keyword_service
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
@@ -24,6 +26,47 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO,
 
 
 class SqlGenerateService():
+    # 所有sql生成请求共用的大模型并发限制
+    llm_semaphore = asyncio.Semaphore(config['LLM_MAX_CONCURRENCY'])
+
+    @staticmethod
+    async def chat_with_model(llm, system_call, user_call):
+        async with SqlGenerateService.llm_semaphore:
+            return await llm.chat_with_model(system_call, user_call)
+
+    @staticmethod
+    async def gather_first(coro_list, cnt):
+        """并发执行协程，按完成顺序收集前cnt个非空结果，收集够后取消其余协程"""
+        tasks = [asyncio.create_task(coro) for coro in coro_list]
+        results = []
+        try:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    result = await future
+                except Exception as e:
+                    logging.error(f'候选结果生成失败由于{e}')
+                    continue
+                if result:
+                    results.append(result)
+                    if len(results) >= cnt:
+                        break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return results
+
+    @staticmethod
+    async def validate_sql(database_type, database_url, sql):
+        """用EXPLAIN校验sql，校验失败或超时返回False"""
+        try:
+            await asyncio.wait_for(
+                DiffDatabaseService.get_database_service(database_type).explain_sql(database_url, sql),
+                timeout=config['SQL_VALIDATE_TIMEOUT'])
+        except Exception as e:
+            logging.error(f'生成的sql校验失败由于{e}')
+            return False
+        return True
 
     @staticmethod
     async def merge_table_and_column_info(table_info, column_info_list):
@@ -43,6 +86,21 @@ class SqlGenerateService():
         note += '</table>'
         return note
 
+    @staticmethod
+    async def get_table_schema(table_id):
+        """获取表信息、列信息和渲染后的表结构说明，优先从缓存读取"""
+        table_schema = MetadataCache.get_table_schema(table_id)
+        if table_schema is not None:
+            _, table_info, column_info_list, note = table_schema
+            return table_info, column_info_list, note
+        table_info = await TableInfoManager.get_table_info_by_table_id(table_id)
+        if table_info is None:
+            return None
+        column_info_list = await ColumnInfoManager.get_column_info_by_table_id(table_id)
+        note = await SqlGenerateService.merge_table_and_column_info(table_info, column_info_list)
+        MetadataCache.set_table_schema(table_id, table_info['database_id'], table_info, column_info_list, note)
+        return table_info, column_info_list, note
+
     @staticmethod
     def extract_list_statements(list_string):
         pattern = r'\[.*?\]'
@@ -55,33 +113,78 @@ class SqlGenerateService():
         return tmp
 
     @staticmethod
-    async def get_most_similar_table_id_list(database_id, question, table_choose_cnt):
+    def get_tokens(content):
+        try:
+            enc = tiktoken.encoding_for_model("gpt-4")
+            return len(enc.encode(str(content)))
+        except Exception as e:
+            logging.error(f'获取token数失败由于{e}')
+        return len(content)
+
+    @staticmethod
+    async def rank_table_id_list(database_id, question, question_vector, table_info_list):
+        """
+        选表第一阶段，按表注释向量的相似度和问题命中的关键词行数分别排序，再用倒数排名融合
+        返回融合后排名靠前的TABLE_CHOOSE_CANDIDATE_CNT张表
+        """
+        candidate_cnt = config['TABLE_CHOOSE_CANDIDATE_CNT']
+        table_id_dict = {str(table_info['table_id']): table_info['table_id'] for table_info in table_info_list}
+        rank_list = []
+        if question_vector is not None:
+            try:
+                vector_table_id_list = await asyncio.wait_for(TableInfoManager.get_topk_table_by_cos_dis(
+                    database_id, question_vector, candidate_cnt), timeout=5)
+                rank_list.append([str(table_id) for table_id in vector_table_id_list])
+            except Exception as e:
+                logging.error(f'按向量预选表失败由于：{e}')
+        table_hit_cnt = keyword_service.get_table_hit_cnt(question, database_id)
+        rank_list.append(sorted(table_hit_cnt, key=lambda table_id: -table_hit_cnt[table_id]))
+        score_dict = {}
+        for table_id_rank in rank_list:
+            for rank, table_id in enumerate(table_id_rank):
+                if table_id in table_id_dict:
+                    score_dict[table_id] = score_dict.get(table_id, 0) + 1 / (60 + rank)
+        ranked_table_id_list = sorted(score_dict, key=lambda table_id: -score_dict[table_id])
+        return [table_id_dict[table_id] for table_id in ranked_table_id_list[:candidate_cnt]]
+
+    @staticmethod
+    async def get_most_similar_table_id_list(database_id, question, table_choose_cnt, question_vector=None):
+        """
+        两阶段选表：先按向量和关键词预选，再把预选的表交给大模型选择
+        结果按(数据库ID, 归一化的问题)缓存
+        """
+        table_id_list = MetadataCache.get_table_choice(database_id, question, table_choose_cnt)
+        if table_id_list is not None:
+            _, table_id_list = table_id_list
+            return list(table_id_list)
         table_info_list = await TableInfoManager.get_table_info_by_database_id(database_id)
-        random.shuffle(table_info_list)
-        table_id_set = set()
+        table_info_dict = {str(table_info['table_id']): table_info for table_info in table_info_list}
+        candidate_table_id_list = await SqlGenerateService.rank_table_id_list(
+            database_id, question, question_vector, table_info_list)
+        # 预选的表不够时按原有顺序补齐
         for table_info in table_info_list:
-            table_id = table_info['table_id']
-            table_id_set.add(str(table_id))
+            if len(candidate_table_id_list) >= config['TABLE_CHOOSE_CANDIDATE_CNT']:
+                break
+            if table_info['table_id'] not in candidate_table_id_list:
+                candidate_table_id_list.append(table_info['table_id'])
         try:
-            with open('./chat2db/templetes/prompt.yaml', 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            prompt = prompt_dict.get('table_choose_prompt', '')
+            prompt = prompt_registry.get('table_choose_prompt')
             table_entries = '<table>\n'
             table_entries += '<tr>\n'+' <td>主键</td>\n<td>表注释</td>\n'+'</tr>\n'
-            token_upper = 2048
-            for table_info in table_info_list:
-                table_id = table_info['table_id']
-                table_note = table_info['table_note']
-                if len(table_entries) + len(
-                        '<tr>\n' + f' <td>{table_id}</td>\n<td>{table_note}</td>\n' + '</tr>\n') > token_upper:
+            token_cnt = SqlGenerateService.get_tokens(table_entries + '</table>')
+            for table_id in candidate_table_id_list:
+                table_note = table_info_dict[str(table_id)]['table_note']
+                table_entry = '<tr>\n' + f' <td>{table_id}</td>\n<td>{table_note}</td>\n' + '</tr>\n'
+                entry_token_cnt = SqlGenerateService.get_tokens(table_entry)
+                if token_cnt + entry_token_cnt > config['TABLE_CHOOSE_TOKEN_BUDGET']:
                     break
-                table_entries += '<tr>\n'+f' <td>{table_id}</td>\n<td>{table_note}</td>\n'+'</tr>\n'
+                token_cnt += entry_token_cnt
+                table_entries += table_entry
             table_entries += '</table>'
             prompt = prompt.format(table_cnt=table_choose_cnt, table_entries=table_entries, question=question)
-            # logging.info(f'在大模型增强模式下，选择表的prompt构造成功：{prompt}')
         except Exception as e:
             logging.error(f'在大模型增强模式下，选择表的prompt构造失败由于：{e}')
-            return []
+            return candidate_table_id_list[:table_choose_cnt]
         try:
             llm = LLM(model_name=config['LLM_MODEL'],
                       openai_api_base=config['LLM_URL'],
@@ -93,22 +196,30 @@ class SqlGenerateService():
             llm = None
             logging.error(f'在大模型增强模式下，选择表的过程中，与大模型建立连接失败由于：{e}')
         table_id_list = []
+        llm_success = False
         if llm is not None:
-            for i in range(2):
-                content = await llm.chat_with_model(prompt, '请输包含选择表主键的列表')
+            content_list = await asyncio.gather(
+                *[SqlGenerateService.chat_with_model(llm, prompt, '请输包含选择表主键的列表') for _ in range(2)],
+                return_exceptions=True)
+            for content in content_list:
+                if isinstance(content, BaseException):
+                    logging.error(f'在大模型增强模式下，选择表失败由于：{content}')
+                    continue
                 try:
                     sub_table_id_list = json.loads(SqlGenerateService.extract_list_statements(content))
                 except:
-                    sub_table_id_list = []
-                for j in range(len(sub_table_id_list)):
-                    if sub_table_id_list[j] in table_id_set and uuid.UUID(sub_table_id_list[j]) not in table_id_list:
-                        table_id_list.append(uuid.UUID(sub_table_id_list[j]))
-        if len(table_id_list) < table_choose_cnt:
-            table_choose_cnt -= len(table_id_list)
-            for i in range(min(table_choose_cnt, len(table_info_list))):
-                table_id = table_info_list[i]['table_id']
-                if table_id is not None and table_id not in table_id_list:
-                    table_id_list.append(table_id)
+                    continue
+                llm_success = True
+                for sub_table_id in sub_table_id_list:
+                    if sub_table_id in table_info_dict and uuid.UUID(sub_table_id) not in table_id_list:
+                        table_id_list.append(uuid.UUID(sub_table_id))
+        for table_id in candidate_table_id_list:
+            if len(table_id_list) >= table_choose_cnt:
+                break
+            if table_id not in table_id_list:
+                table_id_list.append(table_id)
+        if llm_success:
+            MetadataCache.set_table_choice(database_id, question, table_choose_cnt, table_id_list)
         return table_id_list
 
     @staticmethod
@@ -131,7 +242,8 @@ class SqlGenerateService():
         data_frame_list = []
         if table_id_list is None:
             if use_llm_enhancements:
-                table_id_list = await SqlGenerateService.get_most_similar_table_id_list(database_id, question, table_choose_cnt)
+                table_id_list = await SqlGenerateService.get_most_similar_table_id_list(
+                    database_id, question, table_choose_cnt, question_vector)
             else:
                 try:
                     table_info_list = await TableInfoManager.get_table_info_by_database_id(database_id)
@@ -173,12 +285,10 @@ class SqlGenerateService():
                 continue
             exist_table_id.add(table_id)
             try:
-                table_info = await TableInfoManager.get_table_info_by_table_id(table_id)
-                column_info_list = await ColumnInfoManager.get_column_info_by_table_id(table_id)
+                table_info, column_info_list, note = await SqlGenerateService.get_table_schema(table_id)
             except Exception as e:
                 logging.error(f'表{table_id}注释获取失败由于{e}')
                 continue
-            note = await SqlGenerateService.merge_table_and_column_info(table_info, column_info_list)
             note_list.append(note)
             max_retry = 3
             sql_example_list = []
@@ -199,7 +309,8 @@ class SqlGenerateService():
                     {'question': sql_example_list[i]['question'],
                      'sql': sql_example_list[i]['sql']})
             data_frame_list.append({'table_id': table_id, 'table_info': table_info,
-                                   'column_info_list': column_info_list, 'sql_example_list': question_sql_list})
+                                   'column_info_list': column_info_list, 'note': note,
+                                   'sql_example_list': question_sql_list})
         return data_frame_list
 
     @staticmethod
@@ -234,21 +345,21 @@ class SqlGenerateService():
         database_type = DiffDatabaseService.get_database_type_from_url(database_url)
         data_frame_list = await SqlGenerateService.find_most_similar_sql_example(database_id, table_id_list, question, use_llm_enhancements)
         try:
-            with open('./chat2db/templetes/prompt.yaml', 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
             llm = LLM(model_name=config['LLM_MODEL'],
                       openai_api_base=config['LLM_URL'],
                       openai_api_key=config['LLM_KEY'],
                       max_tokens=config['LLM_MAX_TOKENS'],
                       request_timeout=60,
                       temperature=0.5)
-            results = []
+            table_task_list = []
             for data_frame in data_frame_list:
-                prompt = prompt_dict.get('sql_generate_base_on_example_prompt', '')
+                prompt = prompt_registry.get('sql_generate_base_on_example_prompt')
                 table_info = data_frame.get('table_info', '')
                 table_id = table_info['table_id']
                 column_info_list = data_frame.get('column_info_list', '')
-                note = await SqlGenerateService.merge_table_and_column_info(table_info, column_info_list)
+                note = data_frame.get('note')
+                if note is None:
+                    note = await SqlGenerateService.merge_table_and_column_info(table_info, column_info_list)
                 sql_example = await SqlGenerateService.merge_sql_example(data_frame.get('sql_example_list', []))
                 try:
                     prompt = prompt.format(
@@ -256,21 +367,60 @@ class SqlGenerateService():
                         sql_example=sql_example, question=question)
                 except Exception as e:
                     logging.info(f'sql生成失败{e}')
-                    return []
-                ge_cnt = 0
-                ge_sql_cnt = 0
-                while ge_cnt < 10*sql_generate_cnt and ge_sql_cnt < sql_generate_cnt:
-                    sql = await llm.chat_with_model(prompt, f'请输出一条在与{database_type}下能运行的sql，以分号结尾')
-                    sql = await SqlGenerateService.extract_select_statements(sql)
-                    if len(sql):
-                        ge_sql_cnt += 1
-                        tmp_dict = {'database_id': database_id, 'table_id': table_id, 'sql': sql}
-                        results.append(tmp_dict)
-                    ge_cnt += 1
-                if len(results) == sql_generate_cnt:
-                    break
+                    continue
+                table_task_list.append((table_id, asyncio.create_task(SqlGenerateService.generate_sql_for_table(
+                    llm, prompt, database_type, database_url, sql_generate_cnt))))
+            # 各表并发生成，按表的相关度顺序取结果，结果够了就取消其余表的生成
+            results = []
+            try:
+                for table_id, task in table_task_list:
+                    if len(results) >= sql_generate_cnt:
+                        break
+                    try:
+                        sql_list = await task
+                    except Exception as e:
+                        logging.error(f'表{table_id}的sql生成失败由于：{e}')
+                        continue
+                    for sql in sql_list[:sql_generate_cnt - len(results)]:
+                        results.append({'database_id': database_id, 'table_id': table_id, 'sql': sql})
+            finally:
+                for _, task in table_task_list:
+                    task.cancel()
+                await asyncio.gather(*[task for _, task in table_task_list], return_exceptions=True)
         except Exception as e:
             logging.error(f'sql生成失败由于：{e}')
+            return []
+        return results
+
+    @staticmethod
+    async def generate_sql_for_table(llm, prompt, database_type, database_url, sql_generate_cnt):
+        """
+        每轮并发生成多条候选sql，去重后并发校验，返回最先通过校验的sql_generate_cnt条
+        调用大模型的总次数不超过10*sql_generate_cnt
+        """
+        sql_set = set()
+        results = []
+
+        async def generate_candidate():
+            sql = await SqlGenerateService.chat_with_model(
+                llm, prompt, f'请输出一条在与{database_type}下能运行的sql，以分号结尾')
+            sql = await SqlGenerateService.extract_select_statements(sql)
+            key = ' '.join(sql.lower().split())
+            if not sql or key in sql_set:
+                return None
+            sql_set.add(key)
+            if config['SQL_GENERATE_VALIDATE'] and \
+                    not await SqlGenerateService.validate_sql(database_type, database_url, sql):
+                return None
+            return sql
+        max_attempt_cnt = 10 * sql_generate_cnt
+        attempt_cnt = 0
+        while attempt_cnt < max_attempt_cnt and len(results) < sql_generate_cnt:
+            candidate_cnt = min(max(config['SQL_GENERATE_CANDIDATE_CNT'], sql_generate_cnt - len(results)),
+                                max_attempt_cnt - attempt_cnt)
+            attempt_cnt += candidate_cnt
+            results += await SqlGenerateService.gather_first(
+                [generate_candidate() for _ in range(candidate_cnt)], sql_generate_cnt - len(results))
         return results
 
     @staticmethod
@@ -295,49 +445,50 @@ class SqlGenerateService():
                   max_tokens=config['LLM_MAX_TOKENS'],
                   request_timeout=60,
                   temperature=0.5)
-        for i in range(5):
+
+        async def generate_candidate():
             data_frame = await DiffDatabaseService.get_database_service(database_type).get_rand_data(database_url, table_name)
             try:
-                with open('./chat2db/templetes/prompt.yaml', 'r', encoding='utf-8') as f:
-                    prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-                prompt = prompt_dict['question_generate_base_on_data_prompt'].format(
+                prompt = prompt_registry.get('question_generate_base_on_data_prompt').format(
                     note=note, data_frame=data_frame)
-                question = await llm.chat_with_model(prompt, '请输出一个问题')
+                question = await SqlGenerateService.chat_with_model(llm, prompt, '请输出一个问题')
                 if count_char(question, '?') > 1 or count_char(question, '？') > 1:
-                    continue
+                    return None
             except Exception as e:
                 logging.error(f'问题生成失败由于{e}')
-                continue
+                return None
             try:
-                with open('./chat2db/templetes/prompt.yaml', 'r', encoding='utf-8') as f:
-                    prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-                prompt = prompt_dict['sql_generate_base_on_data_prompt'].format(
+                prompt = prompt_registry.get('sql_generate_base_on_data_prompt').format(
                     database_type=database_type,
                     note=note, data_frame=data_frame, question=question)
-                sql = await llm.chat_with_model(prompt, f'请输出一条可以用于查询{database_type}的sql,要以分号结尾')
+                sql = await SqlGenerateService.chat_with_model(
+                    llm, prompt, f'请输出一条可以用于查询{database_type}的sql,要以分号结尾')
                 sql = await SqlGenerateService.extract_select_statements(sql)
                 if not sql:
-                    continue
+                    return None
             except Exception as e:
                 logging.error(f'sql生成失败由于{e}')
-                continue
-            try:
-                if sql_var:
-                    await DiffDatabaseService.get_database_service(database_type).try_excute(database_url, sql)
-            except Exception as e:
-                logging.error(f'生成的sql执行失败由于{e}')
-                continue
+                return None
+            if sql_var and not await SqlGenerateService.validate_sql(database_type, database_url, sql):
+                return None
             return {
                 'question': question,
                 'sql': sql
             }
+        # 最多尝试5次，每轮并发进行，取最先成功的一条
+        max_attempt_cnt = 5
+        attempt_cnt = 0
+        while attempt_cnt < max_attempt_cnt:
+            candidate_cnt = min(config['SQL_GENERATE_CANDIDATE_CNT'], max_attempt_cnt - attempt_cnt)
+            attempt_cnt += candidate_cnt
+            results = await SqlGenerateService.gather_first([generate_candidate() for _ in range(candidate_cnt)], 1)
+            if results:
+                return results[0]
         return None
 
     @staticmethod
     async def repair_sql(database_type, table_info, column_info_list, sql_failed, sql_failed_message, question):
         try:
-            with open('./chat2db/templetes/prompt.yaml', 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
             llm = LLM(model_name=config['LLM_MODEL'],
                       openai_api_base=config['LLM_URL'],
                       openai_api_key=config['LLM_KEY'],
@@ -346,7 +497,7 @@ class SqlGenerateService():
                       temperature=0.5)
             try:
                 note = await SqlGenerateService.merge_table_and_column_info(table_info, column_info_list)
-                prompt = prompt_dict.get('sql_expand_prompt', '')
+                prompt = prompt_registry.get('sql_expand_prompt')
                 prompt = prompt.format(
                     database_type=database_type, note=note, sql_failed=sql_failed,
                     sql_failed_message=sql_failed_message,
@@ -354,7 +505,8 @@ class SqlGenerateService():
             except Exception as e:
                 logging.error(f'sql修复失败由于{e}')
                 return ''
-            sql = await llm.chat_with_model(prompt, f'请输出一条在与{database_type}下能运行的sql，要以分号结尾')
+            sql = await SqlGenerateService.chat_with_model(
+                llm, prompt, f'请输出一条在与{database_type}下能运行的sql，要以分号结尾')
             sql = await SqlGenerateService.extract_select_statements(sql)
             logging.info(f"修复前的sql为{sql_failed}修复后的sql为{sql}")
         except Exception as e:
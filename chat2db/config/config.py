@@ -20,6 +20,48 @@ class ConfigModel(BaseModel):
     DATABASE_USER: str = Field(None, description="数据库用户名")
     DATABASE_PASSWORD: str = Field(None, description="数据库密码")
     DATABASE_DB: str = Field(None, description="数据库名称")
+    DATABASE_POOL_SIZE: int = Field(default=20, description="元数据库连接池的常驻连接数")
+    DATABASE_MAX_OVERFLOW: int = Field(default=20, description="元数据库连接池允许超出常驻连接数的连接数")
+    DATABASE_POOL_TIMEOUT: int = Field(default=30, description="从元数据库连接池获取连接的超时时间(秒)")
+    DATABASE_STATEMENT_TIMEOUT: int = Field(default=30000, description="元数据库单条语句的执行超时时间(毫秒)")
+
+    # 目标数据库连接池
+    TARGET_DATABASE_POOL_SIZE: int = Field(default=5, description="每个目标数据库连接池的常驻连接数")
+    TARGET_DATABASE_MAX_OVERFLOW: int = Field(default=10, description="每个目标数据库连接池允许超出常驻连接数的连接数")
+    TARGET_DATABASE_POOL_TIMEOUT: int = Field(default=10, description="从目标数据库连接池获取连接的超时时间(秒)")
+    TARGET_DATABASE_IDLE_TIMEOUT: int = Field(default=600, description="目标数据库连接池空闲多久后被回收(秒)")
+    TARGET_DATABASE_MAX_ENGINES: int = Field(default=64, description="同时保留的目标数据库连接池数量上限")
+    TARGET_DATABASE_STATEMENT_TIMEOUT: int = Field(default=30000, description="目标数据库单条语句的执行超时时间(毫秒)")
+
+    # 元数据缓存
+    METADATA_CACHE_TTL: int = Field(default=300, description="数据库连接串和表结构说明缓存的过期时间(秒)")
+    METADATA_CACHE_MAX_SIZE: int = Field(default=1024, description="数据库连接串和表结构说明缓存的最大条目数")
+
+    # 关键词索引
+    KEYWORD_INDEX_PATH: str = Field(default='./chat2db-keyword-index', description="关键词索引快照的保存目录")
+    KEYWORD_REFRESH_INTERVAL: int = Field(default=3600, description="关键词索引定时刷新的间隔(秒)，不大于0时不刷新")
+    KEYWORD_REFRESH_MIN_INTERVAL: int = Field(default=600, description="同一数据库两次刷新关键词索引的最小间隔(秒)")
+    KEYWORD_REFRESH_PAGE_SIZE: int = Field(default=1000, description="增量刷新时按主键范围划分的每页大小")
+
+    # SQL执行
+    SQL_EXECUTE_MAX_ROWS: int = Field(default=1000, description="单次执行sql返回的最大行数")
+    SQL_EXECUTE_MAX_BYTES: int = Field(default=8388608, description="单次执行sql返回结果的最大字节数")
+    SQL_EXECUTE_FETCH_SIZE: int = Field(default=500, description="服务端游标每批读取的行数")
+    SQL_EXECUTE_TIMEOUT: int = Field(default=60, description="单次执行sql并返回结果的最长时间(秒)")
+
+    # SQL生成
+    SQL_GENERATE_CANDIDATE_CNT: int = Field(default=3, description="每张表每轮并发生成的候选sql数量")
+    SQL_GENERATE_VALIDATE: bool = Field(default=True, description="是否用EXPLAIN校验候选sql")
+    SQL_VALIDATE_TIMEOUT: int = Field(default=5, description="EXPLAIN校验单条sql的超时时间(秒)")
+    LLM_MAX_CONCURRENCY: int = Field(default=16, description="sql生成过程中同时进行的大模型调用数量上限")
+
+    # 随机抽样
+    RAND_DATA_SMALL_TABLE_ROWS: int = Field(default=10000, description="估算行数不超过该值的表直接随机排序抽样")
+    RAND_DATA_BERNOULLI_MAX_ROWS: int = Field(default=1000000, description="postgres估算行数不超过该值时按行抽样，超过时按数据页抽样")
+
+    # 选表
+    TABLE_CHOOSE_CANDIDATE_CNT: int = Field(default=20, description="大模型选表前按向量和关键词预选的表数量")
+    TABLE_CHOOSE_TOKEN_BUDGET: int = Field(default=2048, description="选表提示词中表条目的token上限")
 
     # QWEN
     LLM_KEY: str = Field(None, description="语言模型访问密钥")
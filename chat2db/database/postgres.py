@@ -1,9 +1,11 @@
+import asyncio
 import logging
 from uuid import uuid4
 import urllib.parse
 from pgvector.sqlalchemy import Vector
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import TIMESTAMP, UUID, Column, String, Boolean, ForeignKey, create_engine, func, Index
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import TIMESTAMP, UUID, Column, String, Boolean, ForeignKey, func, Index
 import sys
 from chat2db.config.config import config
 
@@ -79,57 +81,65 @@ class SqlExample(Base):
 
 
 class PostgresDB:
-    _engine = None
+    password = config['DATABASE_PASSWORD']
+    encoded_password = urllib.parse.quote_plus(password)
+
+    if config['DATABASE_TYPE'].lower() == 'opengauss':
+        database_url = f"opengauss+asyncpg://{config['DATABASE_USER']}:{encoded_password}@{config['DATABASE_HOST']}:{config['DATABASE_PORT']}/{config['DATABASE_DB']}"
+    else:
+        database_url = f"postgresql+asyncpg://{config['DATABASE_USER']}:{encoded_password}@{config['DATABASE_HOST']}:{config['DATABASE_PORT']}/{config['DATABASE_DB']}"
+    engine = create_async_engine(
+        database_url,
+        hide_parameters=True,
+        echo=False,
+        pool_size=config['DATABASE_POOL_SIZE'],
+        max_overflow=config['DATABASE_MAX_OVERFLOW'],
+        pool_timeout=config['DATABASE_POOL_TIMEOUT'],
+        pool_recycle=300,
+        pool_pre_ping=True,
+        connect_args={'server_settings': {'statement_timeout': str(config['DATABASE_STATEMENT_TIMEOUT'])}}
+    )
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    init_all_table_flag = False
+    init_all_table_lock = asyncio.Lock()
+
+    @classmethod
+    async def init_all_table(cls):
+        if config['DATABASE_TYPE'].lower() == 'opengauss':
+            from sqlalchemy import event
+            from opengauss_sqlalchemy.register_async import register_vector
+
+            @event.listens_for(cls.engine.sync_engine, "connect")
+            def connect(dbapi_connection, connection_record):
+                dbapi_connection.run_async(register_vector)
+        async with cls.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
 
     @classmethod
-    def get_mysql_engine(cls):
-        if not cls._engine:
-            password = config['DATABASE_PASSWORD']
-            encoded_password = urllib.parse.quote_plus(password)
-
-            if config['DATABASE_TYPE'].lower() == 'opengauss':
-                database_url = f"opengauss+psycopg2://{config['DATABASE_USER']}:{encoded_password}@{config['DATABASE_HOST']}:{config['DATABASE_PORT']}/{config['DATABASE_DB']}"
-            else:
-                database_url = f"postgresql+psycopg2://{config['DATABASE_USER']}:{encoded_password}@{config['DATABASE_HOST']}:{config['DATABASE_PORT']}/{config['DATABASE_DB']}"
-            cls.engine = create_engine(
-                database_url,
-                hide_parameters=True,
-                echo=False,
-                pool_recycle=300,
-                pool_pre_ping=True)
-
-            Base.metadata.create_all(cls.engine)
-            if config['DATABASE_TYPE'].lower() == 'opengauss':
-                from sqlalchemy import event
-                from opengauss_sqlalchemy.register_async import register_vector
-
-                @event.listens_for(cls.engine.sync_engine, "connect")
-                def connect(dbapi_connection, connection_record):
-                    dbapi_connection.run_async(register_vector)
-        return cls._engine
+    async def ensure_all_table(cls):
+        if cls.init_all_table_flag:
+            return
+        async with cls.init_all_table_lock:
+            if cls.init_all_table_flag:
+                return
+            await cls.init_all_table()
+            cls.init_all_table_flag = True
 
     @classmethod
-    def get_session(cls):
-        connection = None
-        try:
-            connection = sessionmaker(bind=cls.engine)()
-        except Exception as e:
-            logging.error(f"Error creating a postgres sessiondue to error: {e}")
-            return None
-        return cls._ConnectionManager(connection)
+    async def get_session(cls):
+        if not cls.init_all_table_flag:
+            await cls.ensure_all_table()
+        return cls._ConnectionManager(cls.session_maker())
 
     class _ConnectionManager:
         def __init__(self, connection):
             self.connection = connection
 
-        def __enter__(self):
+        async def __aenter__(self):
             return self.connection
 
-        def __exit__(self, exc_type, exc_val, exc_tb):
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
             try:
-                self.connection.close()
+                await self.connection.close()
             except Exception as e:
                 logging.error(f"Postgres connection close failed due to error: {e}")
-
-
-PostgresDB.get_mysql_engine()
@@ -0,0 +1,81 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import logging
+import os
+import string
+import sys
+import threading
+import time
+import yaml
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
+
+
+class PromptTemplate:
+    """预编译的prompt模板，加载时解析一次占位符，格式化时只做拼接"""
+
+    def __init__(self, template: str):
+        self.template = template
+        self.segments = []
+        # 含格式说明、转换符或属性访问的占位符交还给str.format处理
+        self.is_simple = True
+        for literal_text, field_name, format_spec, conversion in string.Formatter().parse(template):
+            self.segments.append((literal_text, field_name))
+            if field_name is not None and (format_spec or conversion or not field_name.isidentifier()):
+                self.is_simple = False
+
+    def format(self, **kwargs) -> str:
+        if not self.is_simple:
+            return self.template.format(**kwargs)
+        parts = []
+        for literal_text, field_name in self.segments:
+            parts.append(literal_text)
+            if field_name is not None:
+                parts.append(str(kwargs[field_name]))
+        return ''.join(parts)
+
+    def __str__(self) -> str:
+        return self.template
+
+
+class PromptRegistry:
+    """prompt注册表，只在文件变化时重新解析yaml"""
+    check_interval = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.last_check_time = 0
+        self.templates = {}
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> None:
+        now = time.time()
+        if now - self.last_check_time < PromptRegistry.check_interval:
+            return
+        with self.lock:
+            if now - self.last_check_time < PromptRegistry.check_interval:
+                return
+            self.last_check_time = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime == self.mtime:
+                    return
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
+                self.templates = {
+                    key: PromptTemplate(value) for key, value in prompt_dict.items() if isinstance(value, str)}
+                self.mtime = mtime
+            except Exception as e:
+                logging.error(f'prompt文件{self.path}加载失败由于{e}')
+
+    def get(self, name: str, default: str = '') -> PromptTemplate:
+        self.reload_if_changed()
+        prompt_template = self.templates.get(name)
+        if prompt_template is None:
+            return PromptTemplate(default)
+        return prompt_template
+
+
+prompt_registry = PromptRegistry('./chat2db/templetes/prompt.yaml')
@@ -1,4 +1,4 @@
-from sqlalchemy import and_
+from sqlalchemy import and_, select, delete, update
 import sys
 from chat2db.database.postgres import ColumnInfo, PostgresDB
 
@@ -8,23 +8,21 @@ class ColumnInfoManager():
     async def add_column_info_with_table_id(table_id, column_name, column_type, column_note):
         column_info_entry = ColumnInfo(table_id=table_id, column_name=column_name,
                                        column_type=column_type, column_note=column_note)
-        with PostgresDB.get_session() as session:
+        async with await PostgresDB.get_session() as session:
             session.add(column_info_entry)
-            session.commit()
+            await session.commit()
 
     @staticmethod
     async def del_column_info_by_column_id(column_id):
-        with PostgresDB.get_session() as session:
-            column_info_to_delete = session.query(ColumnInfo).filter(ColumnInfo.id == column_id)
-            session.delete(column_info_to_delete)
-            session.commit()
+        async with await PostgresDB.get_session() as session:
+            await session.execute(delete(ColumnInfo).where(ColumnInfo.id == column_id))
+            await session.commit()
 
     @staticmethod
     async def get_column_info_by_column_id(column_id):
         tmp_dict = {}
-        with PostgresDB.get_session() as session:
-            result = session.query(ColumnInfo).filter(ColumnInfo.id == column_id).first()
-            session.commit()
+        async with await PostgresDB.get_session() as session:
+            result = (await session.execute(select(ColumnInfo).filter(ColumnInfo.id == column_id))).scalars().first()
             if not result:
                 return None
             tmp_dict = {
@@ -39,24 +37,22 @@ class ColumnInfoManager():
 
     @staticmethod
     async def update_column_info_enable(column_id, enable=True):
-        with PostgresDB.get_session() as session:
-            column_info = session.query(ColumnInfo).filter(ColumnInfo.id == column_id).first()
-            if column_info is not None:
-                column_info.enable = True
-                session.commit()
-            else:
+        async with await PostgresDB.get_session() as session:
+            result = await session.execute(
+                update(ColumnInfo).where(ColumnInfo.id == column_id).values(enable=enable))
+            if result.rowcount == 0:
                 return False
+            await session.commit()
         return True
 
     @staticmethod
     async def get_column_info_by_table_id(table_id, enable=None):
         column_info_list = []
-        with PostgresDB.get_session() as session:
-            if enable is None:
-                results = session.query(ColumnInfo).filter(ColumnInfo.table_id == table_id).all()
-            else:
-                results = session.query(ColumnInfo).filter(
-                    and_(ColumnInfo.table_id == table_id, ColumnInfo.enable == enable)).all()
+        async with await PostgresDB.get_session() as session:
+            stmt = select(ColumnInfo).filter(ColumnInfo.table_id == table_id)
+            if enable is not None:
+                stmt = stmt.filter(ColumnInfo.enable == enable)
+            results = (await session.execute(stmt)).scalars().all()
             for result in results:
                 tmp_dict = {
                     'column_id': result.id,
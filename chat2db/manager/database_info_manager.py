@@ -2,8 +2,10 @@ import json
 import hashlib
 import sys
 import logging
+from sqlalchemy import select, delete
 from chat2db.database.postgres import DatabaseInfo, PostgresDB
 from chat2db.security.security import Security
+from chat2db.app.base.metadata_cache import MetadataCache
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                     format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
@@ -13,86 +15,85 @@ class DatabaseInfoManager():
     @staticmethod
     async def add_database(database_url: str):
         id = None
-        with PostgresDB.get_session() as session:
+        async with await PostgresDB.get_session() as session:
             encrypted_database_url, encrypted_config = Security.encrypt(database_url)
             hashmac = hashlib.sha256(database_url.encode('utf-8')).hexdigest()
-            counter = session.query(DatabaseInfo).filter(DatabaseInfo.hashmac == hashmac).first()
+            counter = (await session.execute(
+                select(DatabaseInfo.id).filter(DatabaseInfo.hashmac == hashmac))).first()
             if counter:
                 return id
             encrypted_config = json.dumps(encrypted_config)
             database_info_entry = DatabaseInfo(encrypted_database_url=encrypted_database_url,
                                                encrypted_config=encrypted_config, hashmac=hashmac)
             session.add(database_info_entry)
-            session.commit()
+            await session.commit()
             id = database_info_entry.id
         return id
 
     @staticmethod
     async def del_database_by_id(id):
-        with PostgresDB.get_session() as session:
-            database_info_to_delete = session.query(DatabaseInfo).filter(DatabaseInfo.id == id).first()
-            if database_info_to_delete:
-                session.delete(database_info_to_delete)
-            else:
+        async with await PostgresDB.get_session() as session:
+            result = await session.execute(delete(DatabaseInfo).where(DatabaseInfo.id == id))
+            if result.rowcount == 0:
                 return False
-            session.commit()
+            await session.commit()
         return True
-    
+
     @staticmethod
     async def del_database_by_url(database_url):
-        with PostgresDB.get_session() as session:
+        async with await PostgresDB.get_session() as session:
             hashmac = hashlib.sha256(database_url.encode('utf-8')).hexdigest()
-            database_info_entry = session.query(DatabaseInfo).filter(DatabaseInfo.hashmac == hashmac).first()
-            if database_info_entry:
-                database_info_to_delete = session.query(DatabaseInfo).filter(DatabaseInfo.id == database_info_entry.id).first()
-                if database_info_to_delete:
-                    session.delete(database_info_to_delete)
-                else:
-                    return False
-            else:
+            result = await session.execute(delete(DatabaseInfo).where(DatabaseInfo.hashmac == hashmac))
+            if result.rowcount == 0:
                 return False
-            session.commit()
+            await session.commit()
         return True
-    
+
     @staticmethod
     async def get_database_url_by_id(id):
-        with PostgresDB.get_session() as session:
-            result = session.query(
+        database_url = MetadataCache.get_database_url(id)
+        if database_url is not None:
+            return database_url
+        async with await PostgresDB.get_session() as session:
+            result = (await session.execute(select(
                 DatabaseInfo.encrypted_database_url, DatabaseInfo.encrypted_config).filter(
-                DatabaseInfo.id == id).first()
-            if result is None:
-                return None
-            try:
-                encrypted_database_url, encrypted_config = result
-                encrypted_config = json.loads(encrypted_config)
-            except Exception as e:
-                logging.error(f'数据库url解密失败由于{e}')
-                return None
-            if encrypted_database_url:
-                database_url = Security.decrypt(encrypted_database_url, encrypted_config)
-            else:
-                return None
+                DatabaseInfo.id == id))).first()
+        if result is None:
+            return None
+        try:
+            encrypted_database_url, encrypted_config = result
+            encrypted_config = json.loads(encrypted_config)
+        except Exception as e:
+            logging.error(f'数据库url解密失败由于{e}')
+            return None
+        if encrypted_database_url:
+            database_url = Security.decrypt(encrypted_database_url, encrypted_config)
+        else:
+            return None
+        MetadataCache.set_database_url(id, database_url)
         return database_url
+
     @staticmethod
     async def get_database_id_by_url(database_url: str):
-        with PostgresDB.get_session() as session:
+        async with await PostgresDB.get_session() as session:
             hashmac = hashlib.sha256(database_url.encode('utf-8')).hexdigest()
-            database_info_entry = session.query(DatabaseInfo).filter(DatabaseInfo.hashmac == hashmac).first()
-            if database_info_entry:
-                return database_info_entry.id
-        return None
+            database_id = (await session.execute(
+                select(DatabaseInfo.id).filter(DatabaseInfo.hashmac == hashmac))).scalars().first()
+        return database_id
+
     @staticmethod
     async def get_all_database_info():
-        with PostgresDB.get_session() as session:
-            results = session.query(DatabaseInfo).order_by(DatabaseInfo.created_at).all()
-            database_info_list = []
-            for i in range(len(results)):
-                database_id = results[i].id
-                encrypted_database_url = results[i].encrypted_database_url
-                encrypted_config = json.loads(results[i].encrypted_config)
-                created_at = results[i].created_at
-                if encrypted_database_url:
-                    database_url = Security.decrypt(encrypted_database_url, encrypted_config)
-                tmp_dict = {'database_id': database_id, 'database_url': database_url, 'created_at': created_at}
-                database_info_list.append(tmp_dict)
+        async with await PostgresDB.get_session() as session:
+            results = (await session.execute(
+                select(DatabaseInfo).order_by(DatabaseInfo.created_at))).scalars().all()
+        database_info_list = []
+        for i in range(len(results)):
+            database_id = results[i].id
+            encrypted_database_url = results[i].encrypted_database_url
+            encrypted_config = json.loads(results[i].encrypted_config)
+            created_at = results[i].created_at
+            if encrypted_database_url:
+                database_url = Security.decrypt(encrypted_database_url, encrypted_config)
+            tmp_dict = {'database_id': database_id, 'database_url': database_url, 'created_at': created_at}
+            database_info_list.append(tmp_dict)
         return database_info_list
@@ -1,4 +1,4 @@
-from sqlalchemy import and_
+from sqlalchemy import and_, select, delete
 import sys
 from chat2db.database.postgres import TableInfo, PostgresDB
 
@@ -7,37 +7,36 @@ class TableInfoManager():
     @staticmethod
     async def add_table_info(database_id, table_name, table_note, table_note_vector):
         id = None
-        with PostgresDB.get_session() as session:
-            counter = session.query(TableInfo).filter(
-                and_(TableInfo.database_id == database_id, TableInfo.table_name == table_name)).first()
+        async with await PostgresDB.get_session() as session:
+            counter = (await session.execute(select(TableInfo.id).filter(
+                and_(TableInfo.database_id == database_id, TableInfo.table_name == table_name)))).first()
             if counter:
                 return id
             table_info_entry = TableInfo(database_id=database_id, table_name=table_name,
                                          table_note=table_note, table_note_vector=table_note_vector)
             session.add(table_info_entry)
-            session.commit()
+            await session.commit()
             id = table_info_entry.id
         return id
 
     @staticmethod
     async def del_table_by_id(id):
-        with PostgresDB.get_session() as session:
-            table_info_to_delete = session.query(TableInfo).filter(TableInfo.id == id).first()
-            if table_info_to_delete:
-                session.delete(table_info_to_delete)
-            else:
+        async with await PostgresDB.get_session() as session:
+            result = await session.execute(delete(TableInfo).where(TableInfo.id == id))
+            if result.rowcount == 0:
                 return False
-            session.commit()
+            await session.commit()
         return True
 
     @staticmethod
     async def get_table_info_by_table_id(table_id):
-        with PostgresDB.get_session() as session:
-            table_id, database_id, table_name, table_note = session.query(
+        async with await PostgresDB.get_session() as session:
+            result = (await session.execute(select(
                 TableInfo.id, TableInfo.database_id, TableInfo.table_name, TableInfo.table_note).filter(
-                TableInfo.id == table_id).first()
-        if table_id is None:
+                TableInfo.id == table_id))).first()
+        if result is None:
             return None
+        table_id, database_id, table_name, table_note = result
         return {
             'table_id': table_id,
             'database_id': database_id,
@@ -47,28 +46,22 @@ class TableInfoManager():
 
     @staticmethod
     async def get_table_id_by_database_id_and_table_name(database_id, table_name):
-        with PostgresDB.get_session() as session:
-            table_info_entry = session.query(
-                TableInfo).filter(
+        async with await PostgresDB.get_session() as session:
+            table_id = (await session.execute(select(
+                TableInfo.id).filter(
                 TableInfo.database_id == database_id,
                 TableInfo.table_name == table_name,
-            ).first()
-        if table_info_entry:
-            return table_info_entry.id
-        return None
+            ))).scalars().first()
+        return table_id
 
     @staticmethod
     async def get_table_info_by_database_id(database_id, enable=None):
-        with PostgresDB.get_session() as session:
-            if enable is None:
-                results = session.query(
-                    TableInfo).filter(TableInfo.database_id == database_id).all()
-            else:
-                results = session.query(
-                    TableInfo).filter(
-                    and_(TableInfo.database_id == database_id,
-                         TableInfo.enable == enable
-                         )).all()
+        async with await PostgresDB.get_session() as session:
+            stmt = select(TableInfo.id, TableInfo.table_name, TableInfo.table_note, TableInfo.created_at).filter(
+                TableInfo.database_id == database_id)
+            if enable is not None:
+                stmt = stmt.filter(TableInfo.enable == enable)
+            results = (await session.execute(stmt)).all()
         table_info_list = []
         for result in results:
             table_info_list.append({'table_id': result.id, 'table_name': result.table_name,
@@ -77,11 +70,12 @@ class TableInfoManager():
 
     @staticmethod
     async def get_topk_table_by_cos_dis(database_id, tmp_vector, topk=3):
-        with PostgresDB.get_session() as session:
-            results = session.query(
+        async with await PostgresDB.get_session() as session:
+            stmt = select(
                 TableInfo.id
             ).filter(TableInfo.database_id == database_id).order_by(
                 TableInfo.table_note_vector.cosine_distance(tmp_vector)
-            ).limit(topk).all()
+            ).limit(topk)
+            results = (await session.execute(stmt)).all()
         table_id_list = [result[0] for result in results]
         return table_id_list
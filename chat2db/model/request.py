@@ -81,6 +81,9 @@ class SqlRepairRequest(BaseModel):
 class SqlExcuteRequest(BaseModel):
     database_id: uuid.UUID
     sql: str
+    offset: int = Field(default=0, ge=0, description="跳过结果的前offset行，用于分页")
+    limit: Optional[int] = Field(default=None, gt=0, description="返回的最大行数，不超过SQL_EXECUTE_MAX_ROWS")
+    stream: bool = Field(default=False, description="是否以NDJSON流式返回结果")
 
 
 class SqlExampleGenerateRequest(BaseModel):
@@ -1,6 +1,12 @@
 from pydantic import BaseModel
-from typing import Any
+from typing import Any, Optional
 class ResponseData(BaseModel):
     code: int
     message: str
-    result: Any
\ No newline at end of file
+    result: Any
+
+
+class SqlExcuteResponseData(ResponseData):
+    truncated: bool = False
+    truncated_reason: Optional[str] = None
+    next_offset: Optional[int] = None
\ No newline at end of file
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import json
+import time
+import httpx
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(base_url, database_id, question, concurrency, total, use_llm_enhancements):
+    """以固定并发请求/sql/generate，统计吞吐量和时延"""
+    request_body = {
+        'database_id': database_id,
+        'question': question,
+        'use_llm_enhancements': use_llm_enhancements
+    }
+    latency = []
+    error_cnt = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        async def send():
+            nonlocal error_cnt
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    response = await client.post('/sql/generate', json=request_body)
+                    if response.status_code != 200 or response.json().get('code') != 200:
+                        error_cnt += 1
+                except Exception:
+                    error_cnt += 1
+                latency.append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        await asyncio.gather(*[send() for _ in range(total)])
+        elapsed = time.perf_counter() - start_time
+    return {
+        'concurrency': concurrency,
+        'total': total,
+        'error_cnt': error_cnt,
+        'throughput_per_second': total / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': percentile(latency, 0.5) * 1000,
+        'latency_p95_ms': percentile(latency, 0.95) * 1000,
+        'latency_max_ms': max(latency, default=0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/sql/generate并发压测，用于对比改动前后的吞吐量和时延")
+    parser.add_argument('--base-url', default='http://127.0.0.1:9015')
+    parser.add_argument('--database-id', required=True)
+    parser.add_argument('--question', required=True)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--total', type=int, default=64)
+    parser.add_argument('--use-llm-enhancements', action='store_true')
+    args = parser.parse_args()
+    reports = []
+    for concurrency in args.concurrency:
+        reports.append(asyncio.run(run(
+            args.base_url, args.database_id, args.question, concurrency, args.total, args.use_llm_enhancements)))
+    print(json.dumps(reports, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
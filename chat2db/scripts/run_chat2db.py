@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import pandas as pd
 import requests
@@ -175,6 +176,25 @@ def call_generate_sql_example(table_id, generate_cnt=1, sql_var=False):
     return response.json()
 
 
+# 执行sql，以NDJSON流式读取一页结果
+def call_execute_sql(database_id, sql, offset=0, limit=None):
+    url = f"http://{config['UVICORN_IP']}:{config['UVICORN_PORT']}/sql/execute"
+    request_body = {
+        "database_id": database_id,
+        "sql": sql,
+        "offset": offset,
+        "limit": limit,
+        "stream": True
+    }
+    with requests.post(url, json=request_body, stream=True) as response:
+        if response.headers.get('content-type', '').startswith('application/json'):
+            yield {'type': 'error', 'message': response.json().get('result')}
+            return
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
 def write_sql_example_to_excel(dir, sql_example_list):
     try:
         if not os.path.exists(os.path.dirname(dir)):
@@ -275,6 +295,14 @@ if __name__ == "__main__":
     parser_generate_sql_example.add_argument("--dir", type=str, required=False, help="生成的sql对输出路径",
                                              default="templetes/output_examples.xlsx")
 
+    # 执行sql
+    parser_execute_sql = subparsers.add_parser("execute_sql", help="在指定数据库上执行sql并分页输出结果")
+    parser_execute_sql.add_argument("--database_id", type=str, required=True, help="数据库id")
+    parser_execute_sql.add_argument("--sql", type=str, required=True, help="sql语句")
+    parser_execute_sql.add_argument("--page_size", type=int, required=False, help="每页行数", default=100)
+    parser_execute_sql.add_argument("--offset", type=int, required=False, help="起始行", default=0)
+    parser_execute_sql.add_argument("--all", action="store_true", help="读取全部分页，默认只读取一页")
+
     args = parser.parse_args()
 
     if os.path.exists(CONFIG_YAML_PATH):
@@ -432,5 +460,22 @@ if __name__ == "__main__":
             # 输出到execl中
             sql_example_list = response.get("result")['sql_example_list']
             write_sql_example_to_excel(args.dir, sql_example_list)
+    elif args.command == "execute_sql":
+        offset = args.offset
+        while offset is not None:
+            next_offset = None
+            for line in call_execute_sql(args.database_id, args.sql, offset, args.page_size):
+                if line['type'] == 'row':
+                    print(json.dumps(line['data'], ensure_ascii=False))
+                elif line['type'] == 'end':
+                    next_offset = line['next_offset']
+                    if line['truncated'] and not args.all:
+                        print(f"结果未读取完，可以使用--offset {next_offset}继续读取")
+                elif line['type'] == 'error':
+                    print("sql执行失败:", line['message'])
+            if args.all and next_offset is not None and next_offset <= offset:
+                print(f"offset未前进，停止读取，offset: {offset}")
+                break
+            offset = next_offset if args.all else None
     else:
         print("未知命令，请检查输入的命令是否正确。")
@@ -28,6 +28,7 @@ from data_chain.apps.base.task.worker import (
     import_dataset_worker,
     export_knowledge_base_worker,
     import_knowledge_base_worker,
+    reembed_knowledge_base_worker,
     generate_dataset_worker,
     acc_testing_worker,
     parse_document_worker
@@ -64,6 +65,7 @@ from data_chain.stores.database.database import (
     KnowledgeBaseEntity,
     DocumentTypeEntity
 )
+from data_chain.stores.database.migration import SchemaMigrator
 from data_chain.manager.role_manager import RoleManager
 from data_chain.manager.knowledge_manager import KnowledgeBaseManager
 from data_chain.manager.document_type_manager import DocumentTypeManager
@@ -80,18 +82,20 @@ from data_chain.entities.common import (
 # logging.getLogger('apscheduler').setLevel(logging.ERROR)
 from data_chain.apps.service.router_service import get_route_info
 from data_chain.apps.service.task_queue_service import TaskQueueService
-app = fastapi.FastAPI(docs_url=None, redoc_url=None)
+app = fastapi.FastAPI(docs_url=None, redoc_url=None, dependencies=[Depends(DataBase.request_session)])
 scheduler = AsyncIOScheduler()
 
 
 @app.on_event("startup")
 async def startup_event():
     await configure()
+    await migrate_database()
     await add_acitons()
     await TaskQueueService.init_task_queue()
     await add_knowledge_base()
     await add_document_type()
     await init_path()
+    await check_query_plans()
     scheduler.add_job(TaskQueueService.handle_tasks, 'interval', seconds=5)
     scheduler.start()
 
@@ -122,6 +126,28 @@ async def add_document_type():
     await DocumentTypeManager.add_document_type(document_type_entity)
 
 
+async def migrate_database():
+    """执行数据库结构迁移，迁移完成前不处理请求"""
+    try:
+        await DataBase.ensure_all_table()
+        await SchemaMigrator.migrate(DataBase.engine)
+        await SchemaMigrator.check_vector_dimensions(DataBase.engine)
+        await SchemaMigrator.check_compact_vector_indexes(DataBase.engine)
+    except Exception as e:
+        err = f"数据库结构迁移失败: {e}"
+        logging.exception(err)
+        raise e
+
+
+async def check_query_plans():
+    """检查热点查询是否能走索引"""
+    try:
+        await SchemaMigrator.check_hot_query_plans(DataBase.engine)
+    except Exception as e:
+        err = f"检查热点查询执行计划失败: {e}"
+        logging.warning(err)
+
+
 async def init_path():
     """初始化路径"""
     paths = [
@@ -63,6 +63,7 @@ from data_chain.stores.database.database import (
     RoleActionEntity
 )
 from data_chain.config.config import config
+from data_chain.embedding.embedding import Embedding
 from data_chain.logger.logger import logger as logging
 
 
@@ -299,7 +300,7 @@ class Convertor:
                 name=req.kb_name,
                 tokenizer=req.tokenizer.value,
                 description=req.description,
-                embedding_model=req.embedding_model,
+                embedding_model=Embedding.resolve_model_name(req.embedding_model),
                 upload_count_limit=req.upload_count_limit,
                 upload_size_limit=req.upload_size_limit,
                 default_parse_method=req.default_parse_method.value,
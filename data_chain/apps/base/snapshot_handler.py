@@ -0,0 +1,80 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import json
+import struct
+from typing import Any, BinaryIO, Iterator
+
+from data_chain.logger.logger import logger as logging
+
+
+class SnapshotRecordType:
+    """快照记录类型"""
+    DOC = 1
+    CHUNK = 2
+    IMAGE = 3
+
+
+class SnapshotHandler():
+    '''
+    文档解析结果快照
+    文件头为魔数和版本号，之后是顺序排列的记录，每条记录为:
+    [记录类型 uint8][元数据长度 uint32][元数据 json][数据长度 uint64][数据]
+    向量以小端float32存储在数据段，图片以原始字节存储在数据段，读写均可流式进行
+    '''
+    magic = b'WKBS'
+    version = 1
+    file_header = struct.Struct('<4sH')
+    record_header = struct.Struct('<BI')
+    blob_header = struct.Struct('<Q')
+
+    @staticmethod
+    def pack_vector(vector: list[float]) -> bytes:
+        if vector is None:
+            return b''
+        return struct.pack(f'<{len(vector)}f', *vector)
+
+    @staticmethod
+    def unpack_vector(blob: bytes) -> list[float]:
+        if not blob:
+            return None
+        return list(struct.unpack(f'<{len(blob) // 4}f', blob))
+
+    @staticmethod
+    def write_header(f: BinaryIO) -> None:
+        f.write(SnapshotHandler.file_header.pack(SnapshotHandler.magic, SnapshotHandler.version))
+
+    @staticmethod
+    def write_record(f: BinaryIO, record_type: int, meta: dict[str, Any], blob: bytes = b'') -> None:
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        f.write(SnapshotHandler.record_header.pack(record_type, len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(SnapshotHandler.blob_header.pack(len(blob)))
+        f.write(blob)
+
+    @staticmethod
+    def read_exactly(f: BinaryIO, size: int) -> bytes:
+        data = f.read(size)
+        if len(data) != size:
+            raise ValueError('快照文件被截断')
+        return data
+
+    @staticmethod
+    def iter_records(f: BinaryIO) -> Iterator[tuple[int, dict[str, Any], bytes]]:
+        '''按顺序读取快照记录'''
+        magic, version = SnapshotHandler.file_header.unpack(
+            SnapshotHandler.read_exactly(f, SnapshotHandler.file_header.size))
+        if magic != SnapshotHandler.magic or version > SnapshotHandler.version:
+            err = f"不支持的快照文件，magic: {magic}，version: {version}"
+            logging.error("[SnapshotHandler] %s", err)
+            raise ValueError(err)
+        while True:
+            header = f.read(SnapshotHandler.record_header.size)
+            if not header:
+                break
+            if len(header) != SnapshotHandler.record_header.size:
+                raise ValueError('快照文件被截断')
+            record_type, meta_len = SnapshotHandler.record_header.unpack(header)
+            meta = json.loads(SnapshotHandler.read_exactly(f, meta_len).decode('utf-8'))
+            blob_len, = SnapshotHandler.blob_header.unpack(
+                SnapshotHandler.read_exactly(f, SnapshotHandler.blob_header.size))
+            blob = SnapshotHandler.read_exactly(f, blob_len)
+            yield record_type, meta, blob
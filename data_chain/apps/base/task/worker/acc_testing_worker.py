@@ -11,6 +11,7 @@ from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
 from data_chain.apps.base.task.worker.base_worker import BaseWorker
 from data_chain.llm.llm import LLM
+from data_chain.llm.prompt_registry import prompt_registry
 from data_chain.rag.base_searcher import BaseSearcher
 from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus, DocumentStatus, DataSetStatus, QAStatus, TestingStatus, TestCaseStatus
 from data_chain.entities.common import DEFAULT_DOC_TYPE_ID, TESTING_REPORT_PATH_IN_OS, TESTING_REPORT_PATH_IN_MINIO
@@ -135,9 +136,7 @@ class TestingWorker(BaseWorker):
     async def testing(testing_entity: TestingEntity, qa_entities: list[QAEntity], llm: LLM) -> list[TestCaseEntity]:
         '''测试数据集'''
         testcase_entities = []
-        with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-            prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-        prompt_template = prompt_dict.get('LLM_PROMPT_TEMPLATE', '')
+        prompt_template = prompt_registry.get('LLM_PROMPT_TEMPLATE')
         for qa_entity in qa_entities:
             question = qa_entity.question
             answer = qa_entity.answer
@@ -1,19 +1,25 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import asyncio
+import collections
+import functools
 import uuid
 import os
 import shutil
 import yaml
-from data_chain.apps.base.zip_handler import ZipHandler
+from data_chain.apps.base.zip_handler import ZipStreamWriter
+from data_chain.apps.base.snapshot_handler import SnapshotHandler, SnapshotRecordType
 from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
 from data_chain.apps.base.task.worker.base_worker import BaseWorker
-from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus
-from data_chain.entities.common import EXPORT_KB_PATH_IN_OS, DOC_PATH_IN_MINIO, EXPORT_KB_PATH_IN_MINIO
+from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus, DocumentStatus
+from data_chain.entities.common import EXPORT_KB_PATH_IN_OS, DOC_PATH_IN_MINIO, EXPORT_KB_PATH_IN_MINIO, IMAGE_PATH_IN_MINIO
 from data_chain.manager.task_manager import TaskManager
 from data_chain.manager.knowledge_manager import KnowledgeBaseManager
 from data_chain.manager.document_manager import DocumentManager
+from data_chain.manager.chunk_manager import ChunkManager
+from data_chain.manager.image_manager import ImageManager
 from data_chain.manager.task_queue_mamanger import TaskQueueManager
-from data_chain.stores.database.database import TaskEntity, DocumentEntity
+from data_chain.stores.database.database import TaskEntity, DocumentEntity, ChunkEntity, ImageEntity
 from data_chain.stores.minio.minio import MinIO
 from data_chain.stores.mongodb.mongodb import Task
 
@@ -23,6 +29,8 @@ class ExportKnowledgeBaseWorker(BaseWorker):
     ExportKnowledgeBaseWorker
     """
     name = TaskType.KB_EXPORT.value
+    # 不超过该大小的文档预取到内存后写入压缩包
+    prefetch_size_limit = 8 * 1024 * 1024
 
     @staticmethod
     async def init(kb_id: uuid.UUID) -> uuid.UUID:
@@ -90,24 +98,7 @@ class ExportKnowledgeBaseWorker(BaseWorker):
         return task_id
 
     @staticmethod
-    async def init_path(task_id: uuid.UUID) -> tuple:
-        '''初始化存放配置文件和文档的路径'''
-        tmp_path = os.path.join(EXPORT_KB_PATH_IN_OS, str(task_id))
-        if os.path.exists(tmp_path):
-            shutil.rmtree(tmp_path)
-        os.mkdir(tmp_path)
-        source_path = os.path.join(tmp_path, "source")
-        target_path = os.path.join(tmp_path, f"zip")
-        os.mkdir(source_path)
-        os.mkdir(target_path)
-        doc_config_path = os.path.join(source_path, "doc_config")
-        doc_download_path = os.path.join(source_path, "doc_download")
-        os.mkdir(doc_config_path)
-        os.mkdir(doc_download_path)
-        return (source_path, target_path, doc_config_path, doc_download_path)
-
-    @staticmethod
-    async def create_knowledge_base_yaml_config(source_path: str, kb_id: uuid.UUID) -> None:
+    async def create_knowledge_base_yaml_config(zip_writer: ZipStreamWriter, kb_id: uuid.UUID) -> None:
         '''创建知识库yaml文件'''
         knowledge_base_entity = await KnowledgeBaseManager.get_knowledge_base_by_kb_id(kb_id)
         kb_dict = {
@@ -124,14 +115,11 @@ class ExportKnowledgeBaseWorker(BaseWorker):
         doc_type_entities = await KnowledgeBaseManager.list_doc_types_by_kb_id(kb_id)
         for doc_type_entity in doc_type_entities:
             kb_dict["doc_types"].append({"id": str(doc_type_entity.id), "name": doc_type_entity.name})
-        yaml_path = os.path.join(source_path, "kb_config.yaml")
-        with open(yaml_path, "w", encoding="utf-8", errors='ignore') as f:
-            yaml.dump(kb_dict, f, allow_unicode=True)
+        await zip_writer.write_bytes("kb_config.yaml", yaml.dump(kb_dict, allow_unicode=True).encode("utf-8", errors='ignore'))
 
     @staticmethod
-    async def create_document_yaml_config(doc_config_path: str, kb_id: uuid.UUID) -> None:
+    async def create_document_yaml_config(zip_writer: ZipStreamWriter, doc_entities: list[DocumentEntity]) -> None:
         '''创建文档yaml文件'''
-        doc_entities = await DocumentManager.list_all_document_by_kb_id(kb_id)
         for doc_entity in doc_entities:
             doc_dict = {
                 "id": str(doc_entity.id),
@@ -143,33 +131,125 @@ class ExportKnowledgeBaseWorker(BaseWorker):
                 "type_id": str(doc_entity.type_id),
                 "enabled": doc_entity.enabled,
             }
-            yaml_path = os.path.join(doc_config_path, f"{doc_entity.id}.yaml")
-            with open(yaml_path, "w", encoding="utf-8", errors='ignore') as f:
-                yaml.dump(doc_dict, f, allow_unicode=True)
+            await zip_writer.write_bytes(
+                f"doc_config/{doc_entity.id}.yaml", yaml.dump(doc_dict, allow_unicode=True).encode("utf-8", errors='ignore'))
 
     @staticmethod
-    async def download_document_from_minio(doc_config_path: str, kb_id: uuid.UUID) -> None:
-        '''从minio下载文档'''
-        doc_entities = await DocumentManager.list_all_document_by_kb_id(kb_id)
-        for doc_entity in doc_entities:
-            local_path = os.path.join(doc_config_path, f"{doc_entity.id}.{doc_entity.extension}")
-            await MinIO.download_object(DOC_PATH_IN_MINIO, str(doc_entity.id), local_path)
+    async def download_document_from_minio(zip_writer: ZipStreamWriter, doc_entities: list[DocumentEntity]) -> None:
+        '''从minio下载文档并写入压缩包'''
+        # 小文件按批并发预取到内存，写入当前批时下一批已在下载；大文件边下载边压缩
+        small_doc_entities = [doc_entity for doc_entity in doc_entities
+                              if (doc_entity.size or 0) <= ExportKnowledgeBaseWorker.prefetch_size_limit]
+        large_doc_entities = [doc_entity for doc_entity in doc_entities
+                              if (doc_entity.size or 0) > ExportKnowledgeBaseWorker.prefetch_size_limit]
+        batches = [small_doc_entities[index:index+MinIO.max_concurrency]
+                   for index in range(0, len(small_doc_entities), MinIO.max_concurrency)]
+
+        def prefetch(batch: list[DocumentEntity]) -> asyncio.Future:
+            return asyncio.ensure_future(asyncio.gather(*[
+                MinIO.get_object_bytes(DOC_PATH_IN_MINIO, str(doc_entity.id)) for doc_entity in batch]))
+        next_future = prefetch(batches[0]) if batches else None
+        for index, batch in enumerate(batches):
+            doc_blobs = await next_future
+            next_future = prefetch(batches[index+1]) if index + 1 < len(batches) else None
+            for doc_entity, doc_blob in zip(batch, doc_blobs):
+                if doc_blob is None:
+                    continue
+                await zip_writer.write_bytes(f"doc_download/{doc_entity.id}.{doc_entity.extension}", doc_blob)
+        for doc_entity in large_doc_entities:
+            await zip_writer.write_object(
+                f"doc_download/{doc_entity.id}.{doc_entity.extension}", DOC_PATH_IN_MINIO, str(doc_entity.id))
 
     @staticmethod
-    async def zip_config_and_document(source_path: str, target_path: str, task_id: uuid.UUID) -> None:
-        '''压缩配置文件和文档'''
-        zip_path = os.path.join(target_path, f"{task_id}.zip")
-        await ZipHandler.zip_dir(source_path, zip_path)
-        return zip_path
+    def get_snapshot_embedding_model(doc_entity: DocumentEntity, chunk_entities: list[ChunkEntity]) -> str:
+        '''文档摘要向量和分片向量实际使用的模型，混有多个模型或没有向量时返回None'''
+        embedding_models = {chunk_entity.embedding_model for chunk_entity in chunk_entities
+                            if chunk_entity.text_vector is not None}
+        if doc_entity.abstract_vector is not None:
+            embedding_models.add(doc_entity.embedding_model)
+        if len(embedding_models) != 1:
+            return None
+        return embedding_models.pop()
+
+    @staticmethod
+    def write_document_snapshot(
+            f, doc_entity: DocumentEntity, embedding_model: str,
+            chunk_entities: list[ChunkEntity], image_entities: list[ImageEntity]) -> None:
+        '''顺序写出快照记录，图片按顺序下载，同时预取的图片数不超过minio并发数'''
+        SnapshotHandler.write_header(f)
+        SnapshotHandler.write_record(f, SnapshotRecordType.DOC, {
+            "id": str(doc_entity.id),
+            "embedding_model": embedding_model,
+            "parse_relut_topology": doc_entity.parse_relut_topology,
+            "full_text": doc_entity.full_text,
+            "abstract": doc_entity.abstract,
+        }, SnapshotHandler.pack_vector(doc_entity.abstract_vector))
+        for chunk_entity in chunk_entities:
+            SnapshotHandler.write_record(f, SnapshotRecordType.CHUNK, {
+                "id": str(chunk_entity.id),
+                "text": chunk_entity.text,
+                "tokens": chunk_entity.tokens,
+                "type": chunk_entity.type,
+                "pre_id_in_parse_topology": str(chunk_entity.pre_id_in_parse_topology)
+                if chunk_entity.pre_id_in_parse_topology else None,
+                "parse_topology_type": chunk_entity.parse_topology_type,
+                "global_offset": chunk_entity.global_offset,
+                "local_offset": chunk_entity.local_offset,
+                "enabled": chunk_entity.enabled,
+            }, SnapshotHandler.pack_vector(chunk_entity.text_vector))
+        image_entities = iter(image_entities)
+        pending = collections.deque()
+
+        def prefetch() -> None:
+            image_entity = next(image_entities, None)
+            if image_entity is not None:
+                pending.append((image_entity, MinIO.executor.submit(
+                    MinIO.read_object_bytes, IMAGE_PATH_IN_MINIO, str(image_entity.chunk_id))))
+        for _ in range(MinIO.max_concurrency):
+            prefetch()
+        while pending:
+            image_entity, future = pending.popleft()
+            prefetch()
+            image_blob = future.result()
+            if image_blob is None:
+                continue
+            SnapshotHandler.write_record(f, SnapshotRecordType.IMAGE, {
+                "chunk_id": str(image_entity.chunk_id),
+                "extension": image_entity.extension,
+            }, image_blob)
 
     @staticmethod
-    async def upload_zip_to_minio(zip_path: str, task_id: uuid.UUID) -> None:
-        '''上传压缩包到minio'''
-        await MinIO.put_object(EXPORT_KB_PATH_IN_MINIO, str(task_id), zip_path)
+    async def create_document_snapshot(zip_writer: ZipStreamWriter, doc_entities: list[DocumentEntity]) -> None:
+        '''导出文档解析结果快照，包含分片、拓扑、向量和图片'''
+        for doc_entity in doc_entities:
+            if doc_entity.status != DocumentStatus.IDLE.value:
+                continue
+            try:
+                chunk_entities = await ChunkManager.list_all_chunk_by_doc_id(doc_entity.id)
+                if not chunk_entities:
+                    continue
+                embedding_model = ExportKnowledgeBaseWorker.get_snapshot_embedding_model(doc_entity, chunk_entities)
+                if embedding_model is None:
+                    # 重新向量化未完成的文档不导出快照，导入时重新解析
+                    warning = f"[ExportKnowledgeBaseWorker] 文档向量混有多个embedding模型，不导出快照，doc_id: {doc_entity.id}"
+                    logging.warning(warning)
+                    continue
+                image_entities = await ImageManager.list_images_by_doc_id(doc_entity.id)
+            except Exception as e:
+                err = f"[ExportKnowledgeBaseWorker] 导出文档解析结果快照失败，doc_id: {doc_entity.id}，错误信息: {e}"
+                logging.exception(err)
+                continue
+            # 快照记录直接压缩写入压缩包，写入失败时压缩包已不完整，异常向上抛出
+            await zip_writer.write_stream(
+                f"doc_snapshot/{doc_entity.id}.wkbs",
+                functools.partial(ExportKnowledgeBaseWorker.write_document_snapshot, doc_entity=doc_entity,
+                                  embedding_model=embedding_model, chunk_entities=chunk_entities,
+                                  image_entities=image_entities))
 
     @staticmethod
     async def run(task_id: uuid.UUID) -> None:
         '''运行任务'''
+        zip_writer = None
         try:
             task_entity = await TaskManager.get_task_by_task_id(task_id)
             if task_entity is None:
@@ -179,28 +259,34 @@ class ExportKnowledgeBaseWorker(BaseWorker):
             await KnowledgeBaseManager.update_knowledge_base_by_kb_id(task_entity.op_id, {"status": KnowledgeBaseStatus.EXPORTING.value})
             current_stage = 0
             stage_cnt = 6
-            source_path, target_path, doc_config_path, doc_download_path = await ExportKnowledgeBaseWorker.init_path(task_id)
+            # 压缩包边生成边以分片上传写入minio
+            zip_writer = ZipStreamWriter(EXPORT_KB_PATH_IN_MINIO, str(task_id))
+            await zip_writer.open()
             current_stage += 1
-            await ExportKnowledgeBaseWorker.report(task_id, "创建临时目录", current_stage, stage_cnt)
-            await ExportKnowledgeBaseWorker.create_knowledge_base_yaml_config(source_path, task_entity.op_id)
+            await ExportKnowledgeBaseWorker.report(task_id, "创建压缩包上传流", current_stage, stage_cnt)
+            await ExportKnowledgeBaseWorker.create_knowledge_base_yaml_config(zip_writer, task_entity.op_id)
             current_stage += 1
             await ExportKnowledgeBaseWorker.report(task_id, "创建知识库yaml配置文件", current_stage, stage_cnt)
-            await ExportKnowledgeBaseWorker.create_document_yaml_config(doc_config_path, task_entity.op_id)
+            doc_entities = await DocumentManager.list_all_document_by_kb_id(task_entity.op_id)
+            await ExportKnowledgeBaseWorker.create_document_yaml_config(zip_writer, doc_entities)
             current_stage += 1
             await ExportKnowledgeBaseWorker.report(task_id, "创建文档yaml配置文件", current_stage, stage_cnt)
-            await ExportKnowledgeBaseWorker.download_document_from_minio(doc_download_path, task_entity.op_id)
+            await ExportKnowledgeBaseWorker.download_document_from_minio(zip_writer, doc_entities)
             current_stage += 1
             await ExportKnowledgeBaseWorker.report(task_id, "下载文档", current_stage, stage_cnt)
-            zip_path = await ExportKnowledgeBaseWorker.zip_config_and_document(source_path, target_path, task_id)
+            await ExportKnowledgeBaseWorker.create_document_snapshot(zip_writer, doc_entities)
             current_stage += 1
-            await ExportKnowledgeBaseWorker.report(task_id, "压缩配置文件和文档", current_stage, stage_cnt)
-            await ExportKnowledgeBaseWorker.upload_zip_to_minio(zip_path, task_id)
+            await ExportKnowledgeBaseWorker.report(task_id, "导出文档解析结果快照", current_stage, stage_cnt)
+            await zip_writer.close()
+            zip_writer = None
             current_stage += 1
             await ExportKnowledgeBaseWorker.report(task_id, "上传压缩包到minio", current_stage, stage_cnt)
             await TaskQueueManager.add_task(Task(_id=task_id, status=TaskStatus.SUCCESS.value))
         except Exception as e:
             err = f"[ExportKnowledgeBaseWorker] 运行任务失败，task_id: {task_id}，错误信息: {e}"
             logging.exception(err)
+            if zip_writer is not None:
+                await zip_writer.abort(e)
             await TaskQueueManager.add_task(Task(_id=task_id, status=TaskStatus.FAILED.value))
             await ExportKnowledgeBaseWorker.report(task_id, err, 0, 1)
 
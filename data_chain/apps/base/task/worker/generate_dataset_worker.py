@@ -11,6 +11,7 @@ from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
 from data_chain.apps.base.task.worker.base_worker import BaseWorker
 from data_chain.llm.llm import LLM
+from data_chain.llm.prompt_registry import prompt_registry
 from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus, DocumentStatus, DataSetStatus, QAStatus
 from data_chain.entities.common import DEFAULT_DOC_TYPE_ID
 from data_chain.parser.tools.token_tool import TokenTool
@@ -136,11 +137,9 @@ class GenerateDataSetWorker(BaseWorker):
         index = 0
         d_index = 0
         random.shuffle(doc_chunks)
-        with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-            prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-        q_generate_prompt_template = prompt_dict.get('GENREATE_QUESTION_FROM_CONTENT_PROMPT', '')
-        answer_generate_prompt_template = prompt_dict.get('GENERATE_ANSWER_FROM_QUESTION_AND_CONTENT_PROMPT', '')
-        cal_qa_score_prompt_template = prompt_dict.get('CAL_QA_SCORE_PROMPT', '')
+        q_generate_prompt_template = prompt_registry.get('GENREATE_QUESTION_FROM_CONTENT_PROMPT')
+        answer_generate_prompt_template = prompt_registry.get('GENERATE_ANSWER_FROM_QUESTION_AND_CONTENT_PROMPT')
+        cal_qa_score_prompt_template = prompt_registry.get('CAL_QA_SCORE_PROMPT')
         dataset_score = 0
         logging.error(f"{chunk_index_list}")
         for i in range(len(doc_chunks)):
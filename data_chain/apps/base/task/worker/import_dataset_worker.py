@@ -10,6 +10,7 @@ from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
 from data_chain.apps.base.task.worker.base_worker import BaseWorker
 from data_chain.llm.llm import LLM
+from data_chain.llm.prompt_registry import prompt_registry
 from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus, DocumentStatus, DataSetStatus, QAStatus, ChunkType
 from data_chain.entities.common import DEFAULT_DOC_TYPE_ID, IMPORT_DATASET_PATH_IN_OS, IMPORT_DATASET_PATH_IN_MINIO
 from data_chain.parser.parse_result import ParseResult, ParseNode
@@ -190,9 +191,7 @@ class ImportDataSetWorker(BaseWorker):
         if not qa_entities:
             return
         databse_score = 0
-        with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-            prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-        cal_qa_score_prompt_template = prompt_dict.get('CAL_QA_SCORE_PROMPT', '')
+        cal_qa_score_prompt_template = prompt_registry.get('CAL_QA_SCORE_PROMPT')
         for qa_entity in qa_entities:
             chunk = qa_entity.chunk
             question = qa_entity.question
@@ -1,22 +1,27 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import asyncio
+import itertools
 import uuid
 import os
 import shutil
+import zipfile
 import yaml
-from data_chain.apps.base.zip_handler import ZipHandler
+from data_chain.apps.base.snapshot_handler import SnapshotHandler, SnapshotRecordType
 from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
 from data_chain.apps.service.task_queue_service import TaskQueueService
 from data_chain.apps.base.task.worker.base_worker import BaseWorker
-from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus, DocumentStatus
-from data_chain.entities.common import DEFAULT_DOC_TYPE_ID, IMPORT_KB_PATH_IN_OS, DOC_PATH_IN_MINIO, IMPORT_KB_PATH_IN_MINIO
+from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus, DocumentStatus, ChunkStatus, ImageStatus
+from data_chain.entities.common import DEFAULT_DOC_TYPE_ID, IMPORT_KB_PATH_IN_OS, DOC_PATH_IN_MINIO, IMPORT_KB_PATH_IN_MINIO, IMAGE_PATH_IN_MINIO
 from data_chain.manager.task_manager import TaskManager
 from data_chain.manager.knowledge_manager import KnowledgeBaseManager
 from data_chain.manager.document_type_manager import DocumentTypeManager
 from data_chain.manager.document_manager import DocumentManager
+from data_chain.manager.chunk_manager import ChunkManager
+from data_chain.manager.image_manager import ImageManager
 from data_chain.manager.task_queue_mamanger import TaskQueueManager
-from data_chain.stores.database.database import TaskEntity, DocumentEntity, DocumentTypeEntity
-from data_chain.stores.minio.minio import MinIO
+from data_chain.stores.database.database import TaskEntity, DocumentEntity, DocumentTypeEntity, ChunkEntity, ImageEntity
+from data_chain.stores.minio.minio import MinIO, MinIOObjectReader
 from data_chain.stores.mongodb.mongodb import Task
 
 
@@ -25,6 +30,10 @@ class ImportKnowledgeBaseWorker(BaseWorker):
     ImportKnowledgeBaseWorker
     """
     name = TaskType.KB_IMPORT.value
+    # 不超过该大小的文档解压到内存后并发上传
+    prefetch_size_limit = 8 * 1024 * 1024
+    # 每次从压缩包读取的快照记录数
+    snapshot_read_batch_size = 256
 
     @staticmethod
     async def init(kb_id: uuid.UUID) -> uuid.UUID:
@@ -80,35 +89,34 @@ class ImportKnowledgeBaseWorker(BaseWorker):
         return task_id
 
     @staticmethod
-    async def init_path(task_id: uuid.UUID) -> tuple:
-        '''初始化存放配置文件和文档的路径'''
-        tmp_path = os.path.join(IMPORT_KB_PATH_IN_OS, str(task_id))
-        if os.path.exists(tmp_path):
-            shutil.rmtree(tmp_path)
-        os.mkdir(tmp_path)
-        source_path = os.path.join(tmp_path, f"{task_id}.zip")
-        target_path = os.path.join(tmp_path, "target")
-        os.mkdir(target_path)
-        doc_config_path = os.path.join(target_path, "doc_config")
-        doc_download_path = os.path.join(target_path, "doc_download")
-        return (source_path, target_path, doc_config_path, doc_download_path)
+    async def open_zip_from_minio(kb_id: uuid.UUID) -> zipfile.ZipFile:
+        '''直接以范围请求读取minio中的zip文件，不下载到本地'''
+        def open_zip():
+            reader = MinIOObjectReader(IMPORT_KB_PATH_IN_MINIO, str(kb_id))
+            try:
+                return zipfile.ZipFile(reader)
+            except Exception:
+                reader.close()
+                raise
+        return await asyncio.to_thread(open_zip)
 
     @staticmethod
-    async def download_zip_from_minio(source_path: str, kb_id: uuid.UUID) -> None:
-        '''从minio下载zip文件'''
-        await MinIO.download_object(IMPORT_KB_PATH_IN_MINIO, str(kb_id), source_path)
+    def close_zip(zip_file: zipfile.ZipFile) -> None:
+        '''关闭zip文件，传入文件对象打开的ZipFile不会关闭底层读取器，需要单独关闭'''
+        reader = zip_file.fp
+        zip_file.close()
+        if reader is not None:
+            reader.close()
 
     @staticmethod
-    async def unzip_config_and_document(source_path: str, target_path: str) -> None:
-        '''解压zip文件'''
-        await ZipHandler.unzip_file(source_path, target_path)
+    async def read_yaml_from_zip(zip_file: zipfile.ZipFile, name: str) -> dict:
+        content = await asyncio.to_thread(zip_file.read, name)
+        return yaml.load(content.decode("utf-8"), Loader=yaml.SafeLoader)
 
     @staticmethod
-    async def add_doc_types_to_kb(kb_id: uuid.UUID, source_path: str) -> dict[uuid.UUID, uuid.UUID]:
+    async def add_doc_types_to_kb(kb_id: uuid.UUID, zip_file: zipfile.ZipFile) -> dict[uuid.UUID, uuid.UUID]:
         '''添加文档类型到知识库'''
-        yaml_path = os.path.join(source_path, "kb_config.yaml")
-        with open(yaml_path, "r", encoding="utf-8") as f:
-            kb_config = yaml.load(f, Loader=yaml.SafeLoader)
+        kb_config = await ImportKnowledgeBaseWorker.read_yaml_from_zip(zip_file, "kb_config.yaml")
         doc_types_old_id_map_to_new_id = {}
         doc_type_dicts = kb_config.get("doc_types", [])
         for doc_type_dict in doc_type_dicts:
@@ -122,22 +130,19 @@ class ImportKnowledgeBaseWorker(BaseWorker):
         return doc_types_old_id_map_to_new_id
 
     @staticmethod
-    async def add_docs_to_kb(kb_id: uuid.UUID, doc_config_path: str, doc_download_path: str,
-                             doc_types_old_id_map_to_new_id: dict[uuid.UUID, uuid.UUID]) -> dict[uuid.UUID, uuid.UUID]:
+    async def add_docs_to_kb(kb_id: uuid.UUID, zip_file: zipfile.ZipFile,
+                             doc_types_old_id_map_to_new_id: dict[uuid.UUID, uuid.UUID]) -> dict[str, uuid.UUID]:
         '''添加文档到知识库'''
         kb_entity = await KnowledgeBaseManager.get_knowledge_base_by_kb_id(kb_id)
         doc_old_id_map_to_new_id = {}
-        doc_config_names = os.listdir(doc_config_path)
+        member_names = set(zip_file.namelist())
+        doc_config_names = [name for name in member_names if name.startswith("doc_config/") and name.endswith(".yaml")]
         for doc_config_name in doc_config_names:
             try:
-                yaml_path = os.path.join(doc_config_path, doc_config_name)
-                with open(yaml_path, "r", encoding="utf-8") as f:
-                    doc_config = yaml.load(f, Loader=yaml.SafeLoader)
+                doc_config = await ImportKnowledgeBaseWorker.read_yaml_from_zip(zip_file, doc_config_name)
                 old_doc_id = doc_config["id"]
                 extension = doc_config["extension"]
-                doc_name = f"{old_doc_id}.{extension}"
-                doc_path = os.path.join(doc_download_path, doc_name)
-                if not os.path.exists(doc_path):
+                if f"doc_download/{old_doc_id}.{extension}" not in member_names:
                     continue
                 doc_type_id = doc_types_old_id_map_to_new_id.get(doc_config.get("type_id"), DEFAULT_DOC_TYPE_ID)
                 document_entity = DocumentEntity(
@@ -158,7 +163,7 @@ class ImportKnowledgeBaseWorker(BaseWorker):
                 if document_entity:
                     doc_old_id_map_to_new_id[doc_config.get('id', '')] = document_entity.id
             except Exception as e:
-                err = f"[ImportKnowledgeBaseWorker] 添加文档失败，文档配置文件: {doc_config_path}，错误信息: {e}"
+                err = f"[ImportKnowledgeBaseWorker] 添加文档失败，文档配置文件: {doc_config_name}，错误信息: {e}"
                 logging.exception(err)
                 continue
         await KnowledgeBaseManager.update_doc_cnt_and_doc_size(kb_id)
@@ -166,32 +171,200 @@ class ImportKnowledgeBaseWorker(BaseWorker):
 
     @staticmethod
     async def upload_document_to_minio(
-            doc_download_path: str, doc_old_id_map_to_new_id: dict[uuid.UUID, uuid.UUID]) -> None:
-        '''上传文档到minio'''
-        doc_names = os.listdir(doc_download_path)
-        for doc_name in doc_names:
+            zip_file: zipfile.ZipFile, doc_old_id_map_to_new_id: dict[str, uuid.UUID]) -> None:
+        '''边解压边上传文档到minio'''
+        # 小文件解压到内存后并发上传，未完成的上传数受限；大文件直接从压缩流分片上传
+        semaphore = asyncio.Semaphore(MinIO.max_concurrency)
+        upload_tasks = []
+
+        async def upload_from_bytes(file_index: str, member_name: str, data: bytes) -> None:
             try:
-                doc_path = os.path.join(doc_download_path, doc_name)
-                if not os.path.exists(doc_path):
-                    continue
-                old_id = doc_name.split('.')[0]
-                if old_id in doc_old_id_map_to_new_id.keys():
-                    await MinIO.put_object(DOC_PATH_IN_MINIO, str(doc_old_id_map_to_new_id.get(old_id)), doc_path)
+                if not await MinIO.put_object_from_bytes(DOC_PATH_IN_MINIO, file_index, data):
+                    err = f"[ImportKnowledgeBaseWorker] 上传文档失败，文档: {member_name}"
+                    logging.error(err)
+            finally:
+                semaphore.release()
+
+        def upload_from_zip(file_index: str, member_info: zipfile.ZipInfo) -> None:
+            with zip_file.open(member_info) as f:
+                MinIO.client.put_object(
+                    DOC_PATH_IN_MINIO, file_index, f, member_info.file_size, part_size=MinIO.part_size)
+        for member_info in zip_file.infolist():
+            if not member_info.filename.startswith("doc_download/"):
+                continue
+            old_id = os.path.basename(member_info.filename).split('.')[0]
+            if old_id not in doc_old_id_map_to_new_id.keys():
+                continue
+            file_index = str(doc_old_id_map_to_new_id.get(old_id))
+            try:
+                if member_info.file_size <= ImportKnowledgeBaseWorker.prefetch_size_limit:
+                    await semaphore.acquire()
+                    try:
+                        data = await asyncio.to_thread(zip_file.read, member_info)
+                    except Exception:
+                        semaphore.release()
+                        raise
+                    upload_tasks.append(asyncio.ensure_future(
+                        upload_from_bytes(file_index, member_info.filename, data)))
+                else:
+                    await MinIO.run_in_executor(upload_from_zip, file_index, member_info)
             except Exception as e:
-                err = f"[ImportKnowledgeBaseWorker] 上传文档失败，文档路径: {doc_path}，错误信息: {e}"
+                err = f"[ImportKnowledgeBaseWorker] 上传文档失败，文档: {member_info.filename}，错误信息: {e}"
                 logging.exception(err)
                 continue
+        await asyncio.gather(*upload_tasks)
+
+    @staticmethod
+    async def load_doc_snapshot(
+            zip_file: zipfile.ZipFile, member_name: str, doc_entity: DocumentEntity, embedding_model: str) -> bool:
+        '''从快照直接写入文档的分片、向量和图片，快照的embedding模型与知识库不一致时返回False'''
+        # 分片id重新生成，拓扑中的前驱id可能先于分片本身出现，统一通过映射表分配
+        chunk_id_map = {}
+        doc_dict = None
+        chunk_entities = []
+        image_entities = []
+        image_uploads = []
+        # 快照按批解压读取，图片读到后即上传，同时上传的图片数不超过minio并发数
+        # 加载失败时ImageEntity可能尚未写入，按已上传的图片清理对象
+        uploaded_image_ids = []
+        loaded = False
+        try:
+            f = await asyncio.to_thread(zip_file.open, member_name)
+            try:
+                records = SnapshotHandler.iter_records(f)
+                while True:
+                    batch = await asyncio.to_thread(
+                        lambda: list(itertools.islice(records, ImportKnowledgeBaseWorker.snapshot_read_batch_size)))
+                    if not batch:
+                        break
+                    for record_type, meta, blob in batch:
+                        if record_type == SnapshotRecordType.DOC:
+                            if meta.get("embedding_model") != embedding_model:
+                                warning = f"[ImportKnowledgeBaseWorker] 快照embedding模型与当前不一致，doc_id: {doc_entity.id}，快照模型: {meta.get('embedding_model')}"
+                                logging.warning(warning)
+                                return False
+                            doc_dict = {
+                                "parse_relut_topology": meta.get("parse_relut_topology"),
+                                "full_text": meta.get("full_text"),
+                                "abstract": meta.get("abstract", ""),
+                                "abstract_vector": SnapshotHandler.unpack_vector(blob),
+                                "embedding_model": embedding_model,
+                            }
+                            continue
+                        if doc_dict is None:
+                            raise ValueError("快照缺少文档记录")
+                        if record_type == SnapshotRecordType.CHUNK:
+                            chunk_id = chunk_id_map.setdefault(meta["id"], uuid.uuid4())
+                            pre_id = meta.get("pre_id_in_parse_topology")
+                            chunk_entities.append(ChunkEntity(
+                                id=chunk_id,
+                                team_id=doc_entity.team_id,
+                                kb_id=doc_entity.kb_id,
+                                doc_id=doc_entity.id,
+                                doc_name=doc_entity.name,
+                                text=meta.get("text", ""),
+                                text_vector=SnapshotHandler.unpack_vector(blob),
+                                embedding_model=embedding_model,
+                                tokens=meta.get("tokens", 0),
+                                type=meta.get("type"),
+                                pre_id_in_parse_topology=chunk_id_map.setdefault(pre_id, uuid.uuid4()) if pre_id else None,
+                                parse_topology_type=meta.get("parse_topology_type"),
+                                global_offset=meta.get("global_offset"),
+                                local_offset=meta.get("local_offset"),
+                                enabled=meta.get("enabled", True),
+                                status=ChunkStatus.EXISTED.value
+                            ))
+                            if len(chunk_entities) >= 1024:
+                                if await ChunkManager.add_chunks(chunk_entities) is None:
+                                    raise Exception("批量写入分片失败")
+                                chunk_entities = []
+                        elif record_type == SnapshotRecordType.IMAGE:
+                            chunk_id = chunk_id_map.setdefault(meta["chunk_id"], uuid.uuid4())
+                            extension = meta.get("extension", "")
+                            image_uploads.append(asyncio.ensure_future(
+                                MinIO.put_object_from_bytes(IMAGE_PATH_IN_MINIO, str(chunk_id), blob)))
+                            uploaded_image_ids.append(str(chunk_id))
+                            image_entities.append(ImageEntity(
+                                id=uuid.uuid4(),
+                                team_id=doc_entity.team_id,
+                                doc_id=doc_entity.id,
+                                chunk_id=chunk_id,
+                                extension=extension,
+                            ))
+                            if len(image_uploads) >= MinIO.max_concurrency:
+                                await asyncio.gather(*image_uploads)
+                                image_uploads = []
+                await asyncio.gather(*image_uploads)
+            finally:
+                # 出错时等待其余上传结束后再清理，避免删除后仍有上传写入
+                await asyncio.gather(*image_uploads, return_exceptions=True)
+                await asyncio.to_thread(f.close)
+            if doc_dict is None:
+                return False
+            if chunk_entities and await ChunkManager.add_chunks(chunk_entities) is None:
+                raise Exception("批量写入分片失败")
+            index = 0
+            while index < len(image_entities):
+                await ImageManager.add_images(image_entities[index:index+1024])
+                index += 1024
+            await DocumentManager.update_document_by_doc_id(doc_entity.id, doc_dict)
+            task_entity = TaskEntity(
+                team_id=doc_entity.team_id,
+                user_id=doc_entity.author_id,
+                op_id=doc_entity.id,
+                op_name=doc_entity.name,
+                type=TaskType.DOC_PARSE.value,
+                retry=0,
+                status=TaskStatus.SUCCESS.value)
+            await TaskManager.add_task(task_entity)
+            loaded = True
+            return True
+        finally:
+            if not loaded and uploaded_image_ids:
+                await MinIO.delete_objects(IMAGE_PATH_IN_MINIO, uploaded_image_ids)
+
+    @staticmethod
+    async def load_doc_snapshots(
+            zip_file: zipfile.ZipFile,
+            doc_old_id_map_to_new_id: dict[str, uuid.UUID]) -> list[uuid.UUID]:
+        '''加载文档解析结果快照，返回已加载的文档id'''
+        loaded_doc_ids = []
+        embedding_model = None
+        for member_name in zip_file.namelist():
+            if not member_name.startswith("doc_snapshot/"):
+                continue
+            old_doc_id = os.path.basename(member_name).split('.')[0]
+            doc_id = doc_old_id_map_to_new_id.get(old_doc_id)
+            if doc_id is None:
+                continue
+            try:
+                doc_entity = await DocumentManager.get_document_by_doc_id(doc_id)
+                if embedding_model is None:
+                    embedding_model = await KnowledgeBaseManager.get_embedding_model(doc_entity.kb_id)
+                if await ImportKnowledgeBaseWorker.load_doc_snapshot(zip_file, member_name, doc_entity, embedding_model):
+                    loaded_doc_ids.append(doc_id)
+            except Exception as e:
+                err = f"[ImportKnowledgeBaseWorker] 加载文档解析结果快照失败，doc_id: {doc_id}，错误信息: {e}"
+                logging.exception(err)
+                await ChunkManager.update_chunk_by_doc_id(doc_id, {"status": ChunkStatus.DELETED.value})
+                chunk_ids = await ImageManager.delete_images_by_doc_id(doc_id)
+                await MinIO.delete_objects(IMAGE_PATH_IN_MINIO, [str(chunk_id) for chunk_id in chunk_ids])
+        return loaded_doc_ids
 
     @staticmethod
-    async def init_doc_parse_tasks(kb_id: uuid.UUID) -> None:
-        '''初始化文档解析任务'''
+    async def init_doc_parse_tasks(kb_id: uuid.UUID, loaded_doc_ids: list[uuid.UUID] = []) -> None:
+        '''初始化文档解析任务，已从快照加载的文档不再解析'''
+        loaded_doc_ids = set(loaded_doc_ids)
         document_entities = await DocumentManager.list_all_document_by_kb_id(kb_id)
         for document_entity in document_entities:
+            if document_entity.id in loaded_doc_ids:
+                continue
             await TaskQueueService.init_task(TaskType.DOC_PARSE.value, document_entity.id)
 
     @staticmethod
     async def run(task_id: uuid.UUID) -> None:
         '''运行任务'''
+        zip_file = None
         try:
             task_entity = await TaskManager.get_task_by_task_id(task_id)
             if task_entity is None:
@@ -200,27 +373,24 @@ class ImportKnowledgeBaseWorker(BaseWorker):
                 raise Exception(err)
             await KnowledgeBaseManager.update_knowledge_base_by_kb_id(task_entity.op_id, {"status": KnowledgeBaseStatus.IMPORTING.value})
             current_stage = 0
-            stage_cnt = 7
-            source_path, target_path, doc_config_path, doc_download_path = await ImportKnowledgeBaseWorker.init_path(task_id)
-            current_stage += 1
-            await ImportKnowledgeBaseWorker.report(task_id, "初始化路径", current_stage, stage_cnt)
+            stage_cnt = 6
             kb_id = task_entity.op_id
-            await ImportKnowledgeBaseWorker.download_zip_from_minio(source_path, kb_id)
-            current_stage += 1
-            await ImportKnowledgeBaseWorker.report(task_id, "下载zip文件", current_stage, stage_cnt)
-            await ImportKnowledgeBaseWorker.unzip_config_and_document(source_path, target_path)
+            zip_file = await ImportKnowledgeBaseWorker.open_zip_from_minio(kb_id)
             current_stage += 1
-            await ImportKnowledgeBaseWorker.report(task_id, "解压zip文件", current_stage, stage_cnt)
-            doc_types_old_id_map_to_new_id = await ImportKnowledgeBaseWorker.add_doc_types_to_kb(kb_id, target_path)
+            await ImportKnowledgeBaseWorker.report(task_id, "读取zip文件目录", current_stage, stage_cnt)
+            doc_types_old_id_map_to_new_id = await ImportKnowledgeBaseWorker.add_doc_types_to_kb(kb_id, zip_file)
             current_stage += 1
             await ImportKnowledgeBaseWorker.report(task_id, "添加文档类型到知识库", current_stage, stage_cnt)
-            doc_old_id_map_to_new_id = await ImportKnowledgeBaseWorker.add_docs_to_kb(kb_id, doc_config_path, doc_download_path, doc_types_old_id_map_to_new_id)
+            doc_old_id_map_to_new_id = await ImportKnowledgeBaseWorker.add_docs_to_kb(kb_id, zip_file, doc_types_old_id_map_to_new_id)
             current_stage += 1
             await ImportKnowledgeBaseWorker.report(task_id, "添加文档到知识库", current_stage, stage_cnt)
-            await ImportKnowledgeBaseWorker.upload_document_to_minio(doc_download_path, doc_old_id_map_to_new_id)
+            await ImportKnowledgeBaseWorker.upload_document_to_minio(zip_file, doc_old_id_map_to_new_id)
             current_stage += 1
             await ImportKnowledgeBaseWorker.report(task_id, "上传文档到minio", current_stage, stage_cnt)
-            await ImportKnowledgeBaseWorker.init_doc_parse_tasks(kb_id)
+            loaded_doc_ids = await ImportKnowledgeBaseWorker.load_doc_snapshots(zip_file, doc_old_id_map_to_new_id)
+            current_stage += 1
+            await ImportKnowledgeBaseWorker.report(task_id, "加载文档解析结果快照", current_stage, stage_cnt)
+            await ImportKnowledgeBaseWorker.init_doc_parse_tasks(kb_id, loaded_doc_ids)
             current_stage += 1
             await ImportKnowledgeBaseWorker.report(task_id, "初始化文档解析任务", current_stage, stage_cnt)
             await TaskQueueManager.add_task(Task(_id=task_id, status=TaskStatus.SUCCESS.value))
@@ -229,6 +399,9 @@ class ImportKnowledgeBaseWorker(BaseWorker):
             logging.exception(err)
             await TaskQueueManager.add_task(Task(_id=task_id, status=TaskStatus.FAILED.value))
             await ImportKnowledgeBaseWorker.report(task_id, err, 0, 1)
+        finally:
+            if zip_file is not None:
+                await asyncio.to_thread(ImportKnowledgeBaseWorker.close_zip, zip_file)
 
     @staticmethod
     async def stop(task_id: uuid.UUID) -> uuid.UUID:
@@ -1,5 +1,6 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
 from typing import Any
+import asyncio
 import uuid
 import os
 import shutil
@@ -37,6 +38,12 @@ from data_chain.stores.mongodb.mongodb import Task
 class ParseDocumentWorker(BaseWorker):
     name = TaskType.DOC_PARSE.value
 
+    @staticmethod
+    async def delete_images(doc_id: uuid.UUID) -> None:
+        '''删除文档上次解析产生的图片，图片以分片ID命名，重新解析后不会再被引用'''
+        chunk_ids = await ImageManager.delete_images_by_doc_id(doc_id)
+        await MinIO.delete_objects(IMAGE_PATH_IN_MINIO, [str(chunk_id) for chunk_id in chunk_ids])
+
     @staticmethod
     async def init(doc_id: uuid.UUID) -> uuid.UUID:
         '''初始化任务'''
@@ -46,7 +53,7 @@ class ParseDocumentWorker(BaseWorker):
             logging.exception(err)
             raise None
         await DocumentManager.update_document_by_doc_id(doc_id, {"status": DocumentStatus.PENDING.value, "abstract": "", "abstract_vector": None})
-        await ImageManager.update_images_by_doc_id(doc_id, {"status": ImageStatus.DELETED.value})
+        await ParseDocumentWorker.delete_images(doc_id)
         await ChunkManager.update_chunk_by_doc_id(doc_id, {"status": ChunkStatus.DELETED.value})
         task_entity = TaskEntity(
             team_id=doc_entity.team_id,
@@ -69,7 +76,7 @@ class ParseDocumentWorker(BaseWorker):
             return False
         doc_id = task_entity.op_id
         await DocumentManager.update_document_by_doc_id(doc_id, {"abstract": "", "abstract_vector": None})
-        await ImageManager.update_images_by_doc_id(doc_id, {"status": ImageStatus.DELETED.value})
+        await ParseDocumentWorker.delete_images(doc_id)
         await ChunkManager.update_chunk_by_doc_id(doc_id, {"status": ChunkStatus.DELETED.value})
         tmp_path = os.path.join(DOC_PATH_IN_OS, str(task_id))
         if os.path.exists(tmp_path):
@@ -224,6 +231,7 @@ class ParseDocumentWorker(BaseWorker):
             parse_result: ParseResult, doc_entity: DocumentEntity, image_path: str) -> None:
         '''上传解析图片到minio'''
         image_entities = []
+        image_blobs = []
         for node in parse_result.nodes:
             if node.type == ChunkType.IMAGE:
                 try:
@@ -236,20 +244,24 @@ class ParseDocumentWorker(BaseWorker):
                         extension=extension,
                     )
                     image_entities.append(image_entity)
-                    image_blob = node.content
-                    image_file_path = os.path.join(image_path, str(node.id) + '.' + extension)
-                    with open(image_file_path, 'wb') as f:
-                        f.write(image_blob)
-                    await MinIO.put_object(
-                        IMAGE_PATH_IN_MINIO,
-                        str(node.id),
-                        image_file_path
-                    )
+                    image_blobs.append(node.content)
                 except Exception as e:
-                    err = f"[ParseDocumentWorker] 上传解析图片到minio失败，doc_id: {doc_entity.id}, image_path: {image_path}, error: {e}"
+                    err = f"[ParseDocumentWorker] 获取解析图片类型失败，doc_id: {doc_entity.id}, error: {e}"
                     logging.exception(err)
                     continue
-                image_entities.append(image_entity)
+        # 图片直接从内存并发上传，上传失败的图片不写入数据库
+        results = await asyncio.gather(*[
+            MinIO.put_object_from_bytes(IMAGE_PATH_IN_MINIO, str(image_entity.chunk_id), image_blob)
+            for image_entity, image_blob in zip(image_entities, image_blobs)
+        ])
+        uploaded_image_entities = []
+        for image_entity, result in zip(image_entities, results):
+            if result:
+                uploaded_image_entities.append(image_entity)
+            else:
+                err = f"[ParseDocumentWorker] 上传解析图片到minio失败，doc_id: {doc_entity.id}, image_id: {image_entity.chunk_id}"
+                logging.error(err)
+        image_entities = uploaded_image_entities
         index = 0
         while index < len(image_entities):
             try:
@@ -396,7 +408,8 @@ class ParseDocumentWorker(BaseWorker):
             await dfs(parse_result.nodes[0], None, llm)
 
     @staticmethod
-    async def update_doc_abstract(doc_id: uuid.UUID, parse_result: ParseResult, llm: LLM = None) -> str:
+    async def update_doc_abstract(
+            doc_id: uuid.UUID, parse_result: ParseResult, llm: LLM = None, embedding_model: str = None) -> str:
         '''获取文档摘要'''
         abstract = ""
         for node in parse_result.nodes:
@@ -406,24 +419,27 @@ class ParseDocumentWorker(BaseWorker):
         else:
             keywords = TokenTool.get_top_k_keywords(abstract, 20)
             abstract = ' '.join(keywords)
-        abstract_vector = await Embedding.vectorize_embedding(abstract)
+        abstract_vector = await Embedding.vectorize_embedding(abstract, embedding_model)
         await DocumentManager.update_document_by_doc_id(
             doc_id,
             {
                 "abstract": abstract,
-                "abstract_vector": abstract_vector
+                "abstract_vector": abstract_vector,
+                "abstract_vector_shadow": None,
+                "embedding_model": Embedding.resolve_model_name(embedding_model)
             }
         )
         return abstract
 
     @staticmethod
-    async def embedding_chunk(parse_result: ParseResult) -> None:
+    async def embedding_chunk(parse_result: ParseResult, embedding_model: str = None) -> None:
         '''嵌入chunk'''
         for node in parse_result.nodes:
-            node.vector = await Embedding.vectorize_embedding(node.text_feature)
+            node.vector = await Embedding.vectorize_embedding(node.text_feature, embedding_model)
 
     @staticmethod
-    async def add_parse_result_to_db(parse_result: ParseResult, doc_entity: DocumentEntity) -> None:
+    async def add_parse_result_to_db(
+            parse_result: ParseResult, doc_entity: DocumentEntity, embedding_model: str = None) -> None:
         '''添加解析结果到数据库'''
         chunk_entities = []
         global_offset = 0
@@ -439,6 +455,7 @@ class ParseDocumentWorker(BaseWorker):
                 doc_name=doc_entity.name,
                 text=node.content,
                 text_vector=node.vector,
+                embedding_model=Embedding.resolve_model_name(embedding_model),
                 tokens=TokenTool.get_tokens(node.content),
                 type=node.type,
                 pre_id_in_parse_topology=node.pre_id,
@@ -486,6 +503,8 @@ class ParseDocumentWorker(BaseWorker):
                 )
             else:
                 llm = None
+            # 使用知识库当前的向量化模型，重新向量化任务负责补齐目标模型的影子向量
+            embedding_model = await KnowledgeBaseManager.get_embedding_model(doc_entity.kb_id)
             tmp_path, image_path = await ParseDocumentWorker.init_path(task_id)
             current_stage = 0
             stage_cnt = 10
@@ -511,13 +530,13 @@ class ParseDocumentWorker(BaseWorker):
             await ParseDocumentWorker.push_up_words_feature(parse_result, llm)
             current_stage += 1
             await ParseDocumentWorker.report(task_id, '推送上层词特征', current_stage, stage_cnt)
-            await ParseDocumentWorker.embedding_chunk(parse_result)
+            await ParseDocumentWorker.embedding_chunk(parse_result, embedding_model)
             current_stage += 1
             await ParseDocumentWorker.report(task_id, '嵌入chunk', current_stage, stage_cnt)
-            await ParseDocumentWorker.update_doc_abstract(doc_entity.id, parse_result, llm)
+            await ParseDocumentWorker.update_doc_abstract(doc_entity.id, parse_result, llm, embedding_model)
             current_stage += 1
             await ParseDocumentWorker.report(task_id, '更新文档摘要', current_stage, stage_cnt)
-            await ParseDocumentWorker.add_parse_result_to_db(parse_result, doc_entity)
+            await ParseDocumentWorker.add_parse_result_to_db(parse_result, doc_entity, embedding_model)
             current_stage += 1
             await ParseDocumentWorker.report(task_id, '添加解析结果到数据库', current_stage, stage_cnt)
             await TaskQueueManager.add_task(Task(_id=task_id, status=TaskStatus.SUCCESS.value))
@@ -557,7 +576,7 @@ class ParseDocumentWorker(BaseWorker):
         await DocumentManager.update_document_by_doc_id(task_entity.op_id, {"status": DocumentStatus.IDLE.value})
         if task_entity.status == TaskStatus.PENDING.value or task_entity.status == TaskStatus.RUNNING.value or task_entity.status == TaskStatus.FAILED.value:
             await DocumentManager.update_document_by_doc_id(task_entity.op_id, {"abstract": "", "abstract_vector": None})
-            await ImageManager.update_images_by_doc_id(task_entity.op_id, {"status": ImageStatus.DELETED.value})
+            await ParseDocumentWorker.delete_images(task_entity.op_id)
             await ChunkManager.update_chunk_by_doc_id(task_entity.op_id, {"status": ChunkStatus.DELETED.value})
         tmp_path = os.path.join(DOC_PATH_IN_OS, str(task_id))
         if os.path.exists(tmp_path):
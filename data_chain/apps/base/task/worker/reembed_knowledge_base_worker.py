@@ -0,0 +1,195 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import asyncio
+import uuid
+from data_chain.config.config import config
+from data_chain.logger.logger import logger as logging
+from data_chain.apps.base.task.worker.base_worker import BaseWorker
+from data_chain.embedding.embedding import Embedding
+from data_chain.entities.enum import TaskType, TaskStatus, KnowledgeBaseStatus
+from data_chain.manager.task_manager import TaskManager
+from data_chain.manager.knowledge_manager import KnowledgeBaseManager
+from data_chain.manager.document_manager import DocumentManager
+from data_chain.manager.chunk_manager import ChunkManager
+from data_chain.manager.task_queue_mamanger import TaskQueueManager
+from data_chain.stores.database.database import TaskEntity
+from data_chain.stores.mongodb.mongodb import Task
+
+
+class ReembedKnowledgeBaseWorker(BaseWorker):
+    """
+    ReembedKnowledgeBaseWorker
+    使用知识库记录的目标模型(reembed_model)重新向量化知识库，向量先写入影子列，全部完成后在一个事务中切换
+    切换前检索仍使用知识库原模型向量化查询并过滤片段，任务失败重试时从未完成的片段继续
+    """
+    name = TaskType.KB_REEMBED.value
+    # 每次请求向量化服务的文本数量
+    batch_size = 64
+    # 同时进行的向量化请求数量
+    concurrency = 4
+    # 每处理多少批上报一次进度
+    report_interval = 16
+
+    @staticmethod
+    async def init(kb_id: uuid.UUID) -> uuid.UUID:
+        '''初始化任务'''
+        knowledge_base_entity = await KnowledgeBaseManager.get_knowledge_base_by_kb_id(kb_id)
+        if knowledge_base_entity is None:
+            err = f"[ReembedKnowledgeBaseWorker] 知识库不存在，知识库ID: {kb_id}"
+            logging.exception(err)
+            return None
+        if knowledge_base_entity.status != KnowledgeBaseStatus.IDLE.value:
+            warning = f"[ReembedKnowledgeBaseWorker] 无法重新向量化知识库，知识库ID: {kb_id}，知识库状态: {knowledge_base_entity.status}"
+            logging.warning(warning)
+            return None
+        knowledge_base_entity = await KnowledgeBaseManager.update_knowledge_base_by_kb_id(kb_id, {"status": KnowledgeBaseStatus.PENDING.value})
+        task_entity = TaskEntity(
+            team_id=knowledge_base_entity.team_id,
+            user_id=knowledge_base_entity.author_id,
+            op_id=knowledge_base_entity.id,
+            op_name=knowledge_base_entity.name,
+            type=TaskType.KB_REEMBED.value,
+            retry=0,
+            status=TaskStatus.PENDING.value)
+        task_entity = await TaskManager.add_task(task_entity)
+        return task_entity.id
+
+    @staticmethod
+    async def reinit(task_id: uuid.UUID) -> bool:
+        '''重新初始化任务'''
+        task_entity = await TaskManager.get_task_by_task_id(task_id)
+        if task_entity is None:
+            err = f"[ReembedKnowledgeBaseWorker] 任务不存在，task_id: {task_id}"
+            logging.exception(err)
+            return False
+        if task_entity.retry < config['TASK_RETRY_TIME_LIMIT']:
+            # 已写入的影子向量保留，重试时跳过
+            await KnowledgeBaseManager.update_knowledge_base_by_kb_id(task_entity.op_id, {"status": KnowledgeBaseStatus.PENDING.value})
+            return True
+        else:
+            await KnowledgeBaseManager.clear_shadow_vectors(task_entity.op_id)
+            await KnowledgeBaseManager.update_knowledge_base_by_kb_id(task_entity.op_id, {"status": KnowledgeBaseStatus.IDLE.value})
+            return False
+
+    @staticmethod
+    async def deinit(task_id: uuid.UUID) -> uuid.UUID:
+        '''析构任务'''
+        task_entity = await TaskManager.get_task_by_task_id(task_id)
+        if task_entity is None:
+            err = f"[ReembedKnowledgeBaseWorker] 任务不存在，task_id: {task_id}"
+            logging.exception(err)
+            return None
+        await KnowledgeBaseManager.update_knowledge_base_by_kb_id(task_entity.op_id, {"status": KnowledgeBaseStatus.IDLE.value})
+        return task_id
+
+    @staticmethod
+    async def vectorize_batches(
+            batches: list[list[tuple[uuid.UUID, str]]], embedding_model: str) -> list[tuple[uuid.UUID, list[float]]]:
+        '''使用目标模型并发向量化多批文本，任一文本向量化失败则抛出异常'''
+        results = await asyncio.gather(*[
+            Embedding.vectorize_embeddings([text or '' for _, text in batch], embedding_model) for batch in batches])
+        id_vectors = []
+        for batch, vectors in zip(batches, results):
+            for (item_id, _), vector in zip(batch, vectors):
+                if vector is None:
+                    raise Exception(f"向量化失败，ID: {item_id}")
+                id_vectors.append((item_id, vector))
+        return id_vectors
+
+    @staticmethod
+    async def reembed_chunks(task_id: uuid.UUID, kb_id: uuid.UUID, embedding_model: str,
+                             current_stage: int, stage_cnt: int) -> None:
+        '''流式读取片段文本，批量向量化后写入影子向量'''
+        total = await ChunkManager.get_chunk_cnt_to_reembed(kb_id, embedding_model)
+        page_size = ReembedKnowledgeBaseWorker.batch_size * ReembedKnowledgeBaseWorker.concurrency
+        done = 0
+        batch_cnt = 0
+        last_id = None
+        while True:
+            rows = await ChunkManager.list_chunk_to_reembed(kb_id, embedding_model, last_id, page_size)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            batches = [rows[i:i + ReembedKnowledgeBaseWorker.batch_size]
+                       for i in range(0, len(rows), ReembedKnowledgeBaseWorker.batch_size)]
+            chunk_vectors = await ReembedKnowledgeBaseWorker.vectorize_batches(batches, embedding_model)
+            await ChunkManager.update_chunk_shadow_vectors(chunk_vectors)
+            done += len(rows)
+            batch_cnt += len(batches)
+            if batch_cnt >= ReembedKnowledgeBaseWorker.report_interval:
+                batch_cnt = 0
+                await ReembedKnowledgeBaseWorker.report(
+                    task_id, f"重新向量化文档片段 {done}/{total}", current_stage, stage_cnt)
+
+    @staticmethod
+    async def reembed_documents(kb_id: uuid.UUID, embedding_model: str) -> None:
+        '''重新向量化有摘要的文档'''
+        rows = [(doc_id, abstract)
+                for doc_id, abstract in await DocumentManager.list_document_to_reembed(kb_id, embedding_model)
+                if abstract]
+        page_size = ReembedKnowledgeBaseWorker.batch_size * ReembedKnowledgeBaseWorker.concurrency
+        for index in range(0, len(rows), page_size):
+            page = rows[index:index + page_size]
+            batches = [page[i:i + ReembedKnowledgeBaseWorker.batch_size]
+                       for i in range(0, len(page), ReembedKnowledgeBaseWorker.batch_size)]
+            doc_vectors = await ReembedKnowledgeBaseWorker.vectorize_batches(batches, embedding_model)
+            await DocumentManager.update_document_shadow_vectors(doc_vectors)
+
+    @staticmethod
+    async def run(task_id: uuid.UUID) -> None:
+        '''运行任务'''
+        try:
+            task_entity = await TaskManager.get_task_by_task_id(task_id)
+            if task_entity is None:
+                err = f"[ReembedKnowledgeBaseWorker] 任务不存在，task_id: {task_id}"
+                logging.exception(err)
+                raise Exception(err)
+            kb_id = task_entity.op_id
+            knowledge_base_entity = await KnowledgeBaseManager.get_knowledge_base_by_kb_id(kb_id)
+            embedding_model = knowledge_base_entity.reembed_model or config['EMBEDDING_MODEL_NAME']
+            await KnowledgeBaseManager.update_knowledge_base_by_kb_id(kb_id, {"status": KnowledgeBaseStatus.REEMBEDDING.value})
+            current_stage = 0
+            stage_cnt = 4
+            await ReembedKnowledgeBaseWorker.reembed_chunks(
+                task_id, kb_id, embedding_model, current_stage + 1, stage_cnt)
+            current_stage += 1
+            await ReembedKnowledgeBaseWorker.report(task_id, "重新向量化文档片段", current_stage, stage_cnt)
+            await ReembedKnowledgeBaseWorker.reembed_documents(kb_id, embedding_model)
+            current_stage += 1
+            await ReembedKnowledgeBaseWorker.report(task_id, "重新向量化文档摘要", current_stage, stage_cnt)
+            # 期间新解析或修改的片段仍是原模型的向量，切换前补齐
+            await ReembedKnowledgeBaseWorker.reembed_chunks(
+                task_id, kb_id, embedding_model, current_stage + 1, stage_cnt)
+            await ReembedKnowledgeBaseWorker.reembed_documents(kb_id, embedding_model)
+            current_stage += 1
+            await ReembedKnowledgeBaseWorker.report(task_id, "补齐重新向量化期间变化的片段和摘要", current_stage, stage_cnt)
+            await KnowledgeBaseManager.swap_embedding_vectors(kb_id, embedding_model)
+            current_stage += 1
+            await ReembedKnowledgeBaseWorker.report(task_id, f"切换为模型 {embedding_model} 的向量", current_stage, stage_cnt)
+            await TaskQueueManager.add_task(Task(_id=task_id, status=TaskStatus.SUCCESS.value))
+        except Exception as e:
+            err = f"[ReembedKnowledgeBaseWorker] 运行任务失败，task_id: {task_id}，错误信息: {e}"
+            logging.exception(err)
+            await TaskQueueManager.add_task(Task(_id=task_id, status=TaskStatus.FAILED.value))
+            await ReembedKnowledgeBaseWorker.report(task_id, err, 0, 1)
+
+    @staticmethod
+    async def stop(task_id: uuid.UUID) -> uuid.UUID:
+        '''停止任务'''
+        task_entity = await TaskManager.get_task_by_task_id(task_id)
+        if task_entity is None:
+            err = f"[ReembedKnowledgeBaseWorker] 任务不存在，task_id: {task_id}"
+            logging.exception(err)
+            return None
+        await KnowledgeBaseManager.clear_shadow_vectors(task_entity.op_id)
+        await KnowledgeBaseManager.update_knowledge_base_by_kb_id(task_entity.op_id, {"status": KnowledgeBaseStatus.IDLE.value})
+        return task_id
+
+    @staticmethod
+    async def delete(task_id) -> uuid.UUID:
+        '''删除任务'''
+        task_entity = await TaskManager.get_task_by_task_id(task_id)
+        if task_entity is None:
+            err = f"[ReembedKnowledgeBaseWorker] 任务不存在，task_id: {task_id}"
+            logging.exception(err)
+            return None
+        return task_id
@@ -1,10 +1,15 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
 import zipfile
 import os
+import io
+from typing import BinaryIO, Callable
+import queue
 import asyncio
+import threading
 import chardet
 
 from data_chain.logger.logger import logger as logging
+from data_chain.stores.minio.minio import MinIO
 
 
 class ZipHandler():
@@ -77,3 +82,147 @@ class ZipHandler():
             err = f"解压缩文件 {zip_file_path} 时出错: {e}"
             logging.error("[ZipHandler] %s", err)
             raise e
+
+
+class PipeStream(io.RawIOBase):
+    '''有界内存管道，一端由zip写入，另一端由MinIO分片上传读取'''
+
+    def __init__(self, max_chunks: int = 64):
+        super().__init__()
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.buffer = bytearray()
+        self.eof = False
+        self.error = None
+
+    def writable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        if self.error is not None:
+            raise self.error
+        if len(b) == 0:
+            return 0
+        data = bytes(b)
+        while True:
+            try:
+                self.queue.put(data, timeout=1)
+                return len(data)
+            except queue.Full:
+                # 读取端异常退出后不再阻塞写入端
+                if self.error is not None:
+                    raise self.error
+
+    def close_write(self) -> None:
+        self.queue.put(None)
+
+    def abort(self, error: Exception) -> None:
+        '''中止管道，读取端抛出异常使分片上传被放弃'''
+        self.error = error
+        try:
+            self.queue.put_nowait(error)
+        except queue.Full:
+            pass
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.queue.get()
+            if chunk is None:
+                self.eof = True
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            self.buffer.extend(chunk)
+        if size < 0 or size >= len(self.buffer):
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        else:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        return data
+
+
+class ZipStreamWriter():
+    '''
+    流式生成zip并通过分片上传写入MinIO，压缩与上传同时进行，不在本地落盘
+    成员按顺序写入，内存占用受管道大小和单个成员的读取块大小限制
+    '''
+
+    def __init__(self, bucket_name: str, file_index: str):
+        self.bucket_name = bucket_name
+        self.file_index = file_index
+        self.pipe = PipeStream()
+        self.zipf = None
+        self.upload_task = None
+
+    async def open(self) -> None:
+        # 上传一直阻塞到zip写完，使用独立线程，不占用MinIO线程池，避免写入端等待线程池时互相阻塞
+        loop = asyncio.get_running_loop()
+        self.upload_task = loop.create_future()
+
+        def set_upload_result(error: Exception = None) -> None:
+            if self.upload_task.done():
+                return
+            if error is None:
+                self.upload_task.set_result(None)
+            else:
+                self.upload_task.set_exception(error)
+
+        def upload():
+            try:
+                MinIO.client.put_object(
+                    self.bucket_name, self.file_index, self.pipe, -1, part_size=MinIO.part_size)
+            except Exception as e:
+                self.pipe.error = e
+                loop.call_soon_threadsafe(set_upload_result, e)
+                return
+            loop.call_soon_threadsafe(set_upload_result)
+        threading.Thread(target=upload, name='minio-zip-upload', daemon=True).start()
+        self.zipf = zipfile.ZipFile(self.pipe, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    async def write_bytes(self, arcname: str, data: bytes) -> None:
+        '''写入内存中的数据'''
+        await asyncio.to_thread(self.zipf.writestr, arcname, data)
+
+    async def write_stream(self, arcname: str, write: Callable[[BinaryIO], None]) -> None:
+        '''在线程中执行write，写出的数据直接压缩进zip成员，不在内存中生成整个成员'''
+        def write_member():
+            with self.zipf.open(arcname, 'w', force_zip64=True) as dst:
+                write(dst)
+        await asyncio.to_thread(write_member)
+
+    async def write_object(self, arcname: str, bucket_name: str, file_index: str, chunk_size: int = 1024 * 1024) -> bool:
+        '''边下载MinIO对象边写入zip'''
+        def copy_object():
+            try:
+                response = MinIO.client.get_object(bucket_name, file_index)
+            except Exception as e:
+                err = f"下载文件 {file_index} 在桶 {bucket_name} 失败: {e}"
+                logging.error("[ZipHandler] %s", err)
+                return False
+            try:
+                with self.zipf.open(arcname, 'w', force_zip64=True) as dst:
+                    for chunk in response.stream(chunk_size):
+                        dst.write(chunk)
+            finally:
+                response.close()
+                response.release_conn()
+            return True
+        return await asyncio.to_thread(copy_object)
+
+    async def close(self) -> None:
+        '''写入zip目录并等待上传完成'''
+        await asyncio.to_thread(self.zipf.close)
+        self.pipe.close_write()
+        await self.upload_task
+
+    async def abort(self, error: Exception) -> None:
+        '''放弃本次上传'''
+        self.pipe.abort(error)
+        if self.upload_task is not None:
+            try:
+                await self.upload_task
+            except Exception:
+                pass
@@ -2,6 +2,8 @@
 
 from fastapi import APIRouter, Response, status
 
+from data_chain.stores.database.database import DataBase
+
 router = APIRouter(
     prefix="/health_check",
     tags=["Health check"]
@@ -11,3 +13,8 @@ router = APIRouter(
 @router.get("")
 def health_check():
     return Response(status_code=status.HTTP_200_OK, content="ok")
+
+
+@router.get("/db_pool")
+def db_pool_status():
+    return DataBase.get_pool_status()
@@ -20,6 +20,7 @@ from data_chain.entities.response_data import (
     CreateKnowledgeBaseResponse,
     ImportKnowledgeBaseResponse,
     ExportKnowledgeBaseResponse,
+    ReembedKnowledgeBaseResponse,
     UpdateKnowledgeBaseResponse,
     DeleteKnowledgeBaseResponse,
 )
@@ -134,6 +135,19 @@ async def export_kb_by_kb_ids(
     return ExportKnowledgeBaseResponse(result=kb_export_task_ids)
 
 
+@router.post('/reembed', response_model=ReembedKnowledgeBaseResponse, dependencies=[Depends(verify_user)])
+async def reembed_kb_by_kb_ids(
+        user_sub: Annotated[str, Depends(get_user_sub)],
+        action: Annotated[str, Depends(get_route_info)],
+        kb_ids: Annotated[list[UUID], Query(alias="kbIds")],
+        embedding_model: Annotated[Optional[str], Query(alias="embeddingModel")] = None):
+    for kb_id in kb_ids:
+        if not await KnowledgeBaseService.validate_user_action_to_knowledge_base(user_sub, kb_id, action):
+            raise Exception("用户没有权限重新向量化该知识库")
+    kb_reembed_task_ids = await KnowledgeBaseService.reembed_kb_by_kb_ids(kb_ids, embedding_model)
+    return ReembedKnowledgeBaseResponse(result=kb_reembed_task_ids)
+
+
 @router.put('', response_model=UpdateKnowledgeBaseResponse, dependencies=[Depends(verify_user)])
 async def update_kb_by_kb_id(
         user_sub: Annotated[str, Depends(get_user_sub)],
@@ -6,7 +6,8 @@ import hashlib
 from typing import Annotated
 from uuid import UUID
 from data_chain.config.config import config
-from data_chain.entities.enum import Embedding, Tokenizer, ParseMethod, SearchMethod
+from data_chain.entities.enum import Tokenizer, ParseMethod, SearchMethod
+from data_chain.embedding.embedding import Embedding
 from data_chain.entities.response_data import (
     LLM,
     ListLLMMsg,
@@ -52,7 +53,7 @@ async def list_llms_by_user_sub(
 
 @router.get('/embedding', response_model=ListEmbeddingResponse, dependencies=[Depends(verify_user)])
 async def list_embeddings():
-    embeddings = [config['EMBEDDING_MODEL_NAME']]
+    embeddings = Embedding.list_model_names()
     return ListEmbeddingResponse(result=embeddings)
 
 
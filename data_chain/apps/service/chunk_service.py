@@ -30,6 +30,7 @@ from data_chain.manager.task_manager import TaskManager
 from data_chain.manager.task_report_manager import TaskReportManager
 from data_chain.stores.database.database import DocumentEntity
 from data_chain.stores.minio.minio import MinIO
+from data_chain.config.config import config
 from data_chain.entities.enum import ParseMethod, DataSetStatus, DocumentStatus, TaskType
 from data_chain.entities.common import DOC_PATH_IN_OS, DOC_PATH_IN_MINIO, DEFAULT_KNOWLEDGE_BASE_ID, DEFAULT_DOC_TYPE_ID
 from data_chain.logger.logger import logger as logging
@@ -89,7 +90,7 @@ class ChunkService:
         if len(chunk_entities) == 0:
             return SearchChunkMsg(docChunks=[])
         if req.is_rerank:
-            chunk_entities = await BaseSearcher.rerank(chunk_entities, req.query)
+            chunk_entities = await BaseSearcher.rerank(chunk_entities, req.query, req.rerank_method.value)
         chunk_entities = chunk_entities[:req.top_k]
         chunk_ids = [chunk_entity.id for chunk_entity in chunk_entities]
         logging.error("[ChunkService] 搜索分片，查询结果数量: %s", len(chunk_entities))
@@ -145,8 +146,13 @@ class ChunkService:
         try:
             chunk_dict = await Convertor.convert_update_chunk_request_to_dict(req)
             if req.text:
-                vector = await Embedding.vectorize_embedding(req.text)
+                chunk_entity = await ChunkManager.get_chunk_by_chunk_id(chunk_id)
+                embedding_model = await KnowledgeBaseManager.get_embedding_model(chunk_entity.kb_id)
+                vector = await Embedding.vectorize_embedding(req.text, embedding_model)
                 chunk_dict["text_vector"] = vector
+                # 影子向量已过期，重新向量化任务在切换前补齐
+                chunk_dict["text_vector_shadow"] = None
+                chunk_dict["embedding_model"] = embedding_model
             chunk_entity = await ChunkManager.update_chunk_by_chunk_id(chunk_id, chunk_dict)
             return chunk_entity.id
         except Exception as e:
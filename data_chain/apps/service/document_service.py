@@ -65,9 +65,12 @@ class DocumentService:
             task_report_entities = await TaskReportManager.list_current_task_report_by_task_ids(task_ids)
             task_report_dict = {task_report_entity.task_id: task_report_entity for task_report_entity in
                                 task_report_entities}
+            doc_type_entities = await DocumentTypeManager.list_document_types_by_ids(
+                list({doc_entity.type_id for doc_entity in doc_entities}))
+            doc_type_dict = {doc_type_entity.id: doc_type_entity for doc_type_entity in doc_type_entities}
             documents = []
             for doc_entity in doc_entities:
-                doc_type_entity = await DocumentTypeManager.get_document_type_by_id(doc_entity.type_id)
+                doc_type_entity = doc_type_dict.get(doc_entity.type_id)
                 document = await Convertor.convert_document_entity_and_document_type_entity_to_document(
                     doc_entity, doc_type_entity)
                 if doc_entity.id in task_dict.keys():
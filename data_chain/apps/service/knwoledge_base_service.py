@@ -5,6 +5,7 @@ from fastapi import APIRouter, Depends, Query, Body, File, UploadFile
 import os
 import shutil
 import yaml
+from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
 from data_chain.entities.request_data import (
     ListTeamRequest,
@@ -26,6 +27,7 @@ from data_chain.entities.enum import Tokenizer, ParseMethod, TeamType, TeamStatu
 from data_chain.entities.common import DEFAULT_DOC_TYPE_ID, default_roles, IMPORT_KB_PATH_IN_OS, EXPORT_KB_PATH_IN_MINIO, IMPORT_KB_PATH_IN_MINIO
 from data_chain.stores.database.database import TeamEntity, KnowledgeBaseEntity, DocumentTypeEntity
 from data_chain.stores.minio.minio import MinIO
+from data_chain.embedding.embedding import Embedding
 from data_chain.apps.base.convertor import Convertor
 from data_chain.manager.team_manager import TeamManager
 from data_chain.manager.knowledge_manager import KnowledgeBaseManager
@@ -198,7 +200,7 @@ class KnowledgeBaseService:
                 name=kb_config.get("name", ""),
                 tokenizer=kb_config.get("tokenizer", Tokenizer.ZH.value),
                 description=kb_config.get("description", ""),
-                embedding_model=kb_config.get("embedding_model", ""),
+                embedding_model=Embedding.resolve_model_name(kb_config.get("embedding_model", "")),
                 doc_cnt=0,
                 doc_size=0,
                 upload_count_limit=kb_config.get("upload_count_limit", 128),
@@ -291,6 +293,28 @@ class KnowledgeBaseService:
                 logging.exception("[KnowledgeBaseService] %s", err)
         return kb_export_task_ids
 
+    @staticmethod
+    async def reembed_kb_by_kb_ids(kb_ids: list[uuid.UUID], embedding_model: str = None) -> list[uuid.UUID]:
+        """使用目标向量化模型重新向量化知识库，未指定时优先使用重新向量化配置的模型"""
+        if embedding_model is None:
+            embedding_model = config['REEMBED_EMBEDDING_MODEL_NAME'] or config['EMBEDDING_MODEL_NAME']
+        if embedding_model not in Embedding.list_model_names():
+            err = f"向量化模型未配置: {embedding_model}"
+            logging.error("[KnowledgeBaseService] %s", err)
+            raise Exception(err)
+        kb_reembed_task_ids = []
+        for kb_id in kb_ids:
+            try:
+                if not await KnowledgeBaseManager.set_reembed_model(kb_id, embedding_model):
+                    continue
+                task_id = await TaskQueueService.init_task(TaskType.KB_REEMBED.value, kb_id)
+                if task_id:
+                    kb_reembed_task_ids.append(task_id)
+            except Exception as e:
+                err = "重新向量化知识库失败"
+                logging.exception("[KnowledgeBaseService] %s", err)
+        return kb_reembed_task_ids
+
     @staticmethod
     async def update_doc_types(kb_id: uuid.UUID, doc_types: list[DocumentTypeRequest]) -> None:
         new_doc_type_map = {doc_type.doc_type_id: doc_type.doc_type_name for doc_type in doc_types}
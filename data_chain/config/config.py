@@ -31,11 +31,25 @@ class ConfigModel(DictBaseModel):
     DATABASE_USER: str = Field(None, description="数据库用户名")
     DATABASE_PASSWORD: str = Field(None, description="数据库密码")
     DATABASE_DB: str = Field(None, description="数据库名称")
+    DATABASE_POOL_SIZE: int = Field(default=20, description="数据库连接池常驻连接数")
+    DATABASE_MAX_OVERFLOW: int = Field(default=20, description="数据库连接池允许超出常驻连接数的连接数")
+    DATABASE_POOL_TIMEOUT: float = Field(default=30, description="从数据库连接池获取连接的超时时间(秒)")
+    DATABASE_STATEMENT_TIMEOUT: int = Field(default=30000, description="单条sql语句的执行超时时间(毫秒)，0表示不限制")
+    DATABASE_PREPARED_STATEMENT_CACHE_SIZE: int = Field(default=100, description="每个连接缓存的预编译语句数量，0表示关闭缓存")
+    # Vector Search
+    HNSW_EF_SEARCH: int = Field(default=100, description="hnsw索引检索时的候选集大小，不小于top_k")
+    HNSW_ITERATIVE_SCAN: str = Field(default="relaxed_order", description="hnsw迭代扫描模式(off/strict_order/relaxed_order)，需要pgvector 0.8.0及以上")
+    HNSW_MAX_SCAN_TUPLES: int = Field(default=20000, description="hnsw迭代扫描最多访问的元组数")
+    VECTOR_EXACT_SEARCH_THRESHOLD: int = Field(default=20000, description="知识库片段数不超过该值时使用精确向量检索")
+    VECTOR_COMPACT_TYPE: str = Field(default="", description="近似检索使用的紧凑向量类型(空/halfvec/bit)，需要pgvector 0.7.0及以上，索引通过python -m data_chain.stores.database.migration --build-compact-vector-index离线创建")
+    VECTOR_COMPACT_RERANK_FACTOR: int = Field(default=4, description="紧凑向量近似检索召回top_k的倍数，再用全精度向量重新打分")
     # MinIO
     MINIO_ENDPOINT: str = Field(None, description="MinIO连接地址")
     MINIO_ACCESS_KEY: str = Field(None, description="Minio认证ak")
     MINIO_SECRET_KEY: str = Field(None, description="MinIO认证sk")
     MINIO_SECURE: bool = Field(None, description="MinIO安全连接")
+    MINIO_MAX_CONCURRENCY: int = Field(default=16, description="MinIO并发传输的最大对象数")
+    MINIO_PART_SIZE: int = Field(default=16*1024*1024, description="MinIO分片上传的分片大小(字节)，不小于5MB")
     # MongoDB
     MONGODB_USER: str = Field(None, description="mongodb认证用户名")
     MONGODB_PASSWORD: str = Field(None, description="mongodb认证密码")
@@ -56,6 +70,11 @@ class ConfigModel(DictBaseModel):
     EMBEDDING_API_KEY: str = Field(None, description="embedding服务api key")
     EMBEDDING_ENDPOINT: str = Field(None, description="embedding服务url地址")
     EMBEDDING_MODEL_NAME: str = Field(None, description="embedding模型名称")
+    EMBEDDING_DIMENSION: int = Field(default=1024, description="embedding向量维度，与向量列的维度一致")
+    REEMBED_EMBEDDING_TYPE: str = Field(default="openai", description="重新向量化目标模型的embedding服务类型")
+    REEMBED_EMBEDDING_API_KEY: str = Field(None, description="重新向量化目标模型的embedding服务api key")
+    REEMBED_EMBEDDING_ENDPOINT: str = Field(None, description="重新向量化目标模型的embedding服务url地址")
+    REEMBED_EMBEDDING_MODEL_NAME: str = Field(None, description="重新向量化目标模型名称，为空时只能重新向量化为EMBEDDING_MODEL_NAME")
     # Token
     SESSION_TTL: int = Field(None, description="用户session过期时间")
     CSRF_KEY: str = Field(None, description="csrf的密钥")
@@ -71,6 +90,23 @@ class ConfigModel(DictBaseModel):
     USE_CPU_LIMIT: int = Field(default=64, description="文档解析器使用CPU核数")
     # Task Retry Time limit
     TASK_RETRY_TIME_LIMIT: int = Field(default=3, description="任务重试次数限制")
+    # Redis
+    REDIS_HOST: str = Field(None, description="redis地址")
+    REDIS_PORT: int = Field(None, description="redis端口")
+    REDIS_PWD: str = Field(None, description="redis密码")
+    # LLM Cache
+    LLM_CACHE_ENABLE: bool = Field(default=False, description="是否启用大模型响应缓存")
+    LLM_CACHE_TYPE: str = Field(default='disk', description="大模型响应缓存后端类型(disk/redis)")
+    LLM_CACHE_PATH: str = Field(default='./witchaind-llm-cache/llm_cache.db', description="大模型响应缓存本地文件路径")
+    LLM_CACHE_TTL: int = Field(default=7*24*3600, description="大模型响应缓存过期时间(秒)")
+    LLM_CACHE_MAX_SIZE: int = Field(default=100000, description="大模型响应缓存最大条目数")
+    # Search Cache
+    SEARCH_CACHE_ENABLE: bool = Field(default=True, description="是否启用查询向量和检索结果缓存")
+    SEARCH_CACHE_TTL: int = Field(default=600, description="检索缓存过期时间(秒)")
+    SEARCH_CACHE_MAX_SIZE: int = Field(default=4096, description="检索缓存每级最大条目数")
+    # Enhanced By LLM Search
+    ENHANCED_SEARCH_LLM_CONCURRENCY: int = Field(default=8, description="大模型增强检索并发判断的分片数")
+    ENHANCED_SEARCH_TIME_BUDGET: float = Field(default=30, description="大模型增强检索单次请求的耗时上限(秒)")
 
 
 class Config:
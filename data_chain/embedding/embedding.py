@@ -1,4 +1,5 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
+import asyncio
 import requests
 import json
 import urllib3
@@ -10,19 +11,66 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 class Embedding():
     @staticmethod
-    async def vectorize_embedding(text):
+    def list_model_names() -> list[str]:
+        """已配置的向量化模型名称，第一个为默认模型"""
+        model_names = [config['EMBEDDING_MODEL_NAME']]
+        if config['REEMBED_EMBEDDING_MODEL_NAME'] and config['REEMBED_EMBEDDING_MODEL_NAME'] not in model_names:
+            model_names.append(config['REEMBED_EMBEDDING_MODEL_NAME'])
+        return model_names
+
+    @staticmethod
+    def resolve_model_name(model_name: str = None) -> str:
+        """未配置的模型名称退化为默认模型"""
+        if model_name in Embedding.list_model_names():
+            return model_name
+        return config['EMBEDDING_MODEL_NAME']
+
+    @staticmethod
+    def get_model_config(model_name: str = None) -> dict:
+        """获取模型对应的服务配置，model_name为空时使用默认模型"""
+        if not model_name or model_name == config['EMBEDDING_MODEL_NAME']:
+            return {
+                'type': config['EMBEDDING_TYPE'],
+                'api_key': config['EMBEDDING_API_KEY'],
+                'endpoint': config['EMBEDDING_ENDPOINT'],
+                'model_name': config['EMBEDDING_MODEL_NAME'],
+            }
+        if model_name == config['REEMBED_EMBEDDING_MODEL_NAME']:
+            return {
+                'type': config['REEMBED_EMBEDDING_TYPE'],
+                'api_key': config['REEMBED_EMBEDDING_API_KEY'],
+                'endpoint': config['REEMBED_EMBEDDING_ENDPOINT'],
+                'model_name': config['REEMBED_EMBEDDING_MODEL_NAME'],
+            }
+        raise ValueError(f"向量化模型未配置: {model_name}")
+
+    @staticmethod
+    def fit_dimension(vector: list[float]) -> list[float]:
+        """不足配置的向量维度时补零，超出时说明模型与向量列不匹配，不截断，返回None"""
+        dimension = config['EMBEDDING_DIMENSION']
+        if len(vector) > dimension:
+            err = f"[Embedding] 向量维度 {len(vector)} 超过配置的EMBEDDING_DIMENSION {dimension}，请检查向量化模型和向量列维度"
+            logging.error(err)
+            return None
+        if len(vector) < dimension:
+            vector = vector + [0] * (dimension - len(vector))
+        return vector
+
+    @staticmethod
+    def post_embedding(text: str, model_name: str = None) -> list[float]:
         vector = None
-        if config['EMBEDDING_TYPE'] == 'openai':
+        model_config = Embedding.get_model_config(model_name)
+        if model_config['type'] == 'openai':
             headers = {
-                "Authorization": f"Bearer {config['EMBEDDING_API_KEY']}"
+                "Authorization": f"Bearer {model_config['api_key']}"
             }
             data = {
                 "input": text,
-                "model": config["EMBEDDING_MODEL_NAME"],
+                "model": model_config['model_name'],
                 "encoding_format": "float"
             }
             try:
-                res = requests.post(url=config["EMBEDDING_ENDPOINT"], headers=headers, json=data, verify=False)
+                res = requests.post(url=model_config['endpoint'], headers=headers, json=data, verify=False)
                 if res.status_code != 200:
                     return None
                 vector = res.json()['data'][0]['embedding']
@@ -30,12 +78,12 @@ class Embedding():
                 err = f"[Embedding] 向量化失败 ，error: {e}"
                 logging.exception(err)
                 return None
-        elif config['EMBEDDING_TYPE'] == 'mindie':
+        elif model_config['type'] == 'mindie':
             try:
                 data = {
                     "inputs": text,
                 }
-                res = requests.post(url=config["EMBEDDING_ENDPOINT"], json=data, verify=False)
+                res = requests.post(url=model_config['endpoint'], json=data, verify=False)
                 if res.status_code != 200:
                     return None
                 vector = json.loads(res.text)[0]
@@ -45,6 +93,53 @@ class Embedding():
                 return None
         else:
             return None
-        while len(vector) < 1024:
-            vector.append(0)
-        return vector[:1024]
+        return Embedding.fit_dimension(vector)
+
+    @staticmethod
+    async def vectorize_embedding(text, model_name: str = None):
+        # 向量化接口为同步请求，放到线程中执行，避免阻塞事件循环
+        return await asyncio.to_thread(Embedding.post_embedding, text, model_name)
+
+    @staticmethod
+    def post_batch_embedding(texts: list[str], model_name: str = None) -> list[list[float]]:
+        model_config = Embedding.get_model_config(model_name)
+        if model_config['type'] == 'openai':
+            headers = {
+                "Authorization": f"Bearer {model_config['api_key']}"
+            }
+            data = {
+                "input": texts,
+                "model": model_config['model_name'],
+                "encoding_format": "float"
+            }
+            res = requests.post(url=model_config['endpoint'], headers=headers, json=data, verify=False)
+            if res.status_code != 200:
+                return None
+            items = sorted(res.json()['data'], key=lambda item: item.get('index', 0))
+            return [item['embedding'] for item in items]
+        elif model_config['type'] == 'mindie':
+            data = {
+                "inputs": texts,
+            }
+            res = requests.post(url=model_config['endpoint'], json=data, verify=False)
+            if res.status_code != 200:
+                return None
+            return json.loads(res.text)
+        return None
+
+    @staticmethod
+    async def vectorize_embeddings(texts: list[str], model_name: str = None) -> list[list[float]]:
+        """批量向量化，一次请求返回与texts等长的向量列表，失败的位置为None"""
+        if not texts:
+            return []
+        Embedding.get_model_config(model_name)
+        try:
+            vectors = await asyncio.to_thread(Embedding.post_batch_embedding, texts, model_name)
+        except Exception as e:
+            err = f"[Embedding] 批量向量化失败 ，error: {e}"
+            logging.exception(err)
+            vectors = None
+        if vectors is None or len(vectors) != len(texts):
+            # 批量接口不可用时退化为逐条向量化
+            return list(await asyncio.gather(*[Embedding.vectorize_embedding(text, model_name) for text in texts]))
+        return [Embedding.fit_dimension(vector) for vector in vectors]
@@ -33,6 +33,8 @@ actions = [
      'name': '导入知识库', 'action': 'POST /kb/import'},
     {'type': 'knowledge_base',
      'name': '导出知识库', 'action': 'POST /kb/export'},
+    {'type': 'knowledge_base',
+     'name': '重新向量化知识库', 'action': 'POST /kb/reembed'},
     {'type': 'knowledge_base',
      'name': '更新知识库信息', 'action': 'PUT /kb'},
     {'type': 'knowledge_base',
@@ -151,6 +153,8 @@ default_roles = [
              'name': '导入知识库', 'action': 'POST /kb/import'},
             {'type': 'knowledge_base',
              'name': '导出知识库', 'action': 'POST /kb/export'},
+            {'type': 'knowledge_base',
+             'name': '重新向量化知识库', 'action': 'POST /kb/reembed'},
             {'type': 'knowledge_base',
              'name': '更新知识库信息', 'action': 'PUT /kb'},
             {'type': 'knowledge_base',
@@ -263,6 +267,8 @@ default_roles = [
              'name': '导入知识库', 'action': 'POST /kb/import'},
             {'type': 'knowledge_base',
              'name': '导出知识库', 'action': 'POST /kb/export'},
+            {'type': 'knowledge_base',
+             'name': '重新向量化知识库', 'action': 'POST /kb/reembed'},
             {'type': 'knowledge_base',
              'name': '更新知识库信息', 'action': 'PUT /kb'},
             {'type': 'knowledge_base',
@@ -68,6 +68,7 @@ class KnowledgeBaseStatus(str, Enum):
     PENDING = "pending"
     EXPORTING = "exporting"
     IMPORTING = "importing"
+    REEMBEDDING = "reembedding"
     DELETED = "deleted"
 
 
@@ -164,11 +165,18 @@ class SearchMethod(str, Enum):
     DYNAMIC_WEIGHTED_KEYWORD = "dynamic_weighted_keyword"
 
 
+class RerankMethod(str, Enum):
+    """重排序方法"""
+    BM25 = "bm25"
+    JACCARD = "jaccard"
+
+
 class TaskType(str, Enum):
     """任务类型"""
     DOC_PARSE = "doc_parse"
     KB_EXPORT = "kb_export"
     KB_IMPORT = "kb_import"
+    KB_REEMBED = "kb_reembed"
     DATASET_EXPORT = "dataset_export"
     DATASET_IMPORT = "dataset_import"
     DATASET_GENERATE = "dataset_generate"
@@ -19,6 +19,7 @@ from data_chain.entities.enum import (
     DataSetStatus,
     TestingStatus,
     SearchMethod,
+    RerankMethod,
     TaskType,
     TaskStatus,
     OrderType)
@@ -166,6 +167,7 @@ class SearchChunkRequest(BaseModel):
     is_related_surrounding: bool = Field(default=True, description="是否关联上下文", alias="isRelatedSurrounding")
     is_classify_by_doc: bool = Field(default=False, description="是否按文档分类", alias="isClassifyByDoc")
     is_rerank: bool = Field(default=False, description="是否重新排序", alias="isRerank")
+    rerank_method: RerankMethod = Field(default=RerankMethod.BM25, description="重新排序方法", alias="rerankMethod")
     is_compress: bool = Field(default=False, description="是否压缩", alias="isCompress")
     tokens_limit: int = Field(default=8192, description="token限制", alias="tokensLimit")
 
@@ -214,6 +214,11 @@ class ExportKnowledgeBaseResponse(ResponseData):
     result: list[uuid.UUID] = Field(default=[], description="任务ID")
 
 
+class ReembedKnowledgeBaseResponse(ResponseData):
+    """POST /kb/reembed 响应"""
+    result: list[uuid.UUID] = Field(default=[], description="任务ID")
+
+
 class UpdateKnowledgeBaseResponse(ResponseData):
     """PUT /kb 响应"""
     result: Optional[uuid.UUID] = Field(default=None, description="知识库ID")
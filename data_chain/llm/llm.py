@@ -6,6 +6,7 @@ import json
 import tiktoken
 from langchain_openai import ChatOpenAI
 from langchain.schema import SystemMessage, HumanMessage
+from data_chain.llm.llm_cache import LLMCache
 from data_chain.logger.logger import logger as logging
 
 
@@ -31,13 +32,23 @@ class LLM:
         chat.append(HumanMessage(content=user_call))
         return chat
 
-    async def nostream(self, chat, system_call, user_call,st_str:str=None,en_str:str=None):
+    async def nostream(self, chat, system_call, user_call, st_str: str = None, en_str: str = None,
+                       use_cache: bool = False):
         try:
-            chat = self.assemble_chat(chat, system_call, user_call)
-            response = await self.client.ainvoke(chat)
-            content = re.sub(r'<think>.*?</think>\n?', '', response.content, flags=re.DOTALL)
-            content = re.sub(r'.*?</think>\n?', '', content, flags=re.DOTALL)
-            content=content.strip()     
+            # 只有无历史对话的确定性调用才走缓存
+            cache_key = None
+            content = None
+            if use_cache and not chat:
+                cache_key = LLMCache.make_key(self.model_name, self.temperature, system_call, user_call)
+                content = await LLMCache.get(cache_key)
+            if content is None:
+                chat = self.assemble_chat(chat, system_call, user_call)
+                response = await self.client.ainvoke(chat)
+                content = re.sub(r'<think>.*?</think>\n?', '', response.content, flags=re.DOTALL)
+                content = re.sub(r'.*?</think>\n?', '', content, flags=re.DOTALL)
+                content = content.strip()
+                if cache_key is not None and content:
+                    await LLMCache.set(cache_key, content)
             if st_str is not None:
                 index = content.find(st_str)
                 if index != -1:
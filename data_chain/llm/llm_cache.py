@@ -0,0 +1,162 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from data_chain.config.config import config
+from data_chain.logger.logger import logger as logging
+
+
+class DiskLLMCacheBackend:
+    """基于本地sqlite文件的大模型响应缓存，按最近访问时间做LRU淘汰"""
+
+    def __init__(self, path: str, ttl: int, max_size: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        dir_name = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_cache ('
+                'key TEXT PRIMARY KEY, value TEXT, expire_at REAL, accessed_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_accessed_at_index ON llm_cache(accessed_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _get(self, key: str) -> str:
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            row = conn.execute('SELECT value, expire_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, expire_at = row
+            if expire_at < now:
+                conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE llm_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, value, expire_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, value, now + self.ttl, now))
+            conn.execute('DELETE FROM llm_cache WHERE expire_at < ?', (now,))
+            cnt = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+            if cnt > self.max_size:
+                conn.execute(
+                    'DELETE FROM llm_cache WHERE key IN '
+                    '(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)', (cnt - self.max_size,))
+
+    async def get(self, key: str) -> str:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+
+class RedisLLMCacheBackend:
+    """基于redis的大模型响应缓存，过期交给redis，LRU淘汰依赖访问时间有序集合"""
+    prefix = 'witchaind:llm_cache:'
+    lru_key = 'witchaind:llm_cache_lru'
+
+    def __init__(self, ttl: int, max_size: int):
+        import redis
+        self.ttl = ttl
+        self.max_size = max_size
+        self.client = redis.Redis(
+            host=config['REDIS_HOST'],
+            port=config['REDIS_PORT'],
+            password=config['REDIS_PWD'],
+            decode_responses=True
+        )
+
+    def _get(self, key: str) -> str:
+        value = self.client.get(self.prefix + key)
+        if value is not None:
+            self.client.zadd(self.lru_key, {key: time.time()})
+        return value
+
+    def _set(self, key: str, value: str) -> None:
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, value, ex=self.ttl)
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.zcard(self.lru_key)
+        cnt = pipe.execute()[-1]
+        if cnt > self.max_size:
+            evicted_keys = self.client.zrange(self.lru_key, 0, cnt - self.max_size - 1)
+            if evicted_keys:
+                pipe = self.client.pipeline()
+                pipe.delete(*[self.prefix + evicted_key for evicted_key in evicted_keys])
+                pipe.zrem(self.lru_key, *evicted_keys)
+                pipe.execute()
+
+    async def get(self, key: str) -> str:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+
+class LLMCache:
+    """
+    大模型确定性prompt的响应缓存
+    缓存键为(模型, 温度, system prompt哈希, user prompt哈希)
+    """
+    backend = None
+    backend_init_flag = False
+
+    @staticmethod
+    def get_backend():
+        if LLMCache.backend_init_flag:
+            return LLMCache.backend
+        LLMCache.backend_init_flag = True
+        if not config['LLM_CACHE_ENABLE']:
+            return None
+        try:
+            if config['LLM_CACHE_TYPE'] == 'redis':
+                LLMCache.backend = RedisLLMCacheBackend(config['LLM_CACHE_TTL'], config['LLM_CACHE_MAX_SIZE'])
+            else:
+                LLMCache.backend = DiskLLMCacheBackend(
+                    config['LLM_CACHE_PATH'], config['LLM_CACHE_TTL'], config['LLM_CACHE_MAX_SIZE'])
+        except Exception as e:
+            err = f"[LLMCache] 初始化大模型缓存失败，缓存将被禁用: {e}"
+            logging.error(err)
+            LLMCache.backend = None
+        return LLMCache.backend
+
+    @staticmethod
+    def make_key(model_name: str, temperature: float, system_call: str, user_call: str) -> str:
+        system_hash = hashlib.sha256(system_call.encode('utf-8')).hexdigest()
+        user_hash = hashlib.sha256(user_call.encode('utf-8')).hexdigest()
+        return hashlib.sha256(f'{model_name}|{temperature}|{system_hash}|{user_hash}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    async def get(key: str) -> str:
+        backend = LLMCache.get_backend()
+        if backend is None:
+            return None
+        try:
+            return await backend.get(key)
+        except Exception as e:
+            err = f"[LLMCache] 读取大模型缓存失败: {e}"
+            logging.error(err)
+            return None
+
+    @staticmethod
+    async def set(key: str, value: str) -> None:
+        backend = LLMCache.get_backend()
+        if backend is None:
+            return
+        try:
+            await backend.set(key, value)
+        except Exception as e:
+            err = f"[LLMCache] 写入大模型缓存失败: {e}"
+            logging.error(err)
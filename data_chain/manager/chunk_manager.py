@@ -1,6 +1,8 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
-from sqlalchemy import select, update, func, text, or_, and_, Float, literal_column
+from sqlalchemy import select, update, func, text, or_, and_, case, literal, Float, Integer, literal_column
+from sqlalchemy.orm import aliased
 from typing import List, Tuple, Dict, Optional
+import time
 import uuid
 from data_chain.entities.enum import DocumentStatus, ChunkStatus, Tokenizer
 from data_chain.entities.request_data import ListChunkRequest
@@ -11,12 +13,17 @@ from data_chain.logger.logger import logger as logging
 
 
 class ChunkManager():
+    # 知识库是否足够小以使用精确向量检索，缓存(结果, 时间)
+    small_kb_cache: Dict[uuid.UUID, Tuple[bool, float]] = {}
+    small_kb_cache_ttl = 60
+
     @staticmethod
     async def add_chunk(chunk: ChunkEntity) -> ChunkEntity:
         """添加文档"""
         try:
             async with await DataBase.get_session() as session:
                 session.add(chunk)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt([chunk.kb_id]))
                 await session.commit()
                 return chunk
         except Exception as e:
@@ -29,6 +36,8 @@ class ChunkManager():
         try:
             async with await DataBase.get_session() as session:
                 session.add_all(chunks)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt(
+                    list({chunk.kb_id for chunk in chunks})))
                 await session.commit()
                 return chunks
         except Exception as e:
@@ -51,6 +60,25 @@ class ChunkManager():
             logging.exception("[ChunkManager] %s", err)
             raise e
 
+    @staticmethod
+    async def list_chunk_by_chunk_ids(chunk_ids: List[uuid.UUID]) -> List[ChunkEntity]:
+        """根据片段ID列表查询文档解析结果，不保证顺序"""
+        try:
+            if not chunk_ids:
+                return []
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    select(ChunkEntity)
+                    .where(ChunkEntity.id.in_(chunk_ids))
+                    .where(ChunkEntity.status != ChunkStatus.DELETED.value)
+                )
+                result = await session.execute(stmt)
+                return result.scalars().all()
+        except Exception as e:
+            err = "根据片段ID列表查询文档解析结果失败"
+            logging.exception("[ChunkManager] %s", err)
+            raise e
+
     @staticmethod
     async def get_chunk_cnt_by_doc_ids(doc_ids: List[uuid.UUID]) -> int:
         """根据文档ID查询文档解析结果"""
@@ -164,13 +192,43 @@ class ChunkManager():
             logging.exception("[ChunkManager] %s", err)
             raise e
 
+    @staticmethod
+    async def is_small_kb(kb_id: uuid.UUID) -> bool:
+        """知识库的片段数是否不超过精确检索阈值，只计数到阈值为止"""
+        cache = ChunkManager.small_kb_cache.get(kb_id)
+        if cache is not None and time.time() - cache[1] < ChunkManager.small_kb_cache_ttl:
+            return cache[0]
+        threshold = config['VECTOR_EXACT_SEARCH_THRESHOLD']
+        try:
+            async with await DataBase.get_session() as session:
+                subq = (
+                    select(ChunkEntity.id)
+                    .where(ChunkEntity.kb_id == kb_id)
+                    .where(ChunkEntity.status != ChunkStatus.DELETED.value)
+                    .limit(threshold + 1)
+                    .subquery()
+                )
+                result = await session.execute(select(func.count()).select_from(subq))
+                is_small = result.scalar() <= threshold
+        except Exception as e:
+            err = "统计知识库片段数量失败"
+            logging.exception("[ChunkManager] %s", err)
+            return False
+        ChunkManager.small_kb_cache[kb_id] = (is_small, time.time())
+        return is_small
+
     @staticmethod
     async def get_top_k_chunk_by_kb_id_vector(
             kb_id: uuid.UUID, vector: List[float],
             top_k: int, doc_ids: list[uuid.UUID] = None, banned_ids: list[uuid.UUID] = [],
-            chunk_to_type: str = None, pre_ids: list[uuid.UUID] = None) -> List[ChunkEntity]:
-        """根据知识库ID和向量查询文档解析结果"""
+            chunk_to_type: str = None, pre_ids: list[uuid.UUID] = None, exact: bool = None) -> List[ChunkEntity]:
+        """
+        根据知识库ID和向量查询文档解析结果
+        exact为None时，小知识库或限定了文档、父节点的查询走精确检索，其余走hnsw迭代扫描
+        """
         try:
+            if exact is None:
+                exact = doc_ids is not None or pre_ids is not None or await ChunkManager.is_small_kb(kb_id)
             async with await DataBase.get_session() as session:
                 # 计算相似度分数
                 similarity_score = ChunkEntity.text_vector.cosine_distance(vector).label("similarity_score")
@@ -187,6 +245,8 @@ class ChunkManager():
                     .where(ChunkEntity.enabled == True)
                     .where(ChunkEntity.status != ChunkStatus.DELETED.value)
                     .where(ChunkEntity.id.notin_(banned_ids))
+                    # 只比较知识库当前模型产生的向量，重新向量化切换前仍为原模型
+                    .where(ChunkEntity.embedding_model == KnowledgeBaseManager.embedding_model_subquery(kb_id))
                 )
 
                 # 添加可选条件
@@ -198,12 +258,43 @@ class ChunkManager():
                     stmt = stmt.where(ChunkEntity.pre_id_in_parse_topology.in_(pre_ids))
 
                 # 应用排序条件
-                stmt = stmt.order_by(similarity_score)
+                if exact:
+                    # 排序表达式与hnsw索引不匹配，规划器按kb_id等过滤条件走B-tree索引后精确排序
+                    stmt = stmt.order_by(ChunkEntity.text_vector.cosine_distance(vector) + 0)
+                else:
+                    compact_distance = DataBase.get_compact_distance(
+                        ChunkEntity.__tablename__, 'text_vector', vector)
+                    if compact_distance is None:
+                        await DataBase.apply_hnsw_search_settings(session, top_k)
+                        stmt = stmt.order_by(similarity_score)
+                    else:
+                        # 紧凑向量索引召回候选，再按全精度向量重新打分
+                        candidate_cnt = top_k * config['VECTOR_COMPACT_RERANK_FACTOR']
+                        await DataBase.apply_hnsw_search_settings(session, candidate_cnt)
+                        candidate_ids = (
+                            stmt.with_only_columns(ChunkEntity.id)
+                            .order_by(compact_distance)
+                            .limit(candidate_cnt)
+                            .scalar_subquery()
+                        )
+                        stmt = (
+                            select(ChunkEntity, similarity_score)
+                            .where(ChunkEntity.id.in_(candidate_ids))
+                            .order_by(ChunkEntity.text_vector.cosine_distance(vector) + 0)
+                        )
                 stmt = stmt.limit(top_k)
 
                 # 执行最终查询
                 result = await session.execute(stmt)
-                chunk_entities = result.scalars().all()
+                chunk_entities = []
+                for chunk_entity, distance in result.all():
+                    # 保留余弦距离供重排序融合使用
+                    chunk_entity.vector_distance = distance
+                    chunk_entities.append(chunk_entity)
+                # relaxed_order迭代扫描返回的结果可能略微乱序
+                chunk_entities.sort(
+                    key=lambda chunk_entity: chunk_entity.vector_distance
+                    if chunk_entity.vector_distance is not None else float('inf'))
 
                 return chunk_entities
         except Exception as e:
@@ -364,6 +455,67 @@ class ChunkManager():
             logging.exception("[ChunkManager] %s", err)
             return []
 
+    @staticmethod
+    async def list_chunk_tree_with_score_by_root_ids(
+            kb_id: uuid.UUID, root_ids: List[uuid.UUID], query: str, vector: List[float],
+            max_depth: int, max_node_cnt: int, banned_ids: list[uuid.UUID] = []
+    ) -> List[Tuple[ChunkEntity, int, float, Optional[float]]]:
+        """
+        通过pre_id_in_parse_topology递归展开以root_ids为根的子树，一次查询返回
+        (片段, 深度, 关键词分数, 向量距离)，向量模型与当前模型不一致的片段向量距离为None
+        """
+        try:
+            if not root_ids:
+                return []
+            kb_entity = await KnowledgeBaseManager.get_knowledge_base_by_kb_id(kb_id)
+            if kb_entity.tokenizer == Tokenizer.EN.value:
+                tokenizer = 'english'
+            elif config['DATABASE_TYPE'].lower() == 'opengauss':
+                tokenizer = 'chparser'
+            else:
+                tokenizer = 'zhparser'
+            async with await DataBase.get_session() as session:
+                chunk_tree = (
+                    select(ChunkEntity.id.label('id'), literal(0, Integer).label('depth'))
+                    .where(ChunkEntity.id.in_(root_ids))
+                    .cte('chunk_tree', recursive=True)
+                )
+                child = aliased(ChunkEntity)
+                chunk_tree = chunk_tree.union_all(
+                    select(child.id, chunk_tree.c.depth + 1)
+                    .where(child.pre_id_in_parse_topology == chunk_tree.c.id)
+                    .where(child.kb_id == kb_id)
+                    .where(child.status != ChunkStatus.DELETED.value)
+                    .where(chunk_tree.c.depth < max_depth)
+                )
+                keyword_score = func.ts_rank_cd(
+                    func.to_tsvector(tokenizer, ChunkEntity.text),
+                    func.plainto_tsquery(tokenizer, query)
+                )
+                vector_distance = case(
+                    (ChunkEntity.embedding_model == KnowledgeBaseManager.embedding_model_subquery(kb_id),
+                     ChunkEntity.text_vector.cosine_distance(vector)),
+                    else_=None
+                )
+                stmt = (
+                    select(ChunkEntity, chunk_tree.c.depth, keyword_score, vector_distance)
+                    .join(chunk_tree, chunk_tree.c.id == ChunkEntity.id)
+                    .join(DocumentEntity, DocumentEntity.id == ChunkEntity.doc_id)
+                    .where(DocumentEntity.enabled == True)
+                    .where(DocumentEntity.status != DocumentStatus.DELETED.value)
+                    .where(ChunkEntity.enabled == True)
+                    .where(ChunkEntity.status != ChunkStatus.DELETED.value)
+                    .where(ChunkEntity.id.notin_(banned_ids))
+                    .order_by(chunk_tree.c.depth)
+                    .limit(max_node_cnt)
+                )
+                result = await session.execute(stmt)
+                return [tuple(row) for row in result.all()]
+        except Exception as e:
+            err = "递归查询文档解析树失败"
+            logging.exception("[ChunkManager] %s", err)
+            return []
+
     @staticmethod
     async def fetch_surrounding_chunk_by_doc_id_and_global_offset(
             doc_id: uuid.UUID, global_offset: int,
@@ -388,6 +540,67 @@ class ChunkManager():
             logging.exception("[ChunkManager] %s", err)
             raise e
 
+    @staticmethod
+    async def get_chunk_cnt_to_reembed(kb_id: uuid.UUID, embedding_model: str) -> int:
+        """统计知识库中尚未使用指定模型向量化的片段数量"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    select(func.count())
+                    .select_from(ChunkEntity)
+                    .where(ChunkEntity.kb_id == kb_id)
+                    .where(ChunkEntity.status != ChunkStatus.DELETED.value)
+                    .where(ChunkEntity.text_vector_shadow.is_(None))
+                    .where(ChunkEntity.embedding_model.is_distinct_from(embedding_model))
+                )
+                result = await session.execute(stmt)
+                return result.scalar()
+        except Exception as e:
+            err = "统计待重新向量化的片段数量失败"
+            logging.exception("[ChunkManager] %s", err)
+            raise e
+
+    @staticmethod
+    async def list_chunk_to_reembed(
+            kb_id: uuid.UUID, embedding_model: str, last_id: uuid.UUID = None,
+            limit: int = 256) -> List[Tuple[uuid.UUID, str]]:
+        """按ID顺序分页获取尚未使用指定模型向量化的片段ID和文本"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    select(ChunkEntity.id, ChunkEntity.text)
+                    .where(ChunkEntity.kb_id == kb_id)
+                    .where(ChunkEntity.status != ChunkStatus.DELETED.value)
+                    .where(ChunkEntity.text_vector_shadow.is_(None))
+                    .where(ChunkEntity.embedding_model.is_distinct_from(embedding_model))
+                )
+                if last_id is not None:
+                    stmt = stmt.where(ChunkEntity.id > last_id)
+                stmt = stmt.order_by(ChunkEntity.id).limit(limit)
+                result = await session.execute(stmt)
+                return [(chunk_id, chunk_text) for chunk_id, chunk_text in result.all()]
+        except Exception as e:
+            err = "获取待重新向量化的片段失败"
+            logging.exception("[ChunkManager] %s", err)
+            raise e
+
+    @staticmethod
+    async def update_chunk_shadow_vectors(chunk_vectors: List[Tuple[uuid.UUID, List[float]]]) -> None:
+        """按片段ID批量写入影子向量"""
+        if not chunk_vectors:
+            return
+        try:
+            async with await DataBase.get_session() as session:
+                await session.execute(
+                    update(ChunkEntity),
+                    [{"id": chunk_id, "text_vector_shadow": vector} for chunk_id, vector in chunk_vectors]
+                )
+                await session.commit()
+        except Exception as e:
+            err = "批量写入片段影子向量失败"
+            logging.exception("[ChunkManager] %s", err)
+            raise e
+
     @staticmethod
     async def update_chunk_by_doc_id(doc_id: uuid.UUID, chunk_dict: Dict[str, str]) -> bool:
         """根据文档ID更新文档解析结果"""
@@ -399,6 +612,8 @@ class ChunkManager():
                     .values(**chunk_dict)
                 )
                 await session.execute(stmt)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt(
+                    select(DocumentEntity.kb_id).where(DocumentEntity.id == doc_id)))
                 await session.commit()
                 return True
         except Exception as e:
@@ -416,6 +631,8 @@ class ChunkManager():
                     .values(**chunk_dict)
                 )
                 await session.execute(stmt)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt(
+                    select(ChunkEntity.kb_id).where(ChunkEntity.id == chunk_id)))
                 await session.commit()
                 stmt = (
                     select(ChunkEntity)
@@ -439,6 +656,8 @@ class ChunkManager():
                     .values(**chunk_dict)
                 )
                 await session.execute(stmt)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt(
+                    select(ChunkEntity.kb_id).where(ChunkEntity.id.in_(chunk_ids))))
                 await session.commit()
                 stmt = (
                     select(ChunkEntity)
@@ -1,5 +1,5 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
-from sqlalchemy import select, delete, update, func, between, asc, desc, and_, Float, literal_column, text
+from sqlalchemy import select, delete, update, func, between, asc, desc, and_, or_, Float, literal_column, text
 from datetime import datetime, timezone
 import uuid
 from typing import Dict, List, Tuple
@@ -23,6 +23,7 @@ class DocumentManager():
         try:
             async with await DataBase.get_session() as session:
                 session.add(document_entity)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt([document_entity.kb_id]))
                 await session.commit()
                 return document_entity
         except Exception as e:
@@ -35,6 +36,8 @@ class DocumentManager():
         try:
             async with await DataBase.get_session() as session:
                 session.add_all(document_entities)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt(
+                    list({document_entity.kb_id for document_entity in document_entities})))
                 await session.commit()
                 for document_entity in document_entities:
                     await session.refresh(document_entity)
@@ -58,6 +61,7 @@ class DocumentManager():
                     .where(DocumentEntity.id.notin_(banned_ids))
                     .where(DocumentEntity.status != DocumentStatus.DELETED.value)
                     .where(DocumentEntity.enabled == True)
+                    .where(DocumentEntity.embedding_model == KnowledgeBaseManager.embedding_model_subquery(kb_id))
                 )
                 if doc_ids:
                     stmt = stmt.where(DocumentEntity.id.in_(doc_ids))
@@ -335,6 +339,43 @@ class DocumentManager():
             logging.exception("[DocumentManager] %s", err)
             raise e
 
+    @staticmethod
+    async def list_document_to_reembed(kb_id: uuid.UUID, embedding_model: str) -> List[Tuple[uuid.UUID, str]]:
+        """获取尚未使用指定模型向量化摘要的文档ID和摘要"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    select(DocumentEntity.id, DocumentEntity.abstract)
+                    .where(DocumentEntity.kb_id == kb_id)
+                    .where(DocumentEntity.status != DocumentStatus.DELETED.value)
+                    .where(DocumentEntity.abstract_vector_shadow.is_(None))
+                    .where(DocumentEntity.embedding_model.is_distinct_from(embedding_model))
+                    .order_by(DocumentEntity.id)
+                )
+                result = await session.execute(stmt)
+                return [(doc_id, abstract) for doc_id, abstract in result.all()]
+        except Exception as e:
+            err = "获取待重新向量化的文档失败"
+            logging.exception("[DocumentManager] %s", err)
+            raise e
+
+    @staticmethod
+    async def update_document_shadow_vectors(doc_vectors: List[Tuple[uuid.UUID, List[float]]]) -> None:
+        """按文档ID批量写入摘要影子向量"""
+        if not doc_vectors:
+            return
+        try:
+            async with await DataBase.get_session() as session:
+                await session.execute(
+                    update(DocumentEntity),
+                    [{"id": doc_id, "abstract_vector_shadow": vector} for doc_id, vector in doc_vectors]
+                )
+                await session.commit()
+        except Exception as e:
+            err = "批量写入文档摘要影子向量失败"
+            logging.exception("[DocumentManager] %s", err)
+            raise e
+
     @staticmethod
     async def update_document_by_doc_id(doc_id: uuid.UUID, doc_dict: Dict[str, str]) -> DocumentEntity:
         """根据文档ID更新文档"""
@@ -345,6 +386,8 @@ class DocumentManager():
                          DocumentEntity.status != DocumentStatus.DELETED.value)
                 ).values(**doc_dict)
                 await session.execute(stmt)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt(
+                    select(DocumentEntity.kb_id).where(DocumentEntity.id == doc_id)))
                 await session.commit()
                 return await DocumentManager.get_document_by_doc_id(doc_id)
         except Exception as e:
@@ -362,6 +405,8 @@ class DocumentManager():
                          DocumentEntity.status != DocumentStatus.DELETED.value)
                 ).values(**doc_dict)
                 await session.execute(stmt)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt(
+                    select(DocumentEntity.kb_id).where(DocumentEntity.id.in_(doc_ids))))
                 await session.commit()
                 stmt = select(DocumentEntity).where(
                     DocumentEntity.id.in_(doc_ids)
@@ -53,6 +53,25 @@ class DocumentTypeManager():
             logging.exception("[DocumentTypeManager] %s", err)
             raise e
 
+    @staticmethod
+    async def list_document_types_by_ids(
+            doc_type_ids: List[uuid.UUID]) -> List[DocumentTypeEntity]:
+        """根据文档类型ID列表批量查询文档类型"""
+        try:
+            if not doc_type_ids:
+                return []
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    select(DocumentTypeEntity)
+                    .where(DocumentTypeEntity.id.in_(doc_type_ids))
+                )
+                result = await session.execute(stmt)
+                return result.scalars().all()
+        except Exception as e:
+            err = "批量查询文档类型失败"
+            logging.exception("[DocumentTypeManager] %s", err)
+            raise e
+
     @staticmethod
     async def update_doc_type_by_doc_type_id(
             doc_type_id: uuid.UUID, doc_type_name: str) -> None:
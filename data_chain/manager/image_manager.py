@@ -3,6 +3,7 @@ from sqlalchemy import select, update
 from typing import List, Dict
 import uuid
 from data_chain.logger.logger import logger as logging
+from data_chain.entities.enum import ImageStatus
 
 from data_chain.stores.database.database import DataBase, ImageEntity
 
@@ -39,3 +40,41 @@ class ImageManager:
             err = "更新图片失败"
             logging.exception("[ImageManager] %s", err)
             raise e
+
+    @staticmethod
+    async def delete_images_by_doc_id(doc_id: uuid.UUID) -> List[uuid.UUID]:
+        """将文档的图片标记为删除，返回本次删除的图片对应的分片ID"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    update(ImageEntity)
+                    .where(ImageEntity.doc_id == doc_id)
+                    .where(ImageEntity.status != ImageStatus.DELETED.value)
+                    .values(status=ImageStatus.DELETED.value)
+                    .returning(ImageEntity.chunk_id)
+                )
+                result = await session.execute(stmt)
+                chunk_ids = result.scalars().all()
+                await session.commit()
+                return chunk_ids
+        except Exception as e:
+            err = "删除图片失败"
+            logging.exception("[ImageManager] %s", err)
+            raise e
+
+    @staticmethod
+    async def list_images_by_doc_id(doc_id: uuid.UUID) -> List[ImageEntity]:
+        """根据文档ID查询图片"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    select(ImageEntity)
+                    .where(ImageEntity.doc_id == doc_id)
+                    .where(ImageEntity.status != ImageStatus.DELETED.value)
+                )
+                result = await session.execute(stmt)
+                return result.scalars().all()
+        except Exception as e:
+            err = "根据文档ID查询图片失败"
+            logging.exception("[ImageManager] %s", err)
+            raise e
@@ -1,11 +1,12 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
 from typing import Dict, List, Tuple, Optional
 import uuid
+from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
-from sqlalchemy import and_, select, delete, update, func, between
+from sqlalchemy import and_, select, delete, update, func, between, text
 from datetime import datetime, timezone
 from data_chain.entities.request_data import ListKnowledgeBaseRequest
-from data_chain.stores.database.database import DataBase, KnowledgeBaseEntity, DocumentTypeEntity, DocumentEntity
+from data_chain.stores.database.database import DataBase, KnowledgeBaseEntity, DocumentTypeEntity, DocumentEntity, ChunkEntity
 from data_chain.entities.enum import KnowledgeBaseStatus, DocumentStatus
 
 
@@ -119,6 +120,139 @@ class KnowledgeBaseManager():
             logging.exception("[KnowledgeBaseManager] %s", err)
             raise e
 
+    @staticmethod
+    def bump_generation_stmt(kb_ids):
+        """递增知识库内容代数，kb_ids可以是ID列表或查询知识库ID的子查询，需与内容变化在同一事务中执行"""
+        return (
+            update(KnowledgeBaseEntity)
+            .where(KnowledgeBaseEntity.id.in_(kb_ids))
+            .values(generation=func.coalesce(KnowledgeBaseEntity.generation, 0) + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    async def get_generation(kb_id: uuid.UUID) -> int:
+        """获取知识库内容代数"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = select(KnowledgeBaseEntity.generation).where(KnowledgeBaseEntity.id == kb_id)
+                result = await session.execute(stmt)
+                return result.scalar() or 0
+        except Exception as e:
+            err = "获取知识库内容代数失败"
+            logging.exception("[KnowledgeBaseManager] %s", err)
+            raise e
+
+    @staticmethod
+    def embedding_model_subquery(kb_id: uuid.UUID):
+        """查询知识库当前向量化模型的标量子查询，用于在同一条语句中按模型过滤片段和文档"""
+        return (
+            select(func.coalesce(func.nullif(KnowledgeBaseEntity.embedding_model, ''), config['EMBEDDING_MODEL_NAME']))
+            .where(KnowledgeBaseEntity.id == kb_id)
+            .scalar_subquery()
+        )
+
+    @staticmethod
+    async def get_embedding_model(kb_id: uuid.UUID) -> str:
+        """获取知识库当前的向量化模型，重新向量化切换完成前保持为原模型"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = select(KnowledgeBaseEntity.embedding_model).where(KnowledgeBaseEntity.id == kb_id)
+                result = await session.execute(stmt)
+                return result.scalar() or config['EMBEDDING_MODEL_NAME']
+        except Exception as e:
+            err = "获取知识库向量化模型失败"
+            logging.exception("[KnowledgeBaseManager] %s", err)
+            raise e
+
+    @staticmethod
+    async def set_reembed_model(kb_id: uuid.UUID, reembed_model: str) -> bool:
+        """知识库空闲时记录重新向量化的目标模型，知识库不空闲时返回False"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    update(KnowledgeBaseEntity)
+                    .where(and_(KnowledgeBaseEntity.id == kb_id,
+                                KnowledgeBaseEntity.status == KnowledgeBaseStatus.IDLE.value))
+                    .values(reembed_model=reembed_model)
+                )
+                result = await session.execute(stmt)
+                await session.commit()
+                return result.rowcount > 0
+        except Exception as e:
+            err = "记录知识库重新向量化目标模型失败"
+            logging.exception("[KnowledgeBaseManager] %s", err)
+            raise e
+
+    @staticmethod
+    async def swap_embedding_vectors(kb_id: uuid.UUID, embedding_model: str) -> None:
+        """在一个事务中用影子向量替换知识库的片段向量和文档摘要向量，并更新知识库的向量化模型、清空目标模型"""
+        try:
+            async with await DataBase.get_session() as session:
+                # 大知识库整体替换耗时可能超过全局语句超时，本事务内取消超时限制
+                await session.execute(text('SET LOCAL statement_timeout = 0'))
+                stmt = (
+                    update(ChunkEntity)
+                    .where(and_(ChunkEntity.kb_id == kb_id, ChunkEntity.text_vector_shadow.isnot(None)))
+                    .values(text_vector=ChunkEntity.text_vector_shadow,
+                            text_vector_shadow=None,
+                            embedding_model=embedding_model)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.execute(stmt)
+                stmt = (
+                    update(DocumentEntity)
+                    .where(and_(DocumentEntity.kb_id == kb_id, DocumentEntity.abstract_vector_shadow.isnot(None)))
+                    .values(abstract_vector=DocumentEntity.abstract_vector_shadow,
+                            abstract_vector_shadow=None,
+                            embedding_model=embedding_model)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.execute(stmt)
+                stmt = (
+                    update(KnowledgeBaseEntity)
+                    .where(KnowledgeBaseEntity.id == kb_id)
+                    .values(embedding_model=embedding_model, reembed_model=None)
+                )
+                await session.execute(stmt)
+                await session.execute(KnowledgeBaseManager.bump_generation_stmt([kb_id]))
+                await session.commit()
+        except Exception as e:
+            err = "切换知识库向量失败"
+            logging.exception("[KnowledgeBaseManager] %s", err)
+            raise e
+
+    @staticmethod
+    async def clear_shadow_vectors(kb_id: uuid.UUID) -> None:
+        """清空知识库中未切换的影子向量和重新向量化的目标模型"""
+        try:
+            async with await DataBase.get_session() as session:
+                stmt = (
+                    update(ChunkEntity)
+                    .where(and_(ChunkEntity.kb_id == kb_id, ChunkEntity.text_vector_shadow.isnot(None)))
+                    .values(text_vector_shadow=None)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.execute(stmt)
+                stmt = (
+                    update(DocumentEntity)
+                    .where(and_(DocumentEntity.kb_id == kb_id, DocumentEntity.abstract_vector_shadow.isnot(None)))
+                    .values(abstract_vector_shadow=None)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.execute(stmt)
+                stmt = (
+                    update(KnowledgeBaseEntity)
+                    .where(KnowledgeBaseEntity.id == kb_id)
+                    .values(reembed_model=None)
+                )
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            err = "清空知识库影子向量失败"
+            logging.exception("[KnowledgeBaseManager] %s", err)
+            raise e
+
     @staticmethod
     async def update_doc_cnt_and_doc_size(kb_id: uuid.UUID) -> None:
         """根据知识库ID更新知识库文档数量和文档大小,获取document表内状态不是deleted的文档数量和大小"""
@@ -1,11 +1,11 @@
 from PIL import Image, ImageEnhance
-import yaml
 from paddleocr import PaddleOCR
 import numpy as np
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.logger.logger import logger as logging
 from data_chain.config.config import config
 from data_chain.llm.llm import LLM
+from data_chain.llm.prompt_registry import prompt_registry
 
 
 class OcrTool:
@@ -71,9 +71,7 @@ class OcrTool:
     @staticmethod
     async def enhance_ocr_result(ocr_result, image_related_text='', llm: LLM = None) -> str:
         try:
-            with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-                prompt_template = prompt_dict.get('OCR_ENHANCED_PROMPT', '')
+            prompt_template = prompt_registry.get('OCR_ENHANCED_PROMPT')
             pre_part_description = ""
             token_limit = llm.max_tokens//2
             image_related_text = TokenTool.get_k_tokens_words_from_content(image_related_text, token_limit)
@@ -86,7 +84,7 @@ class OcrTool:
                         image_related_text=image_related_text,
                         pre_part_description=pre_part_description,
                         part=part)
-                    pre_part_description = await llm.nostream([], prompt, user_call)
+                    pre_part_description = await llm.nostream([], prompt, user_call, use_cache=True)
                 except Exception as e:
                     err = f"[OCRTool] OCR增强失败 {e}"
                     logging.exception(err)
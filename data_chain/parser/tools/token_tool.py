@@ -2,13 +2,14 @@ import asyncio
 import tiktoken
 import jieba
 from jieba.analyse import extract_tags
-import yaml
 import json
 import re
 import uuid
+from functools import lru_cache
 import numpy as np
 from pydantic import BaseModel, Field
 from data_chain.llm.llm import LLM
+from data_chain.llm.prompt_registry import prompt_registry
 from data_chain.embedding.embedding import Embedding
 from data_chain.config.config import config
 from data_chain.logger.logger import logger as logging
@@ -266,16 +267,14 @@ class TokenTool:
         使用llm进行内容摘要
         """
         try:
-            with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            prompt_template = prompt_dict.get('CONTENT_TO_ABSTRACT_PROMPT', '')
+            prompt_template = prompt_registry.get('CONTENT_TO_ABSTRACT_PROMPT')
             sentences = TokenTool.split_str_with_slide_window(content, llm.max_tokens//3*2)
             abstract = ''
             for sentence in sentences:
                 abstract = TokenTool.get_k_tokens_words_from_content(abstract, llm.max_tokens//3)
                 sys_call = prompt_template.format(content=sentence, abstract=abstract)
                 user_call = '请结合文本和摘要输出新的摘要'
-                abstract = await llm.nostream([], sys_call, user_call)
+                abstract = await llm.nostream([], sys_call, user_call, use_cache=True)
                 return abstract
         except Exception as e:
             err = f"[TokenTool] 获取摘要失败 {e}"
@@ -287,13 +286,11 @@ class TokenTool:
         使用llm进行标题生成
         """
         try:
-            with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            prompt_template = prompt_dict.get('CONTENT_TO_TITLE_PROMPT', '')
+            prompt_template = prompt_registry.get('CONTENT_TO_TITLE_PROMPT')
             content = TokenTool.get_k_tokens_words_from_content(content, llm.max_tokens)
             sys_call = prompt_template.format(content=content)
             user_call = '请结合文本输出标题'
-            title = await llm.nostream([], sys_call, user_call)
+            title = await llm.nostream([], sys_call, user_call, use_cache=True)
             return title
         except Exception as e:
             err = f"[TokenTool] 获取标题失败 {e}"
@@ -309,9 +306,7 @@ class TokenTool:
         llm:大模型
         """
         try:
-            with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            prompt_template = prompt_dict.get('ANSWER_TO_ANSWER_PROMPT', '')
+            prompt_template = prompt_registry.get('ANSWER_TO_ANSWER_PROMPT')
             answer_1 = TokenTool.get_k_tokens_words_from_content(answer_1, llm.max_tokens//2)
             answer_2 = TokenTool.get_k_tokens_words_from_content(answer_2, llm.max_tokens//2)
             prompt = prompt_template.format(text_1=answer_1, text_2=answer_2)
@@ -333,9 +328,7 @@ class TokenTool:
         content:内容
         """
         try:
-            with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            prompt_template = prompt_dict.get('CONTENT_TO_STATEMENTS_PROMPT', '')
+            prompt_template = prompt_registry.get('CONTENT_TO_STATEMENTS_PROMPT')
             content = TokenTool.compress_tokens(content, llm.max_tokens)
             sys_call = prompt_template.format(content=content)
             user_call = '请结合文本输出陈诉列表'
@@ -345,7 +338,7 @@ class TokenTool:
             if len(statements) == 0:
                 return 0
             score = 0
-            prompt_template = prompt_dict.get('STATEMENTS_TO_QUESTION_PROMPT', '')
+            prompt_template = prompt_registry.get('STATEMENTS_TO_QUESTION_PROMPT')
             for statement in statements:
                 statement = TokenTool.get_k_tokens_words_from_content(statement, llm.max_tokens)
                 prompt = prompt_template.format(statement=statement, question=question)
@@ -370,9 +363,7 @@ class TokenTool:
         answer:答案
         """
         try:
-            with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            prompt_template = prompt_dict.get('QA_TO_STATEMENTS_PROMPT', '')
+            prompt_template = prompt_registry.get('QA_TO_STATEMENTS_PROMPT')
             question = TokenTool.get_k_tokens_words_from_content(question, llm.max_tokens//8)
             answer = TokenTool.get_k_tokens_words_from_content(answer, llm.max_tokens//8*7)
             prompt = prompt_template.format(question=question, answer=answer)
@@ -380,7 +371,7 @@ class TokenTool:
             user_call = '请结合问题和答案输出陈诉'
             statements = await llm.nostream([], sys_call, user_call,st_str='[',
                                              en_str=']')
-            prompt_template = prompt_dict.get('STATEMENTS_TO_FRAGMENT_PROMPT', '')
+            prompt_template = prompt_registry.get('STATEMENTS_TO_FRAGMENT_PROMPT')
             statements = json.loads(statements)
             if len(statements) == 0:
                 return 0
@@ -424,9 +415,7 @@ class TokenTool:
         answer:答案
         """
         try:
-            with open(config['PROMPT_PATH'], 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            prompt_template = prompt_dict.get('GENREATE_QUESTION_FROM_CONTENT_PROMPT', '')
+            prompt_template = prompt_registry.get('GENREATE_QUESTION_FROM_CONTENT_PROMPT')
             answer = TokenTool.get_k_tokens_words_from_content(answer, llm.max_tokens)
             sys_call = prompt_template.format(k=5, content=answer)
             user_call = '请结合文本输出问题列表'
@@ -523,6 +512,39 @@ class TokenTool:
             logging.exception("[TokenTool] %s", err)
             return -1
 
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def get_term_freq(content: str) -> tuple[dict, int]:
+        """
+        统计去停用词后的词频，按文本内容缓存，返回(词频字典, 词数)
+        """
+        term_freq = {}
+        term_cnt = 0
+        for word in TokenTool.split_words(content):
+            if not word.strip() or word in TokenTool.stopwords:
+                continue
+            term_freq[word] = term_freq.get(word, 0) + 1
+            term_cnt += 1
+        return term_freq, term_cnt
+
+    @staticmethod
+    def cal_bm25_scores(query: str, contents: list[str], k1: float = 1.5, b: float = 0.75) -> np.ndarray:
+        """
+        以候选文本为语料计算query对每个文本的BM25分数
+        """
+        query_terms = list(TokenTool.get_term_freq(query)[0].keys())
+        if len(contents) == 0 or len(query_terms) == 0:
+            return np.zeros(len(contents))
+        term_freqs = [TokenTool.get_term_freq(content) for content in contents]
+        tf = np.array([[term_freq.get(term, 0) for term in query_terms]
+                      for term_freq, _ in term_freqs], dtype=np.float64)
+        doc_len = np.array([term_cnt for _, term_cnt in term_freqs], dtype=np.float64)
+        avg_doc_len = max(doc_len.mean(), 1)
+        df = (tf > 0).sum(axis=0)
+        idf = np.log((len(contents) - df + 0.5) / (df + 0.5) + 1)
+        norm = k1 * (1 - b + b * doc_len / avg_doc_len)
+        return (idf * tf * (k1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
     @staticmethod
     def cal_jac(str1: str, str2: str) -> float:
         """
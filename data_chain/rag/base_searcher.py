@@ -2,15 +2,21 @@
 import uuid
 from pydantic import BaseModel, Field
 import random
+import numpy as np
 from data_chain.logger.logger import logger as logging
 from data_chain.apps.base.convertor import Convertor
 from data_chain.stores.database.database import ChunkEntity
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.chunk_manager import ChunkManager
+from data_chain.rag.search_cache import SearchCache
 from data_chain.entities.response_data import Chunk, DocChunk
+from data_chain.entities.enum import RerankMethod
 
 
 class BaseSearcher:
+    # 重排序时向量相似度所占权重
+    vector_weight = 0.3
+
     @staticmethod
     def find_worker_class(worker_name: str):
         subclasses = BaseSearcher.__subclasses__()
@@ -32,30 +38,66 @@ class BaseSearcher:
         """
         search_class = BaseSearcher.find_worker_class(search_method)
         if search_class:
-            return await search_class.search(
-                query=query, kb_id=kb_id, top_k=top_k, doc_ids=doc_ids, banned_ids=banned_ids
-            )
+            # 检索器会向banned_ids追加内容，传入副本
+            banned_ids = list(banned_ids or [])
+            try:
+                return await SearchCache.search(
+                    search_method, kb_id, query, top_k, doc_ids, banned_ids,
+                    lambda: search_class.search(
+                        query=query, kb_id=kb_id, top_k=top_k, doc_ids=doc_ids, banned_ids=list(banned_ids)
+                    )
+                )
+            except Exception as e:
+                # 检索器失败时抛出异常，结果不会写入检索缓存，这里兜底返回空结果
+                err = f"[BaseSearch] 检索失败，search_method: {search_method}，error: {e}"
+                logging.exception(err)
+                return []
         else:
             err = f"[BaseSearch] 检索器不存在，search_method: {search_method}"
             logging.exception(err)
             raise Exception(err)
 
     @staticmethod
-    async def rerank(chunk_entities: list[ChunkEntity], query: str) -> list[ChunkEntity]:
+    async def rerank(
+            chunk_entities: list[ChunkEntity], query: str,
+            rerank_method: str = RerankMethod.BM25.value) -> list[ChunkEntity]:
         """
         重新排序
         :param list: 检索结果
         :param query: 查询
+        :param rerank_method: 重新排序方法
         :return: 重新排序后的结果
         """
-        score_chunk_entities = []
-        for chunk_entity in chunk_entities:
-            score = TokenTool.cal_jac(chunk_entity.text, query)
-            score_chunk_entities.append((score, chunk_entity))
+        if rerank_method == RerankMethod.JACCARD.value:
+            scores = [TokenTool.cal_jac(chunk_entity.text, query) for chunk_entity in chunk_entities]
+        else:
+            scores = BaseSearcher.cal_fusion_scores(chunk_entities, query).tolist()
+        score_chunk_entities = list(zip(scores, chunk_entities))
         score_chunk_entities.sort(key=lambda x: x[0], reverse=True)
         sorted_chunk_entities = [chunk_entity for _, chunk_entity in score_chunk_entities]
         return sorted_chunk_entities
 
+    @staticmethod
+    def cal_fusion_scores(chunk_entities: list[ChunkEntity], query: str) -> np.ndarray:
+        """
+        融合BM25分数与向量检索阶段得到的余弦距离
+        :param list: 检索结果
+        :param query: 查询
+        :return: 融合后的分数
+        """
+        bm25_scores = TokenTool.cal_bm25_scores(query, [chunk_entity.text for chunk_entity in chunk_entities])
+        if bm25_scores.max(initial=0) > 0:
+            bm25_scores = bm25_scores / bm25_scores.max()
+        distances = np.array([getattr(chunk_entity, 'vector_distance', None)
+                             for chunk_entity in chunk_entities], dtype=np.float64)
+        has_distance = ~np.isnan(distances)
+        if not has_distance.any():
+            return bm25_scores
+        # 非向量检索得到的分片没有距离，按候选中最差的相似度计
+        similarities = 1 - distances
+        similarities[~has_distance] = similarities[has_distance].min()
+        return (1 - BaseSearcher.vector_weight) * bm25_scores + BaseSearcher.vector_weight * similarities
+
     @staticmethod
     async def related_surround_chunk(
             chunk_entity: ChunkEntity, tokens_limit: int = 1024, banned_ids: list[uuid.UUID] = []) -> list[ChunkEntity]:
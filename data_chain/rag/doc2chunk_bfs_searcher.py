@@ -8,6 +8,7 @@ from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.document_manager import DocumentManager
 from data_chain.manager.chunk_manager import ChunkManager
 from data_chain.rag.base_searcher import BaseSearcher
+from data_chain.rag.search_cache import SearchCache
 from data_chain.embedding.embedding import Embedding
 from data_chain.entities.enum import SearchMethod
 from data_chain.entities.enum import ChunkParseTopology
@@ -15,9 +16,82 @@ from data_chain.entities.enum import ChunkParseTopology
 
 class Doc2ChunkBfsSearcher(BaseSearcher):
     """
-    关键词向量检索
+    树形文档检索
+    先召回树根，再用一次递归查询展开并打分根下的全部节点，在内存中按子树选择结果
     """
     name = SearchMethod.DOC2CHUNK_BFS.value
+    # 展开的最大深度
+    max_depth = 5
+    # 一次展开的最大节点数
+    max_node_cnt = 2000
+    # 节点分数中关键词分数所占权重
+    keyword_weight = 0.3
+
+    @staticmethod
+    async def get_root_chunks(
+            query: str, vector: list[float], kb_id: uuid.UUID, top_k: int, doc_ids: list[uuid.UUID],
+            banned_ids: list[uuid.UUID]) -> list[ChunkEntity]:
+        """并发进行关键词和向量检索召回树根"""
+        async def get_by_vector():
+            for _ in range(3):
+                try:
+                    return await asyncio.wait_for(ChunkManager.get_top_k_chunk_by_kb_id_vector(
+                        kb_id, vector, top_k, doc_ids, banned_ids, ChunkParseTopology.TREEROOT.value), timeout=3)
+                except Exception as e:
+                    err = f"[Doc2ChunkBfsSearcher] 向量检索失败，error: {e}"
+                    logging.error(err)
+            SearchCache.mark_uncacheable("向量检索失败")
+            return []
+        root_chunk_entities_keyword, root_chunk_entities_vector = await asyncio.gather(
+            ChunkManager.get_top_k_chunk_by_kb_id_keyword(
+                kb_id, query, max(top_k//2, 1), doc_ids, banned_ids, ChunkParseTopology.TREEROOT.value),
+            get_by_vector()
+        )
+        root_chunk_entity_dict = {}
+        for chunk_entity in root_chunk_entities_keyword + root_chunk_entities_vector:
+            root_chunk_entity_dict.setdefault(chunk_entity.id, chunk_entity)
+        return list(root_chunk_entity_dict.values())
+
+    @staticmethod
+    def select_from_trees(
+            root_ids: list[uuid.UUID], nodes: list[tuple[ChunkEntity, int, float, float]],
+            top_k: int) -> list[ChunkEntity]:
+        """
+        节点分数由关键词分数和向量相似度加权得到，子树分数为子树中节点分数的最大值
+        最终按节点分数与其所在树的子树分数的平均值排序
+        """
+        if not nodes:
+            return []
+        max_keyword_score = max(keyword_score or 0 for _, _, keyword_score, _ in nodes)
+        node_scores = {}
+        parent_ids = {}
+        for chunk_entity, depth, keyword_score, vector_distance in nodes:
+            chunk_entity.vector_distance = vector_distance
+            keyword_score = (keyword_score or 0) / max_keyword_score if max_keyword_score > 0 else 0
+            similarity = 1 - vector_distance if vector_distance is not None else 0
+            node_scores[chunk_entity.id] = (
+                Doc2ChunkBfsSearcher.keyword_weight * keyword_score
+                + (1 - Doc2ChunkBfsSearcher.keyword_weight) * similarity)
+            if depth > 0:
+                parent_ids[chunk_entity.id] = chunk_entity.pre_id_in_parse_topology
+        # 自底向上汇总子树分数，节点按深度升序返回，逆序遍历即可
+        subtree_scores = dict(node_scores)
+        for chunk_entity, _, _, _ in reversed(nodes):
+            parent_id = parent_ids.get(chunk_entity.id)
+            if parent_id in subtree_scores:
+                subtree_scores[parent_id] = max(subtree_scores[parent_id], subtree_scores[chunk_entity.id])
+        root_id_set = set(root_ids)
+
+        def find_root_id(chunk_id: uuid.UUID) -> uuid.UUID:
+            while chunk_id not in root_id_set and chunk_id in parent_ids:
+                chunk_id = parent_ids[chunk_id]
+            return chunk_id
+        scored_chunk_entities = []
+        for chunk_entity, _, _, _ in nodes:
+            root_score = subtree_scores.get(find_root_id(chunk_entity.id), 0)
+            scored_chunk_entities.append(((node_scores[chunk_entity.id] + root_score) / 2, chunk_entity))
+        scored_chunk_entities.sort(key=lambda x: x[0], reverse=True)
+        return [chunk_entity for _, chunk_entity in scored_chunk_entities[:top_k]]
 
     @staticmethod
     async def search(
@@ -25,50 +99,22 @@ class Doc2ChunkBfsSearcher(BaseSearcher):
             banned_ids: list[uuid.UUID] = []
     ) -> list[ChunkEntity]:
         """
-        向量检索
+        树形文档检索
         :param query: 查询
         :param top_k: 返回的结果数量
         :return: 检索结果
         """
-        vector = await Embedding.vectorize_embedding(query)
+        vector = await SearchCache.get_query_vector(query, kb_id)
         try:
-            root_chunk_entities_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_keyword(kb_id, query, top_k//2, doc_ids, banned_ids, ChunkParseTopology.TREEROOT.value)
-            banned_ids += [chunk_entity.id for chunk_entity in root_chunk_entities_keyword]
-            root_chunk_entities_vector = []
-            for _ in range(3):
-                try:
-                    root_chunk_entities_vector = await asyncio.wait_for(ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k-len(root_chunk_entities_keyword), doc_ids, banned_ids, ChunkParseTopology.TREEROOT.value), timeout=3)
-                    break
-                except Exception as e:
-                    err = f"[KeywordVectorSearcher] 向量检索失败，error: {e}"
-                    logging.error(err)
-                    continue
-            banned_ids += [chunk_entity.id for chunk_entity in root_chunk_entities_vector]
-            chunk_entities = root_chunk_entities_keyword + root_chunk_entities_vector
-            pre_ids = [chunk_entity.id for chunk_entity in chunk_entities]
-            rd = 0
-            max_retry = 5
-            while rd < max_retry:
-                root_chunk_entities_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_keyword(kb_id, query, top_k//2, doc_ids, banned_ids, None, pre_ids)
-                banned_ids += [chunk_entity.id for chunk_entity in root_chunk_entities_keyword]
-                root_chunk_entities_vector = []
-                for _ in range(3):
-                    try:
-                        root_chunk_entities_vector = await asyncio.wait_for(ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k-len(root_chunk_entities_keyword), doc_ids, banned_ids, None, pre_ids), timeout=3)
-                        break
-                    except Exception as e:
-                        err = f"[KeywordVectorSearcher] 向量检索失败，error: {e}"
-                        logging.error(err)
-                        continue
-                banned_ids += [chunk_entity.id for chunk_entity in root_chunk_entities_vector]
-                sub_chunk_entities = root_chunk_entities_keyword + root_chunk_entities_vector
-                if len(sub_chunk_entities) == 0:
-                    break
-                chunk_entities += sub_chunk_entities
-                pre_ids = [chunk_entity.id for chunk_entity in sub_chunk_entities]
-                rd += 1
+            root_chunk_entities = await Doc2ChunkBfsSearcher.get_root_chunks(
+                query, vector, kb_id, top_k, doc_ids, banned_ids)
+            root_ids = [chunk_entity.id for chunk_entity in root_chunk_entities]
+            nodes = await ChunkManager.list_chunk_tree_with_score_by_root_ids(
+                kb_id, root_ids, query, vector, Doc2ChunkBfsSearcher.max_depth,
+                Doc2ChunkBfsSearcher.max_node_cnt, banned_ids)
+            chunk_entities = Doc2ChunkBfsSearcher.select_from_trees(root_ids, nodes, top_k)
         except Exception as e:
-            err = f"[KeywordVectorSearcher] 关键词向量检索失败，error: {e}"
+            err = f"[Doc2ChunkBfsSearcher] 树形文档检索失败，error: {e}"
             logging.exception(err)
-            return []
+            raise e
         return chunk_entities
@@ -8,6 +8,7 @@ from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.document_manager import DocumentManager
 from data_chain.manager.chunk_manager import ChunkManager
 from data_chain.rag.base_searcher import BaseSearcher
+from data_chain.rag.search_cache import SearchCache
 from data_chain.embedding.embedding import Embedding
 from data_chain.entities.enum import SearchMethod
 
@@ -29,9 +30,9 @@ class Doc2ChunkSearcher(BaseSearcher):
         :param top_k: 返回的结果数量
         :return: 检索结果
         """
-        vector = await Embedding.vectorize_embedding(query)
+        vector = await SearchCache.get_query_vector(query, kb_id)
         try:
-            keywords, weights = TokenTool.get_top_k_keywords_and_weights(query)
+            keywords, weights = await SearchCache.get_query_keywords_and_weights(query)
             doc_entities_keyword = await DocumentManager.get_top_k_document_by_kb_id_dynamic_weighted_keyword(kb_id, keywords, weights, top_k//2, doc_ids, [])
             use_doc_ids = [doc_entity.id for doc_entity in doc_entities_keyword]
             doc_entities_vector = []
@@ -43,10 +44,12 @@ class Doc2ChunkSearcher(BaseSearcher):
                     err = f"[KeywordVectorSearcher] 向量检索失败，error: {e}"
                     logging.error(err)
                     continue
+            else:
+                SearchCache.mark_uncacheable("向量检索失败")
             use_doc_ids += [doc_entity.id for doc_entity in doc_entities_vector]
             chunk_entities_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_keyword(kb_id, query, top_k//3, use_doc_ids, banned_ids)
             banned_ids += [chunk_entity.id for chunk_entity in chunk_entities_keyword]
-            keywords, weights = TokenTool.get_top_k_keywords_and_weights(query)
+            keywords, weights = await SearchCache.get_query_keywords_and_weights(query)
             logging.error(f"[KeywordVectorSearcher] keywords: {keywords}, weights: {weights}")
             chunk_entities_get_by_dynamic_weighted_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_dynamic_weighted_keyword(kb_id, keywords, weights, top_k//2, use_doc_ids, banned_ids)
             banned_ids += [chunk_entity.id for chunk_entity in chunk_entities_get_by_dynamic_weighted_keyword]
@@ -59,9 +62,11 @@ class Doc2ChunkSearcher(BaseSearcher):
                     err = f"[KeywordVectorSearcher] 向量检索失败，error: {e}"
                     logging.error(err)
                     continue
+            else:
+                SearchCache.mark_uncacheable("向量检索失败")
             chunk_entities = chunk_entities_keyword + chunk_entities_get_by_dynamic_weighted_keyword + chunk_entities_vector
         except Exception as e:
             err = f"[KeywordVectorSearcher] 关键词向量检索失败，error: {e}"
             logging.exception(err)
-            return []
+            raise e
         return chunk_entities
@@ -7,6 +7,7 @@ from data_chain.stores.database.database import ChunkEntity
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.chunk_manager import ChunkManager
 from data_chain.rag.base_searcher import BaseSearcher
+from data_chain.rag.search_cache import SearchCache
 from data_chain.entities.enum import SearchMethod
 
 
@@ -28,10 +29,10 @@ class DynamicWeightKeyWordSearcher(BaseSearcher):
         :return: 检索结果
         """
         try:
-            keywords, weights = TokenTool.get_top_k_keywords_and_weights(query)
+            keywords, weights = await SearchCache.get_query_keywords_and_weights(query)
             chunk_entities = await ChunkManager.get_top_k_chunk_by_kb_id_dynamic_weighted_keyword(kb_id, keywords, weights, top_k, doc_ids, banned_ids)
         except Exception as e:
             err = f"[KeywordVectorSearcher] 关键词向量检索失败，error: {e}"
             logging.exception(err)
-            return []
+            raise e
         return chunk_entities
@@ -1,6 +1,5 @@
 import asyncio
 import uuid
-import yaml
 from pydantic import BaseModel, Field
 import random
 from data_chain.logger.logger import logger as logging
@@ -8,10 +7,12 @@ from data_chain.stores.database.database import ChunkEntity
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.chunk_manager import ChunkManager
 from data_chain.rag.base_searcher import BaseSearcher
+from data_chain.rag.search_cache import SearchCache
 from data_chain.embedding.embedding import Embedding
 from data_chain.entities.enum import SearchMethod
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.llm.llm import LLM
+from data_chain.llm.prompt_registry import prompt_registry
 from data_chain.config.config import config
 
 
@@ -21,6 +22,22 @@ class EnhancedByLLMSearcher(BaseSearcher):
     """
     name = SearchMethod.ENHANCED_BY_LLM.value
 
+    @staticmethod
+    async def judge_chunk(
+            llm: LLM, prompt_template, query: str, chunk_entity: ChunkEntity,
+            semaphore: asyncio.Semaphore) -> bool:
+        """
+        判断分片与问题是否相关
+        """
+        async with semaphore:
+            sys_call = prompt_template.format(
+                chunk=TokenTool.get_k_tokens_words_from_content(chunk_entity.text, llm.max_tokens),
+                question=query,
+            )
+            user_call = "请输出YES或NO"
+            result = await llm.nostream([], sys_call, user_call, use_cache=True)
+        return result.lower() == "yes"
+
     @staticmethod
     async def search(
             query: str, kb_id: uuid.UUID, top_k: int = 5, doc_ids: list[uuid.UUID] = None,
@@ -32,12 +49,14 @@ class EnhancedByLLMSearcher(BaseSearcher):
         :param top_k: 返回的结果数量
         :return: 检索结果
         """
-        vector = await Embedding.vectorize_embedding(query)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config['ENHANCED_SEARCH_TIME_BUDGET']
+        vector = await SearchCache.get_query_vector(query, kb_id)
         try:
-            with open('./data_chain/common/prompt.yaml', 'r', encoding='utf-8') as f:
-                prompt_dict = yaml.safe_load(f)
-            prompt_template = prompt_dict['CHUNK_QUERY_MATCH_PROMPT']
+            prompt_template = prompt_registry.get('CHUNK_QUERY_MATCH_PROMPT')
             chunk_entities = []
+            # 超时时尚未判断完的候选分片，按检索顺序兜底返回
+            unjudged_chunk_entities = []
             rd = 0
             max_retry = 15
             llm = LLM(
@@ -46,40 +65,71 @@ class EnhancedByLLMSearcher(BaseSearcher):
                 model_name=config['MODEL_NAME'],
                 max_tokens=config['MAX_TOKENS'],
             )
-            keywords, weights = TokenTool.get_top_k_keywords_and_weights(query)
-            while len(chunk_entities) < top_k and rd < max_retry:
+            semaphore = asyncio.Semaphore(config['ENHANCED_SEARCH_LLM_CONCURRENCY'])
+            keywords, weights = await SearchCache.get_query_keywords_and_weights(query)
+            while len(chunk_entities) < top_k and rd < max_retry and loop.time() < deadline:
                 rd += 1
-                sub_chunk_entities_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_dynamic_weighted_keyword(
-                    kb_id, keywords, weights, top_k, doc_ids, banned_ids)
+                # 检索本身的耗时也计入耗时上限
+                try:
+                    sub_chunk_entities_keyword = await asyncio.wait_for(
+                        ChunkManager.get_top_k_chunk_by_kb_id_dynamic_weighted_keyword(
+                            kb_id, keywords, weights, top_k, doc_ids, banned_ids),
+                        timeout=deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
                 chunk_ids = [chunk_entity.id for chunk_entity in sub_chunk_entities_keyword]
                 banned_ids += chunk_ids
                 sub_chunk_entities_vector = []
                 for _ in range(3):
+                    timeout = min(3, deadline - loop.time())
+                    if timeout <= 0:
+                        break
                     try:
-                        sub_chunk_entities_vector = await asyncio.wait_for(ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k, doc_ids, banned_ids), timeout=3)
+                        sub_chunk_entities_vector = await asyncio.wait_for(ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k, doc_ids, banned_ids), timeout=timeout)
                         break
                     except Exception as e:
                         err = f"[EnhancedByLLMSearcher] 向量检索失败，error: {e}"
                         logging.error(err)
                         continue
+                else:
+                    SearchCache.mark_uncacheable("向量检索失败")
                 chunk_ids = [chunk_entity.id for chunk_entity in sub_chunk_entities_vector]
                 banned_ids += chunk_ids
                 sub_chunk_entities = sub_chunk_entities_keyword + sub_chunk_entities_vector
-                for chunk_entity in sub_chunk_entities:
-                    sys_call = prompt_template.format(
-                        chunk=TokenTool.get_k_tokens_words_from_content(chunk_entity.text, llm.max_tokens),
-                        question=query,
-                    )
-                    user_call = "请输出YES或NO"
-                    result = await llm.nostream([], sys_call, user_call)
-                    result = result.lower()
-                    if result == "yes":
+                if not sub_chunk_entities:
+                    break
+                tasks = [
+                    asyncio.create_task(EnhancedByLLMSearcher.judge_chunk(
+                        llm, prompt_template, query, chunk_entity, semaphore))
+                    for chunk_entity in sub_chunk_entities
+                ]
+                pending = set(tasks)
+                accepted_cnt = 0
+                while pending and len(chunk_entities) + accepted_cnt < top_k:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    done, pending = await asyncio.wait(
+                        pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if not task.exception() and task.result():
+                            accepted_cnt += 1
+                for task in pending:
+                    task.cancel()
+                for task, chunk_entity in zip(tasks, sub_chunk_entities):
+                    if not task.done() or task.cancelled():
+                        unjudged_chunk_entities.append(chunk_entity)
+                    elif not task.exception() and task.result():
                         chunk_entities.append(chunk_entity)
                         logging.info(
                             f"[EnhancedByLLMSearcher] 匹配到分片: {chunk_entity.id}, 分片内容: {chunk_entity.text[:50]}...")
-                banned_ids += chunk_ids
+            if len(chunk_entities) < top_k and loop.time() >= deadline:
+                logging.warning(f"[EnhancedByLLMSearcher] 检索超出耗时上限，返回已获得的结果，轮次: {rd}")
+                # 结果中包含未经大模型判断的分片，不作为完整结果缓存
+                SearchCache.mark_uncacheable("检索超出耗时上限")
+                chunk_entities += unjudged_chunk_entities[:top_k - len(chunk_entities)]
             return chunk_entities[:top_k]
         except Exception as e:
             err = f"[KeywordVectorSearcher] 关键词向量检索失败，error: {e}"
             logging.exception(err)
-            return []
+            raise e
@@ -7,6 +7,7 @@ from data_chain.stores.database.database import ChunkEntity
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.chunk_manager import ChunkManager
 from data_chain.rag.base_searcher import BaseSearcher
+from data_chain.rag.search_cache import SearchCache
 from data_chain.embedding.embedding import Embedding
 from data_chain.entities.enum import SearchMethod
 
@@ -28,12 +29,12 @@ class KeywordVectorSearcher(BaseSearcher):
         :param top_k: 返回的结果数量
         :return: 检索结果
         """
-        vector = await Embedding.vectorize_embedding(query)
+        vector = await SearchCache.get_query_vector(query, kb_id)
         try:
             chunk_entities_get_by_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_keyword(
                 kb_id, query, max(top_k//3, 1), doc_ids, banned_ids)
             banned_ids += [chunk_entity.id for chunk_entity in chunk_entities_get_by_keyword]
-            keywords, weights = TokenTool.get_top_k_keywords_and_weights(query)
+            keywords, weights = await SearchCache.get_query_keywords_and_weights(query)
             logging.error(f"[KeywordVectorSearcher] keywords: {keywords}, weights: {weights}")
             chunk_entities_get_by_dynamic_weighted_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_dynamic_weighted_keyword(kb_id, keywords, weights, top_k//2, doc_ids, banned_ids)
             banned_ids += [chunk_entity.id for chunk_entity in chunk_entities_get_by_dynamic_weighted_keyword]
@@ -46,6 +47,8 @@ class KeywordVectorSearcher(BaseSearcher):
                     err = f"[KeywordVectorSearcher] 向量检索失败，error: {e}"
                     logging.error(err)
                     continue
+            else:
+                SearchCache.mark_uncacheable("向量检索失败")
             chunk_entities = chunk_entities_get_by_keyword + chunk_entities_get_by_dynamic_weighted_keyword + chunk_entities_get_by_vector
             for chunk_entity in chunk_entities:
                 logging.error(
@@ -53,5 +56,5 @@ class KeywordVectorSearcher(BaseSearcher):
         except Exception as e:
             err = f"[KeywordVectorSearcher] 关键词向量检索失败，error: {e}"
             logging.exception(err)
-            return []
+            raise e
         return chunk_entities
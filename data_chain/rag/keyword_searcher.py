@@ -29,5 +29,5 @@ class KeyWordSearcher(BaseSearcher):
         except Exception as e:
             err = f"[KeyWordSearcher] 关键词检索失败，error: {e}"
             logging.exception(err)
-            return []
+            raise e
         return chunk_entities
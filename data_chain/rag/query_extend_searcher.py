@@ -1,6 +1,5 @@
 import asyncio
 import uuid
-import yaml
 from pydantic import BaseModel, Field
 import random
 import json
@@ -8,11 +7,14 @@ from data_chain.logger.logger import logger as logging
 from data_chain.stores.database.database import ChunkEntity
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.chunk_manager import ChunkManager
+from data_chain.manager.knowledge_manager import KnowledgeBaseManager
 from data_chain.rag.base_searcher import BaseSearcher
+from data_chain.rag.search_cache import SearchCache
 from data_chain.embedding.embedding import Embedding
 from data_chain.entities.enum import SearchMethod
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.llm.llm import LLM
+from data_chain.llm.prompt_registry import prompt_registry
 from data_chain.config.config import config
 
 
@@ -21,6 +23,9 @@ class QueryExtendSearcher(BaseSearcher):
     基于查询扩展的搜索
     """
     name = SearchMethod.QUERY_EXTEND.value
+    # 同时进行的检索数，关键词检索单次会占用两个数据库连接
+    concurrency = 4
+    rrf_k = 60
 
     @staticmethod
     async def search(
@@ -33,9 +38,7 @@ class QueryExtendSearcher(BaseSearcher):
         :param top_k: 返回的结果数量
         :return: 检索结果
         """
-        with open('./data_chain/common/prompt.yaml', 'r', encoding='utf-8') as f:
-            prompt_dict = yaml.safe_load(f)
-        prompt_template = prompt_dict['QUERY_EXTEND_PROMPT']
+        prompt_template = prompt_registry.get('QUERY_EXTEND_PROMPT')
         chunk_entities = []
         llm = LLM(
             openai_api_key=config['OPENAI_API_KEY'],
@@ -45,29 +48,52 @@ class QueryExtendSearcher(BaseSearcher):
         )
         sys_call = prompt_template.format(k=2*top_k, question=query)
         user_call = "请输出扩写的问题列表"
-        queries = await llm.nostream([], sys_call, user_call, st_str='[', en_str=']')
+        queries = await llm.nostream([], sys_call, user_call, st_str='[', en_str=']', use_cache=True)
         try:
             queries = json.loads(queries)
             queries += [query]
         except Exception as e:
             logging.error(f"[QueryExtendSearcher] JSON解析失败，error: {e}")
             queries = [query]
-        queries = list(set(queries))
-        chunk_entities = []
-        for query in queries:
-            vector = await Embedding.vectorize_embedding(query)
-            chunk_entities_get_by_keyword = await ChunkManager.get_top_k_chunk_by_kb_id_keyword(kb_id, query, 2, doc_ids, banned_ids)
-            banned_ids += [chunk_entity.id for chunk_entity in chunk_entities_get_by_keyword]
-            chunk_entities_get_by_vector = []
-            for _ in range(3):
-                try:
-                    chunk_entities_get_by_vector = await asyncio.wait_for(ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k-len(chunk_entities_get_by_keyword), doc_ids, banned_ids), timeout=3)
-                    break
-                except Exception as e:
-                    err = f"[KeywordVectorSearcher] 向量检索失败，error: {e}"
-                    logging.error(err)
-                    continue
-            banned_ids += [chunk_entity.id for chunk_entity in chunk_entities_get_by_vector]
-            sub_chunk_entities = chunk_entities_get_by_keyword + chunk_entities_get_by_vector
-            chunk_entities += sub_chunk_entities
+        # 去重并保留扩写结果的顺序，保证相同问题的检索结果稳定
+        queries = list(dict.fromkeys(queries))
+        embedding_model = await KnowledgeBaseManager.get_embedding_model(kb_id)
+        vectors = await Embedding.vectorize_embeddings(queries, embedding_model)
+        semaphore = asyncio.Semaphore(QueryExtendSearcher.concurrency)
+
+        async def search_by_keyword(sub_query: str) -> list[ChunkEntity]:
+            async with semaphore:
+                return await ChunkManager.get_top_k_chunk_by_kb_id_keyword(kb_id, sub_query, top_k, doc_ids, banned_ids)
+
+        async def search_by_vector(vector: list[float]) -> list[ChunkEntity]:
+            if vector is None:
+                SearchCache.mark_uncacheable("扩写问题向量化失败")
+                return []
+            async with semaphore:
+                for _ in range(3):
+                    try:
+                        return await asyncio.wait_for(ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k, doc_ids, banned_ids), timeout=3)
+                    except Exception as e:
+                        err = f"[QueryExtendSearcher] 向量检索失败，error: {e}"
+                        logging.error(err)
+                        continue
+            SearchCache.mark_uncacheable("向量检索失败")
+            return []
+        tasks = [search_by_keyword(sub_query) for sub_query in queries]
+        tasks += [search_by_vector(vector) for vector in vectors]
+        ranked_lists = await asyncio.gather(*tasks, return_exceptions=True)
+        # 倒数排序融合，多个扩写问题共同命中的分片排名靠前
+        chunk_entity_dict = {}
+        rrf_scores = {}
+        for ranked_list in ranked_lists:
+            if isinstance(ranked_list, BaseException):
+                logging.error(f"[QueryExtendSearcher] 扩写问题检索失败，error: {ranked_list}")
+                SearchCache.mark_uncacheable("扩写问题检索失败")
+                continue
+            for rank, chunk_entity in enumerate(ranked_list):
+                chunk_entity_dict.setdefault(chunk_entity.id, chunk_entity)
+                rrf_scores[chunk_entity.id] = rrf_scores.get(
+                    chunk_entity.id, 0) + 1 / (QueryExtendSearcher.rrf_k + rank + 1)
+        chunk_ids = sorted(rrf_scores.keys(), key=lambda chunk_id: rrf_scores[chunk_id], reverse=True)
+        chunk_entities = [chunk_entity_dict[chunk_id] for chunk_id in chunk_ids[:top_k]]
         return chunk_entities
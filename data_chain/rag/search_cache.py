@@ -0,0 +1,168 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+
+from data_chain.config.config import config
+from data_chain.logger.logger import logger as logging
+from data_chain.embedding.embedding import Embedding
+from data_chain.parser.tools.token_tool import TokenTool
+from data_chain.manager.chunk_manager import ChunkManager
+from data_chain.manager.knowledge_manager import KnowledgeBaseManager
+from data_chain.stores.database.database import ChunkEntity
+
+
+class TTLCache:
+    """进程内带过期时间的LRU缓存，相同键的并发未命中只计算一次"""
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.pending = {}
+
+    def get(self, key: Any) -> Any:
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expire_time, value = item
+        if expire_time < time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    async def get_or_compute(self, key: Any, compute: Callable[[], Awaitable[Any]]) -> Any:
+        '''未命中时计算并缓存，结果为None时不缓存'''
+        value = self.get(key)
+        if value is not None:
+            return value
+        future = self.pending.get(key)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 计算方被取消时由当前调用重新计算，当前任务自身被取消时继续抛出
+                if not future.cancelled():
+                    raise
+                return await self.get_or_compute(key, compute)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            value = await compute()
+            if value is not None:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免未取回异常的告警
+            future.exception()
+            raise e
+        finally:
+            # 计算被取消时future未完成，取消future以唤醒等待者
+            if not future.done():
+                future.cancel()
+            self.pending.pop(key, None)
+
+
+class SearchCache:
+    '''
+    检索缓存
+    一级缓存: (向量化模型, 查询文本) -> 查询向量，查询文本 -> 关键词及权重
+    二级缓存: (知识库ID, 知识库内容代数, 查询, 检索方法, top_k, 文档ID, 排除的片段ID) -> 排序后的片段ID
+    知识库中的文档或片段变化时内容代数递增，旧的检索结果自然失效
+    空结果和被标记为不完整的结果不写入二级缓存
+    '''
+    query_cache = TTLCache(config['SEARCH_CACHE_TTL'], config['SEARCH_CACHE_MAX_SIZE'])
+    result_cache = TTLCache(config['SEARCH_CACHE_TTL'], config['SEARCH_CACHE_MAX_SIZE'])
+    # 当前检索中结果不完整的原因，检索器并发的子任务复制上下文后共享同一个列表
+    uncacheable_reasons_var: ContextVar[list] = ContextVar('search_uncacheable_reasons', default=None)
+
+    @staticmethod
+    def mark_uncacheable(reason: str) -> None:
+        '''标记当前检索结果不完整(部分检索失败、超出耗时上限等)，结果不写入缓存'''
+        reasons = SearchCache.uncacheable_reasons_var.get()
+        if reasons is not None:
+            reasons.append(reason)
+
+    @staticmethod
+    async def get_query_vector(query: str, kb_id: uuid.UUID) -> list[float]:
+        '''使用知识库当前的向量化模型向量化查询，重新向量化切换完成前仍为原模型'''
+        embedding_model = await KnowledgeBaseManager.get_embedding_model(kb_id)
+        if not config['SEARCH_CACHE_ENABLE']:
+            return await Embedding.vectorize_embedding(query, embedding_model)
+        return await SearchCache.query_cache.get_or_compute(
+            ('vector', embedding_model, query), lambda: Embedding.vectorize_embedding(query, embedding_model))
+
+    @staticmethod
+    async def get_query_keywords_and_weights(query: str, k: int = 10) -> tuple[list[str], list[float]]:
+        if not config['SEARCH_CACHE_ENABLE']:
+            return TokenTool.get_top_k_keywords_and_weights(query, k)
+
+        async def compute():
+            result = TokenTool.get_top_k_keywords_and_weights(query, k)
+            return tuple(result) if result else None
+        result = await SearchCache.query_cache.get_or_compute(('keywords', query, k), compute)
+        if not result:
+            return [], []
+        keywords, weights = result
+        # 调用方可能修改返回的列表，返回副本
+        return list(keywords), list(weights)
+
+    @staticmethod
+    async def search(
+            search_method: str, kb_id: uuid.UUID, query: str, top_k: int, doc_ids: list[uuid.UUID],
+            banned_ids: list[uuid.UUID], compute: Callable[[], Awaitable[list[ChunkEntity]]]) -> list[ChunkEntity]:
+        '''命中时按缓存的片段ID重新加载片段，保持原有顺序和向量距离'''
+        if not config['SEARCH_CACHE_ENABLE']:
+            return await compute()
+        try:
+            generation = await KnowledgeBaseManager.get_generation(kb_id)
+        except Exception as e:
+            err = f"[SearchCache] 获取知识库内容代数失败，跳过检索缓存: {e}"
+            logging.error(err)
+            return await compute()
+        key = (kb_id, generation, query, search_method, top_k,
+               tuple(sorted(doc_ids)) if doc_ids is not None else None,
+               tuple(sorted(banned_ids or [])))
+        computed_chunk_entities = None
+
+        async def compute_ranked_ids():
+            nonlocal computed_chunk_entities
+            reasons = []
+            token = SearchCache.uncacheable_reasons_var.set(reasons)
+            try:
+                computed_chunk_entities = await compute()
+            finally:
+                SearchCache.uncacheable_reasons_var.reset(token)
+            if not computed_chunk_entities or reasons:
+                # 返回None时不缓存，等待同一结果的调用各自重新检索
+                return None
+            return [(chunk_entity.id, getattr(chunk_entity, 'vector_distance', None))
+                    for chunk_entity in computed_chunk_entities]
+        ranked_ids = await SearchCache.result_cache.get_or_compute(key, compute_ranked_ids)
+        if computed_chunk_entities is not None:
+            return computed_chunk_entities
+        if ranked_ids is None:
+            return await compute()
+        chunk_entities = await ChunkManager.list_chunk_by_chunk_ids([chunk_id for chunk_id, _ in ranked_ids])
+        chunk_entity_dict = {chunk_entity.id: chunk_entity for chunk_entity in chunk_entities}
+        ranked_chunk_entities = []
+        for chunk_id, vector_distance in ranked_ids:
+            chunk_entity = chunk_entity_dict.get(chunk_id)
+            if chunk_entity is None:
+                continue
+            if vector_distance is not None:
+                chunk_entity.vector_distance = vector_distance
+            ranked_chunk_entities.append(chunk_entity)
+        return ranked_chunk_entities
@@ -7,6 +7,7 @@ from data_chain.stores.database.database import ChunkEntity
 from data_chain.parser.tools.token_tool import TokenTool
 from data_chain.manager.chunk_manager import ChunkManager
 from data_chain.rag.base_searcher import BaseSearcher
+from data_chain.rag.search_cache import SearchCache
 from data_chain.embedding.embedding import Embedding
 from data_chain.entities.enum import SearchMethod
 
@@ -25,7 +26,7 @@ class VectorSearcher(BaseSearcher):
         :param top_k: 返回的结果数量
         :return: 检索结果
         """
-        vector = await Embedding.vectorize_embedding(query)
+        vector = await SearchCache.get_query_vector(query, kb_id)
         chunk_entities = []
         for _ in range(3):
             try:
@@ -35,4 +36,6 @@ class VectorSearcher(BaseSearcher):
                 err = f"[VectorSearcher] 向量检索失败，error: {e}"
                 logging.exception(err)
                 continue
+        else:
+            SearchCache.mark_uncacheable("向量检索失败")
         return chunk_entities
@@ -1,6 +1,11 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy import Index
+import asyncio
+import time
+from contextvars import ContextVar
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import Index, text
 from uuid import uuid4
 import urllib.parse
 from data_chain.logger.logger import logger as logging
@@ -214,7 +219,8 @@ class KnowledgeBaseEntity(Base):
     name = Column(String, default='')  # 知识库名资产名
     tokenizer = Column(String, default=Tokenizer.ZH.value)  # 分词器
     description = Column(String, default='')  # 资产描述
-    embedding_model = Column(String)  # 资产向量化模型
+    embedding_model = Column(String)  # 资产向量化模型，检索时用该模型向量化查询
+    reembed_model = Column(String)  # 重新向量化的目标模型，切换完成后清空
     doc_cnt = Column(Integer, default=0)  # 资产文档个数
     doc_size = Column(Integer, default=0)  # 资产下所有文档大小(TODO: 单位kb或者字节)
     upload_count_limit = Column(Integer, default=128)  # 更新次数限制
@@ -222,6 +228,7 @@ class KnowledgeBaseEntity(Base):
     default_parse_method = Column(String, default=ParseMethod.GENERAL.value)  # 默认解析方法
     default_chunk_size = Column(Integer, default=1024)  # 默认分块大小
     status = Column(String, default=KnowledgeBaseStatus.IDLE.value)
+    generation = Column(Integer, default=0)  # 知识库内容的代数，文档或片段变化时递增
     created_time = Column(
         TIMESTAMP(timezone=True),
         nullable=True,
@@ -271,7 +278,9 @@ class DocumentEntity(Base):
     status = Column(String, default=DocumentStatus.IDLE.value)  # 文档状态
     full_text = Column(String)  # 文档全文
     abstract = Column(String)  # 文档摘要
-    abstract_vector = Column(Vector(1024))  # 文档摘要向量
+    abstract_vector = Column(Vector(config['EMBEDDING_DIMENSION']))  # 文档摘要向量
+    abstract_vector_shadow = Column(Vector(config['EMBEDDING_DIMENSION']))  # 重新向量化时的文档摘要影子向量
+    embedding_model = Column(String, default=lambda: config['EMBEDDING_MODEL_NAME'])  # 文档摘要向量的模型
     created_time = Column(
         TIMESTAMP(timezone=True),
         nullable=True,
@@ -290,6 +299,12 @@ class DocumentEntity(Base):
             postgresql_with={'m': 16, 'ef_construction': 200},
             postgresql_ops={'abstract_vector': 'vector_cosine_ops'}
         ),
+        Index(
+            'document_kb_id_created_time_index',
+            kb_id,
+            created_time,
+            postgresql_where=(status != DocumentStatus.DELETED.value)
+        ),
     )
 
 
@@ -302,7 +317,9 @@ class ChunkEntity(Base):
     doc_id = Column(UUID, ForeignKey('document.id', ondelete="CASCADE"))  # 片段所属文档id
     doc_name = Column(String)  # 片段所属文档名称
     text = Column(String)  # 片段文本内容
-    text_vector = Column(Vector(1024))  # 文本向量
+    text_vector = Column(Vector(config['EMBEDDING_DIMENSION']))  # 文本向量
+    text_vector_shadow = Column(Vector(config['EMBEDDING_DIMENSION']))  # 重新向量化时的影子向量
+    embedding_model = Column(String, default=lambda: config['EMBEDDING_MODEL_NAME'])  # 文本向量的模型
     tokens = Column(Integer)  # 片段文本token数
     type = Column(String, default=ChunkType.TEXT.value)  # 片段类型
     # 前一个chunk的id（假如解析结果为链表，那么这里是前一个节点的id，如果文档解析结果为树，那么这里是父节点的id）
@@ -330,6 +347,18 @@ class ChunkEntity(Base):
             postgresql_with={'m': 16, 'ef_construction': 200},
             postgresql_ops={'text_vector': 'vector_cosine_ops'}
         ),
+        Index('chunk_doc_id_global_offset_index', doc_id, global_offset),
+        Index(
+            'chunk_kb_id_parse_topology_type_index',
+            kb_id,
+            parse_topology_type,
+            postgresql_where=(status != ChunkStatus.DELETED.value)
+        ),
+        Index(
+            'chunk_pre_id_in_parse_topology_index',
+            pre_id_in_parse_topology,
+            postgresql_where=(status != ChunkStatus.DELETED.value)
+        ),
     )
 
 
@@ -351,6 +380,9 @@ class ImageEntity(Base):
         server_default=func.current_timestamp(),
         onupdate=func.current_timestamp()
     )
+    __table_args__ = (
+        Index('image_doc_id_index', doc_id),
+    )
 
 
 class DataSetEntity(Base):
@@ -422,6 +454,9 @@ class QAEntity(Base):
         server_default=func.current_timestamp(),
         onupdate=func.current_timestamp()
     )
+    __table_args__ = (
+        Index('qa_dataset_id_created_at_index', dataset_id, created_at),
+    )
 
 
 class TestingEntity(Base):
@@ -512,6 +547,10 @@ class TaskEntity(Base):
         server_default=func.current_timestamp(),
         onupdate=func.current_timestamp()
     )
+    __table_args__ = (
+        Index('task_op_id_created_time_index', op_id, created_time),
+        Index('task_status_index', status),
+    )
 
 
 class TaskReportEntity(Base):
@@ -532,6 +571,54 @@ class TaskReportEntity(Base):
         server_default=func.current_timestamp(),
         onupdate=func.current_timestamp()
     )
+    __table_args__ = (
+        Index('task_report_task_id_created_time_index', task_id, created_time),
+    )
+
+
+class SchemaMigrationEntity(Base):
+    __tablename__ = 'schema_migration'
+
+    version = Column(Integer, primary_key=True)  # 迁移版本号
+    description = Column(String)  # 迁移说明
+    applied_time = Column(
+        TIMESTAMP(timezone=True),
+        nullable=True,
+        server_default=func.current_timestamp()
+    )
+
+
+class MetricsAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """记录连接获取次数、等待耗时和超时次数的连接池"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_cnt = 0
+        self.checkout_timeout_cnt = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        except SATimeoutError:
+            self.checkout_timeout_cnt += 1
+            raise
+        finally:
+            wait_time = time.perf_counter() - start_time
+            self.checkout_cnt += 1
+            self.checkout_wait_total += wait_time
+            self.checkout_wait_max = max(self.checkout_wait_max, wait_time)
+
+
+class RequestSession:
+    """请求级别的会话，同一请求内串行的数据库操作复用同一个会话和连接"""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.in_use = False
+        self.closed = False
 
 
 class DataBase:
@@ -547,10 +634,35 @@ class DataBase:
     engine = create_async_engine(
         database_url,
         echo=False,
+        poolclass=MetricsAsyncAdaptedQueuePool,
+        pool_size=config['DATABASE_POOL_SIZE'],
+        max_overflow=config['DATABASE_MAX_OVERFLOW'],
+        pool_timeout=config['DATABASE_POOL_TIMEOUT'],
         pool_recycle=300,
-        pool_pre_ping=True
+        pool_pre_ping=True,
+        connect_args={
+            'server_settings': {'statement_timeout': str(config['DATABASE_STATEMENT_TIMEOUT'])},
+            'prepared_statement_cache_size': config['DATABASE_PREPARED_STATEMENT_CACHE_SIZE']
+        }
     )
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
     init_all_table_flag = False
+    init_all_table_lock = asyncio.Lock()
+    request_session_var: ContextVar[RequestSession] = ContextVar('request_session', default=None)
+    hnsw_iterative_scan_supported = None
+    # 紧凑向量索引离线创建，服务启动时检查索引是否可用
+    compact_vector_index_ready = False
+    # 紧凑向量类型: (索引表达式, 索引操作符类, 距离操作符, 查询向量表达式)
+    compact_vector_types = {
+        'halfvec': (
+            'CAST({column} AS halfvec({dim}))', 'halfvec_cosine_ops', '<=>',
+            'CAST(CAST(:query_vector AS vector({dim})) AS halfvec({dim}))'
+        ),
+        'bit': (
+            'CAST(binary_quantize({column}) AS bit({dim}))', 'bit_hamming_ops', '<~>',
+            'binary_quantize(CAST(:query_vector AS vector({dim})))'
+        ),
+    }
 
     @classmethod
     async def init_all_table(cls):
@@ -561,17 +673,114 @@ class DataBase:
             @event.listens_for(DataBase.engine.sync_engine, "connect")
             def connect(dbapi_connection, connection_record):
                 dbapi_connection.run_async(register_vector)
-        async with DataBase.engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+        # 已有表上的结构迁移在服务启动时执行，请求路径上只创建缺失的表
+        from data_chain.stores.database.migration import SchemaMigrator
+        await SchemaMigrator.create_tables(DataBase.engine)
 
     @classmethod
-    async def get_session(cls):
-        if DataBase.init_all_table_flag is False:
+    async def ensure_all_table(cls):
+        if DataBase.init_all_table_flag:
+            return
+        async with DataBase.init_all_table_lock:
+            if DataBase.init_all_table_flag:
+                return
             await DataBase.init_all_table()
             DataBase.init_all_table_flag = True
-        connection = async_sessionmaker(DataBase.engine, expire_on_commit=False)()
+
+    @classmethod
+    async def get_session(cls):
+        if not DataBase.init_all_table_flag:
+            await DataBase.ensure_all_table()
+        request_session = DataBase.request_session_var.get()
+        if request_session is not None and not request_session.closed and not request_session.in_use:
+            return cls._RequestConnectionManager(request_session)
+        connection = DataBase.session_maker()
         return cls._ConnectionManager(connection)
 
+    @classmethod
+    async def request_session(cls):
+        """FastAPI依赖，为每个请求提供一个会话，请求结束时关闭"""
+        if not DataBase.init_all_table_flag:
+            await DataBase.ensure_all_table()
+        request_session = RequestSession(DataBase.session_maker())
+        DataBase.request_session_var.set(request_session)
+        try:
+            yield request_session.session
+        finally:
+            request_session.closed = True
+            await request_session.session.close()
+
+    @classmethod
+    async def apply_hnsw_search_settings(cls, session: AsyncSession, top_k: int) -> None:
+        """为当前事务设置hnsw检索参数，openGauss不支持pgvector的这些参数"""
+        if config['DATABASE_TYPE'].lower() == 'opengauss':
+            return
+        ef_search = max(int(config['HNSW_EF_SEARCH']), int(top_k))
+        await session.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search}"))
+        iterative_scan = config['HNSW_ITERATIVE_SCAN']
+        if iterative_scan not in ('strict_order', 'relaxed_order'):
+            return
+        if DataBase.hnsw_iterative_scan_supported is None:
+            result = await session.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))
+            version = result.scalar() or '0'
+            DataBase.hnsw_iterative_scan_supported = tuple(
+                int(part) for part in version.split('.')[:2] if part.isdigit()) >= (0, 8)
+            if not DataBase.hnsw_iterative_scan_supported:
+                logging.warning("[DataBase] pgvector版本 %s 不支持hnsw迭代扫描", version)
+        if not DataBase.hnsw_iterative_scan_supported:
+            return
+        await session.execute(text(f"SET LOCAL hnsw.iterative_scan = {iterative_scan}"))
+        await session.execute(text(f"SET LOCAL hnsw.max_scan_tuples = {int(config['HNSW_MAX_SCAN_TUPLES'])}"))
+
+    @classmethod
+    def get_configured_compact_vector_type(cls) -> str:
+        """配置启用的紧凑向量类型，未启用或数据库不支持时返回None"""
+        compact_type = config['VECTOR_COMPACT_TYPE']
+        if not compact_type or compact_type not in DataBase.compact_vector_types:
+            return None
+        if config['DATABASE_TYPE'].lower() == 'opengauss':
+            return None
+        return compact_type
+
+    @classmethod
+    def get_compact_vector_type(cls) -> str:
+        """检索使用的紧凑向量类型，未启用、数据库不支持或紧凑向量索引不可用时返回None"""
+        if not DataBase.compact_vector_index_ready:
+            return None
+        return DataBase.get_configured_compact_vector_type()
+
+    @classmethod
+    def get_compact_distance(cls, table_name: str, column_name: str, vector: list[float]):
+        """紧凑向量的距离表达式，与紧凑向量索引的表达式一致才能走索引"""
+        compact_type = DataBase.get_compact_vector_type()
+        if compact_type is None:
+            return None
+        index_expr, _, operator, query_expr = DataBase.compact_vector_types[compact_type]
+        dim = config['EMBEDDING_DIMENSION']
+        return text(
+            f"{index_expr.format(column=f'{table_name}.{column_name}', dim=dim)} {operator} "
+            f"{query_expr.format(dim=dim)}"
+        ).bindparams(query_vector='[' + ','.join(str(value) for value in vector) + ']')
+
+    @classmethod
+    def get_pool_status(cls) -> dict:
+        """连接池使用情况"""
+        pool = DataBase.engine.pool
+        checkout_cnt = getattr(pool, 'checkout_cnt', 0)
+        checkout_wait_total = getattr(pool, 'checkout_wait_total', 0.0)
+        return {
+            'pool_size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+            'utilization': pool.checkedout() / max(pool.size() + config['DATABASE_MAX_OVERFLOW'], 1),
+            'checkout_cnt': checkout_cnt,
+            'checkout_timeout_cnt': getattr(pool, 'checkout_timeout_cnt', 0),
+            'checkout_wait_avg': checkout_wait_total / checkout_cnt if checkout_cnt else 0.0,
+            'checkout_wait_max': getattr(pool, 'checkout_wait_max', 0.0)
+        }
+
     class _ConnectionManager:
         def __init__(self, connection):
             self.connection = connection
@@ -581,3 +790,27 @@ class DataBase:
 
         async def __aexit__(self, exc_type, exc_val, exc_tb):
             await self.connection.close()
+
+    class _RequestConnectionManager:
+        def __init__(self, request_session: RequestSession):
+            self.request_session = request_session
+
+        async def __aenter__(self):
+            self.request_session.in_use = True
+            return self.request_session.session
+
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
+            session = self.request_session.session
+            try:
+                # 结束事务，连接在两次调用之间归还连接池，SET LOCAL的检索参数也随事务失效
+                if exc_type is not None or not session.is_active:
+                    await session.rollback()
+                elif session.in_transaction():
+                    await session.commit()
+                # 与关闭会话一致，不把本次查询的对象留给后续操作
+                session.expunge_all()
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                self.request_session.in_use = False
@@ -0,0 +1,411 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Callable
+from uuid import uuid4
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from data_chain.config.config import config
+from data_chain.entities.enum import TaskStatus
+from data_chain.logger.logger import logger as logging
+from data_chain.stores.database.database import (
+    Base,
+    KnowledgeBaseEntity,
+    DocumentEntity,
+    ChunkEntity,
+    ImageEntity,
+    QAEntity,
+    TaskEntity,
+    TaskReportEntity,
+    SchemaMigrationEntity
+)
+
+
+class Migration:
+    """
+    一次结构迁移，upgrade在同步连接上执行，必须可重复执行
+    concurrent为True时upgrade在自动提交的连接上执行，用于CREATE INDEX CONCURRENTLY等不能在事务中执行的语句和分批提交的数据更新
+    """
+
+    def __init__(self, version: int, description: str, upgrade: Callable, concurrent: bool = False):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.concurrent = concurrent
+
+
+def is_opengauss() -> bool:
+    """openGauss不支持to_regclass和并发建索引，也不使用advisory lock，迁移时跳过这些步骤"""
+    return config['DATABASE_TYPE'].lower() == 'opengauss'
+
+
+def drop_invalid_index(sync_conn, index_name: str) -> None:
+    """并发建索引中断时会留下无效索引，IF NOT EXISTS会跳过它，重建前先删除"""
+    if is_opengauss():
+        return
+    result = sync_conn.execute(text(
+        'SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:index_name)'
+    ), {'index_name': index_name})
+    if result.scalar():
+        sync_conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}'))
+
+
+def create_indexes(*entities) -> Callable:
+    """为已存在的表并发补建实体中声明的非向量索引，建索引期间不阻塞写入，openGauss上普通建索引"""
+    def upgrade(sync_conn) -> None:
+        for entity in entities:
+            for index in entity.__table__.indexes:
+                if index.dialect_options['postgresql']['using'] == 'hnsw':
+                    continue
+                drop_invalid_index(sync_conn, index.name)
+                create_index_sql = str(CreateIndex(index, if_not_exists=True).compile(
+                    dialect=sync_conn.dialect, compile_kwargs={'literal_binds': True}))
+                if not is_opengauss():
+                    create_index_sql = create_index_sql.replace('INDEX', 'INDEX CONCURRENTLY', 1)
+                sync_conn.execute(text(create_index_sql))
+    return upgrade
+
+
+def add_columns(entity, *column_names: str) -> Callable:
+    """为已存在的表补充实体中新增的列"""
+    def upgrade(sync_conn) -> None:
+        table = entity.__table__
+        existing_columns = {column['name'] for column in inspect(sync_conn).get_columns(table.name)}
+        for column_name in column_names:
+            if column_name in existing_columns:
+                continue
+            column_type = table.c[column_name].type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_name} {column_type}'))
+    return upgrade
+
+
+def reset_knowledge_base_embedding_model(sync_conn) -> None:
+    """历史知识库的向量都由配置的模型生成，将知识库的向量化模型统一为配置的模型，检索时按该模型向量化查询"""
+    sync_conn.execute(text(
+        "UPDATE knowledge_base SET embedding_model = :embedding_model "
+        "WHERE embedding_model IS DISTINCT FROM :embedding_model"
+    ), {'embedding_model': config['EMBEDDING_MODEL_NAME']})
+
+
+def backfill_embedding_model(entity, batch_size: int = 10000) -> Callable:
+    """
+    为未标记向量模型的历史数据补充模型，需要在自动提交的连接上执行
+    历史向量都由配置的模型生成，知识库的embedding_model只是创建时填写的名称，不作为依据
+    按主键分批更新，每批单独提交，中断后重新执行时跳过已补充的行
+    """
+    def upgrade(sync_conn) -> None:
+        table_name = entity.__tablename__
+        last_id = None
+        while True:
+            result = sync_conn.execute(text(
+                f"SELECT id FROM (SELECT id FROM {table_name} "
+                f"WHERE (CAST(:last_id AS uuid) IS NULL OR id > CAST(:last_id AS uuid)) "
+                f"ORDER BY id LIMIT :batch_size) batch ORDER BY id DESC LIMIT 1"
+            ), {'last_id': last_id, 'batch_size': batch_size})
+            batch_last_id = result.scalar()
+            if batch_last_id is None:
+                break
+            sync_conn.execute(text(
+                f"UPDATE {table_name} SET embedding_model = :embedding_model "
+                f"WHERE (CAST(:last_id AS uuid) IS NULL OR id > CAST(:last_id AS uuid)) "
+                f"AND id <= CAST(:batch_last_id AS uuid) AND embedding_model IS NULL"
+            ), {'embedding_model': config['EMBEDDING_MODEL_NAME'], 'last_id': last_id,
+                'batch_last_id': str(batch_last_id)})
+            last_id = str(batch_last_id)
+    return upgrade
+
+
+def run_all(*upgrades: Callable) -> Callable:
+    def upgrade(sync_conn) -> None:
+        for sub_upgrade in upgrades:
+            sub_upgrade(sync_conn)
+    return upgrade
+
+
+class SchemaMigrator:
+    '''
+    数据库结构迁移
+    新表由create_all创建，已有表上的变更按版本号顺序执行，已执行的版本记录在schema_migration表中
+    迁移在服务启动时或通过python -m data_chain.stores.database.migration执行，不在请求路径上执行
+    迁移期间不限制语句超时，多个进程同时启动时通过会话级advisory lock串行执行
+    '''
+    lock_key = 20250601
+    create_table_lock_key = 20250602
+    # 需要紧凑向量索引的(表, 列)
+    compact_vector_columns = [('chunk', 'text_vector')]
+    # 维度需与EMBEDDING_DIMENSION一致的向量列
+    vector_columns = [('chunk', 'text_vector'), ('chunk', 'text_vector_shadow'),
+                      ('document', 'abstract_vector'), ('document', 'abstract_vector_shadow')]
+    migrations = [
+        Migration(
+            1, '为chunk、document、image、task、task_report、qa的热点查询添加B-tree索引',
+            create_indexes(DocumentEntity, ChunkEntity, ImageEntity, QAEntity, TaskEntity, TaskReportEntity),
+            concurrent=True
+        ),
+        Migration(
+            2, '为chunk和document添加向量模型标记和重新向量化使用的影子向量列',
+            run_all(
+                add_columns(ChunkEntity, 'embedding_model', 'text_vector_shadow'),
+                add_columns(DocumentEntity, 'embedding_model', 'abstract_vector_shadow')
+            )
+        ),
+        Migration(
+            3, '为knowledge_base添加内容代数，用于检索结果缓存失效',
+            add_columns(KnowledgeBaseEntity, 'generation')
+        ),
+        Migration(
+            4, '为未标记向量模型的历史chunk和document补充向量模型',
+            run_all(backfill_embedding_model(ChunkEntity), backfill_embedding_model(DocumentEntity)),
+            concurrent=True
+        ),
+        Migration(
+            5, '为knowledge_base添加重新向量化目标模型，并将知识库的向量化模型统一为生成历史向量的模型',
+            run_all(add_columns(KnowledgeBaseEntity, 'reembed_model'), reset_knowledge_base_embedding_model)
+        ),
+    ]
+    # 热点查询及其参数，用于检查执行计划中是否出现全表扫描
+    hot_queries = {
+        'chunk_surrounding_by_doc_id_and_global_offset': (
+            "SELECT id FROM chunk WHERE doc_id = :doc_id AND status != 'deleted' "
+            "AND global_offset >= :start AND global_offset <= :end ORDER BY global_offset",
+            {'doc_id': uuid4(), 'start': 0, 'end': 100}
+        ),
+        'chunk_list_by_doc_id': (
+            "SELECT id FROM chunk WHERE doc_id = :doc_id AND status != 'deleted' ORDER BY global_offset",
+            {'doc_id': uuid4()}
+        ),
+        'chunk_cnt_by_kb_id': (
+            "SELECT count(*) FROM chunk WHERE kb_id = :kb_id AND status != 'deleted'",
+            {'kb_id': uuid4()}
+        ),
+        'chunk_list_by_pre_id': (
+            "SELECT id FROM chunk WHERE pre_id_in_parse_topology = :pre_id AND status != 'deleted'",
+            {'pre_id': uuid4()}
+        ),
+        'document_list_by_kb_id': (
+            "SELECT id FROM document WHERE kb_id = :kb_id AND status != 'deleted' "
+            "ORDER BY created_time DESC LIMIT 10",
+            {'kb_id': uuid4()}
+        ),
+        'image_list_by_doc_id': (
+            "SELECT id FROM image WHERE doc_id = :doc_id AND status != 'deleted'",
+            {'doc_id': uuid4()}
+        ),
+        'task_current_by_op_id': (
+            "SELECT id FROM task WHERE op_id = :op_id AND status != 'deleted' "
+            "ORDER BY created_time DESC LIMIT 1",
+            {'op_id': uuid4()}
+        ),
+        'task_list_by_status': (
+            "SELECT id FROM task WHERE status = :status",
+            {'status': TaskStatus.PENDING.value}
+        ),
+        'task_report_current_by_task_id': (
+            "SELECT id FROM task_report WHERE task_id = :task_id ORDER BY created_time DESC LIMIT 1",
+            {'task_id': uuid4()}
+        ),
+        'qa_list_by_dataset_id': (
+            "SELECT id FROM qa WHERE dataset_id = :dataset_id AND status != 'deleted' "
+            "ORDER BY created_at DESC LIMIT 10",
+            {'dataset_id': uuid4()}
+        ),
+    }
+
+    @staticmethod
+    async def create_tables(engine: AsyncEngine) -> None:
+        """创建缺失的表，多个进程同时创建时通过事务级advisory lock串行执行"""
+        async with engine.begin() as conn:
+            if not is_opengauss():
+                await conn.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+                                   {'key': SchemaMigrator.create_table_lock_key})
+            await conn.run_sync(Base.metadata.create_all)
+
+    @staticmethod
+    async def run_without_transaction(engine: AsyncEngine, upgrade: Callable) -> None:
+        """在自动提交且不限制语句超时的连接上执行，CREATE INDEX CONCURRENTLY不能在事务中执行"""
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            await conn.execute(text('SET statement_timeout = 0'))
+            try:
+                await conn.run_sync(upgrade)
+            finally:
+                # 连接会归还连接池，恢复为建立连接时设置的语句超时
+                await conn.execute(text('RESET statement_timeout'))
+
+    @staticmethod
+    async def migrate(engine: AsyncEngine) -> None:
+        '''
+        创建缺失的表并执行未执行过的迁移，每个迁移在各自的事务中执行并记录版本
+        openGauss上不加advisory lock，多实例部署时应先单独执行python -m data_chain.stores.database.migration
+        '''
+        await SchemaMigrator.create_tables(engine)
+        use_lock = not is_opengauss()
+        async with engine.connect() as conn:
+            if use_lock:
+                await conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': SchemaMigrator.lock_key})
+                await conn.commit()
+            try:
+                result = await conn.execute(select(SchemaMigrationEntity.version))
+                applied_versions = set(result.scalars().all())
+                await conn.commit()
+                for migration in sorted(SchemaMigrator.migrations, key=lambda migration: migration.version):
+                    if migration.version in applied_versions:
+                        continue
+                    logging.info("[SchemaMigrator] 执行数据库迁移 %d: %s", migration.version, migration.description)
+                    if migration.concurrent:
+                        await SchemaMigrator.run_without_transaction(engine, migration.upgrade)
+                    async with conn.begin():
+                        await conn.execute(text('SET LOCAL statement_timeout = 0'))
+                        if not migration.concurrent:
+                            await conn.run_sync(migration.upgrade)
+                        await conn.execute(
+                            SchemaMigrationEntity.__table__.insert().values(
+                                version=migration.version, description=migration.description))
+            finally:
+                if use_lock:
+                    await conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': SchemaMigrator.lock_key})
+                    await conn.commit()
+
+    @staticmethod
+    async def build_compact_vector_indexes(engine: AsyncEngine) -> None:
+        '''
+        按配置并发创建紧凑向量的hnsw表达式索引，并记录构建耗时和索引大小
+        大表上构建耗时较长，不在服务启动时执行，通过python -m data_chain.stores.database.migration --build-compact-vector-index离线执行
+        '''
+        from data_chain.stores.database.database import DataBase
+        compact_type = DataBase.get_configured_compact_vector_type()
+        if compact_type is None:
+            logging.warning("[SchemaMigrator] 未启用紧凑向量或数据库不支持，跳过创建紧凑向量索引")
+            return
+        index_expr, ops, _, _ = DataBase.compact_vector_types[compact_type]
+        dim = config['EMBEDDING_DIMENSION']
+
+        def upgrade(sync_conn) -> None:
+            for table_name, column_name in SchemaMigrator.compact_vector_columns:
+                index_name = f'{table_name}_{column_name}_{compact_type}_index'
+                drop_invalid_index(sync_conn, index_name)
+                result = sync_conn.execute(text('SELECT to_regclass(:index_name)'), {'index_name': index_name})
+                if result.scalar() is not None:
+                    continue
+                start_time = time.perf_counter()
+                sync_conn.execute(text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table_name} USING hnsw "
+                    f"(({index_expr.format(column=column_name, dim=dim)}) {ops}) "
+                    f"WITH (m = 16, ef_construction = 200)"
+                ))
+                build_time = time.perf_counter() - start_time
+                result = sync_conn.execute(text('SELECT pg_relation_size(to_regclass(:index_name))'),
+                                           {'index_name': index_name})
+                logging.info("[SchemaMigrator] 创建紧凑向量索引 %s 耗时 %.2fs，大小 %d 字节",
+                             index_name, build_time, result.scalar())
+        await SchemaMigrator.run_without_transaction(engine, upgrade)
+
+    @staticmethod
+    async def check_compact_vector_indexes(engine: AsyncEngine) -> bool:
+        """检查配置的紧凑向量索引是否都已建好且有效，索引不可用时检索不使用紧凑向量"""
+        from data_chain.stores.database.database import DataBase
+        compact_type = DataBase.get_configured_compact_vector_type()
+        ready = compact_type is not None
+        if ready:
+            async with engine.connect() as conn:
+                for table_name, column_name in SchemaMigrator.compact_vector_columns:
+                    index_name = f'{table_name}_{column_name}_{compact_type}_index'
+                    result = await conn.execute(text(
+                        'SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:index_name)'
+                    ), {'index_name': index_name})
+                    if result.scalar():
+                        continue
+                    ready = False
+                    logging.warning("[SchemaMigrator] 紧凑向量索引 %s 不存在或无效，检索不使用紧凑向量，"
+                                    "请执行python -m data_chain.stores.database.migration "
+                                    "--build-compact-vector-index后重启服务", index_name)
+        DataBase.compact_vector_index_ready = ready
+        return ready
+
+    @staticmethod
+    async def check_vector_dimensions(engine: AsyncEngine) -> None:
+        """检查已有向量列声明的维度与EMBEDDING_DIMENSION一致，不一致时写入向量都会失败，直接报错"""
+        dimension = config['EMBEDDING_DIMENSION']
+        mismatches = []
+        async with engine.connect() as conn:
+            for table_name, column_name in SchemaMigrator.vector_columns:
+                # 向量类型的atttypmod即声明的维度
+                result = await conn.execute(text(
+                    'SELECT a.atttypmod FROM pg_attribute a JOIN pg_class c ON a.attrelid = c.oid '
+                    'WHERE c.relname = :table_name AND a.attname = :column_name AND NOT a.attisdropped'
+                ), {'table_name': table_name, 'column_name': column_name})
+                column_dimension = result.scalar()
+                if column_dimension is not None and column_dimension > 0 and column_dimension != dimension:
+                    mismatches.append(f'{table_name}.{column_name}: vector({column_dimension})')
+        if mismatches:
+            err = (f"[SchemaMigrator] 向量列维度与EMBEDDING_DIMENSION {dimension} 不一致: {', '.join(mismatches)}，"
+                   f"请修改EMBEDDING_DIMENSION或迁移向量列")
+            logging.error(err)
+            raise ValueError(err)
+
+    @staticmethod
+    def collect_seq_scans(plan: dict) -> list[str]:
+        """收集执行计划中的全表扫描节点"""
+        relations = []
+        if plan.get('Node Type') == 'Seq Scan':
+            relations.append(plan.get('Relation Name'))
+        for sub_plan in plan.get('Plans', []):
+            relations.extend(SchemaMigrator.collect_seq_scans(sub_plan))
+        return relations
+
+    @staticmethod
+    async def explain(conn: AsyncConnection, sql: str, params: dict) -> dict:
+        result = await conn.execute(text('EXPLAIN (FORMAT JSON) ' + sql), params)
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    @staticmethod
+    async def check_hot_query_plans(engine: AsyncEngine) -> dict[str, list[str]]:
+        '''
+        检查热点查询的执行计划，返回仍走全表扫描的查询及扫描的表
+        关闭enable_seqscan后仍出现Seq Scan说明没有可用的索引，与表中数据量无关
+        '''
+        violations = {}
+        async with engine.connect() as conn:
+            async with conn.begin():
+                await conn.execute(text('SET LOCAL enable_seqscan = off'))
+                for name, (sql, params) in SchemaMigrator.hot_queries.items():
+                    try:
+                        plan = await SchemaMigrator.explain(conn, sql, params)
+                    except Exception as e:
+                        err = f"[SchemaMigrator] 获取查询 {name} 的执行计划失败: {e}"
+                        logging.exception(err)
+                        raise e
+                    relations = SchemaMigrator.collect_seq_scans(plan)
+                    if relations:
+                        violations[name] = relations
+        for name, relations in violations.items():
+            logging.error("[SchemaMigrator] 热点查询 %s 对表 %s 进行了全表扫描", name, ','.join(relations))
+        return violations
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="执行数据库结构迁移并检查热点查询的执行计划")
+    parser.add_argument('--build-compact-vector-index', action='store_true',
+                        help="并发创建配置的紧凑向量索引，大表上耗时较长")
+    args = parser.parse_args()
+    from data_chain.stores.database.database import DataBase
+    await DataBase.ensure_all_table()
+    await SchemaMigrator.migrate(DataBase.engine)
+    await SchemaMigrator.check_vector_dimensions(DataBase.engine)
+    if args.build_compact_vector_index:
+        await SchemaMigrator.build_compact_vector_indexes(DataBase.engine)
+    violations = await SchemaMigrator.check_hot_query_plans(DataBase.engine)
+    await DataBase.engine.dispose()
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
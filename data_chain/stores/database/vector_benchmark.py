@@ -0,0 +1,98 @@
+# Copyright (c) Huawei Technologies Co., Ltd. 2023-2025. All rights reserved.
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from sqlalchemy import select, func, text
+
+from data_chain.entities.enum import ChunkStatus
+from data_chain.logger.logger import logger as logging
+from data_chain.manager.chunk_manager import ChunkManager
+from data_chain.stores.database.database import DataBase, ChunkEntity
+from data_chain.stores.database.migration import SchemaMigrator
+
+
+class VectorSearchBenchmark:
+    '''
+    对比hnsw检索与精确检索的召回率和时延
+    从知识库中随机抽取片段向量作为查询向量，以精确检索结果为基准计算recall@k
+    '''
+
+    @staticmethod
+    async def sample_vectors(kb_id: uuid.UUID, sample_size: int) -> list[list[float]]:
+        async with await DataBase.get_session() as session:
+            stmt = (
+                select(ChunkEntity.text_vector)
+                .where(ChunkEntity.kb_id == kb_id)
+                .where(ChunkEntity.status != ChunkStatus.DELETED.value)
+                .where(ChunkEntity.text_vector.isnot(None))
+                .order_by(func.random())
+                .limit(sample_size)
+            )
+            result = await session.execute(stmt)
+            return [list(vector) for vector in result.scalars().all()]
+
+    @staticmethod
+    async def get_vector_index_sizes() -> dict[str, int]:
+        """chunk表上各向量索引的大小(字节)"""
+        async with await DataBase.get_session() as session:
+            result = await session.execute(text(
+                "SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes "
+                "WHERE relname = 'chunk' AND indexrelname LIKE '%vector%'"
+            ))
+            return {index_name: size for index_name, size in result.all()}
+
+    @staticmethod
+    def percentile(values: list[float], p: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    @staticmethod
+    async def run(kb_id: uuid.UUID, sample_size: int = 100, top_k: int = 10) -> dict:
+        vectors = await VectorSearchBenchmark.sample_vectors(kb_id, sample_size)
+        recalls = []
+        latency = {'ann': [], 'exact': []}
+        for vector in vectors:
+            start_time = time.perf_counter()
+            exact_chunks = await ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k, exact=True)
+            latency['exact'].append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            ann_chunks = await ChunkManager.get_top_k_chunk_by_kb_id_vector(kb_id, vector, top_k, exact=False)
+            latency['ann'].append(time.perf_counter() - start_time)
+            if not exact_chunks:
+                continue
+            exact_ids = {chunk_entity.id for chunk_entity in exact_chunks}
+            hit_cnt = len(exact_ids & {chunk_entity.id for chunk_entity in ann_chunks})
+            recalls.append(hit_cnt / len(exact_ids))
+        report = {
+            'kb_id': str(kb_id),
+            'sample_size': len(vectors),
+            'top_k': top_k,
+            f'recall@{top_k}': sum(recalls) / len(recalls) if recalls else 0.0,
+        }
+        report['compact_vector_type'] = DataBase.get_compact_vector_type()
+        report['vector_index_sizes'] = await VectorSearchBenchmark.get_vector_index_sizes()
+        for method, values in latency.items():
+            report[f'{method}_latency_p50_ms'] = VectorSearchBenchmark.percentile(values, 0.5) * 1000
+            report[f'{method}_latency_p95_ms'] = VectorSearchBenchmark.percentile(values, 0.95) * 1000
+        logging.info("[VectorSearchBenchmark] %s", report)
+        return report
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="对比hnsw检索与精确检索的召回率和时延")
+    parser.add_argument('kb_id', type=uuid.UUID)
+    parser.add_argument('--sample-size', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+    await SchemaMigrator.check_compact_vector_indexes(DataBase.engine)
+    report = await VectorSearchBenchmark.run(args.kb_id, args.sample_size, args.top_k)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    await DataBase.engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,9 +1,12 @@
 # Copyright (c) Huawei Technologies Co., Ltd. 2023-2024. All rights reserved.
 import asyncio
+import io
 from datetime import timedelta
 from data_chain.logger.logger import logger as logging
-import concurrent
+import concurrent.futures
+import urllib3
 from minio import Minio
+from minio.deleteobjects import DeleteObject
 
 from data_chain.entities.common import (
     REPORT_PATH_IN_MINIO,
@@ -19,11 +22,20 @@ from data_chain.config.config import config
 
 
 class MinIO():
+    # 连接池与线程池同样大小，保证并发传输时每个线程都能拿到连接
+    max_concurrency = config['MINIO_MAX_CONCURRENCY']
+    part_size = max(config['MINIO_PART_SIZE'], 5 * 1024 * 1024)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='minio')
     client = Minio(
         endpoint=config['MINIO_ENDPOINT'],
         access_key=config['MINIO_ACCESS_KEY'],
         secret_key=config['MINIO_SECRET_KEY'],
-        secure=config['MINIO_SECURE'])
+        secure=config['MINIO_SECURE'],
+        http_client=urllib3.PoolManager(
+            maxsize=max_concurrency,
+            timeout=urllib3.Timeout(connect=10, read=300),
+            retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+        ))
     found = client.bucket_exists(REPORT_PATH_IN_MINIO)
     if not found:
         client.make_bucket(REPORT_PATH_IN_MINIO)
@@ -49,6 +61,11 @@ class MinIO():
     if not found:
         client.make_bucket(TESTING_REPORT_PATH_IN_MINIO)
 
+    @staticmethod
+    async def run_in_executor(func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(MinIO.executor, lambda: func(*args, **kwargs))
+
     @staticmethod
     async def put_object(bucket_name: str, file_index: str, file_path: str):
         """
@@ -58,7 +75,8 @@ class MinIO():
         @params file_path: 上传文件目录, 绝对路径
         """
         try:
-            await asyncio.to_thread(MinIO.client.fput_object, bucket_name, file_index, file_path)
+            await MinIO.run_in_executor(
+                MinIO.client.fput_object, bucket_name, file_index, file_path, part_size=MinIO.part_size)
             return True
         except Exception as e:
             err = f"上传文件 {file_index} 到桶 {bucket_name} 失败: {e}"
@@ -73,7 +91,7 @@ class MinIO():
         @params file_name: 文件名
         """
         try:
-            MinIO.client.remove_object(bucket_name=bucket_name, object_name=file_index)
+            await MinIO.run_in_executor(MinIO.client.remove_object, bucket_name=bucket_name, object_name=file_index)
             return True
         except Exception as e:
             err = f"删除文件 {file_index} 在桶 {bucket_name} 失败: {e}"
@@ -89,11 +107,83 @@ class MinIO():
         @params file_path: 下载指定目录, 绝对路径
         """
         try:
-            await asyncio.to_thread(MinIO.client.fget_object, bucket_name, file_index, file_path)
+            await MinIO.run_in_executor(MinIO.client.fget_object, bucket_name, file_index, file_path)
+            return True
+        except Exception as e:
+            err = f"下载文件 {file_index} 在桶 {bucket_name} 失败: {e}"
+            logging.error("[MinIO] %s", err)
+        return False
+
+    @staticmethod
+    async def put_object_from_bytes(bucket_name: str, file_index: str, data: bytes):
+        """
+        从内存上传文件到指定桶当中, 如果桶已经存在文件, 则会覆盖
+        @params bucket_name: 桶名
+        @params file_index: 文件名
+        @params data: 文件内容
+        """
+        try:
+            await MinIO.run_in_executor(
+                MinIO.client.put_object, bucket_name, file_index, io.BytesIO(data), len(data),
+                part_size=MinIO.part_size)
             return True
+        except Exception as e:
+            err = f"上传文件 {file_index} 到桶 {bucket_name} 失败: {e}"
+            logging.error("[MinIO] %s", err)
+            return False
+
+    @staticmethod
+    def read_object_bytes(bucket_name: str, file_index: str) -> bytes:
+        """
+        同步读取桶内指定文件内容到内存，供已在线程中执行的调用方使用
+        @params bucket_name: 桶名
+        @params file_index: 文件名
+        """
+        try:
+            response = MinIO.client.get_object(bucket_name, file_index)
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
         except Exception as e:
             err = f"下载文件 {file_index} 在桶 {bucket_name} 失败: {e}"
             logging.error("[MinIO] %s", err)
+        return None
+
+    @staticmethod
+    async def get_object_bytes(bucket_name: str, file_index: str) -> bytes:
+        """
+        读取桶内指定文件内容到内存
+        @params bucket_name: 桶名
+        @params file_index: 文件名
+        """
+        return await MinIO.run_in_executor(MinIO.read_object_bytes, bucket_name, file_index)
+
+    @staticmethod
+    async def delete_objects(bucket_name: str, file_indexes: list[str]) -> bool:
+        """
+        批量删除桶内文件
+        @params bucket_name: 桶名
+        @params file_indexes: 文件名列表
+        """
+        if not file_indexes:
+            return True
+
+        def remove_objects():
+            # remove_objects返回惰性迭代器，遍历时才真正发起删除请求
+            errors = MinIO.client.remove_objects(
+                bucket_name, [DeleteObject(file_index) for file_index in file_indexes])
+            return [error for error in errors]
+        try:
+            errors = await MinIO.run_in_executor(remove_objects)
+            for error in errors:
+                err = f"删除文件 {error.name} 在桶 {bucket_name} 失败: {error.message}"
+                logging.error("[MinIO] %s", err)
+            return len(errors) == 0
+        except Exception as e:
+            err = f"批量删除桶 {bucket_name} 内文件失败: {e}"
+            logging.error("[MinIO] %s", err)
         return False
 
     @staticmethod
@@ -110,3 +200,69 @@ class MinIO():
             err = f"生成文件 {file_name} 在桶 {bucket_name} 的下载链接失败: {e}"
             logging.error("[MinIO] %s", err)
         return ""
+
+
+class MinIOObjectReader(io.RawIOBase):
+    """
+    MinIO对象的只读可寻址文件，按需发起范围请求并缓存一段数据
+    供zipfile等需要随机访问的读取方直接读取桶内文件，不落盘
+    """
+
+    def __init__(self, bucket_name: str, file_index: str, buffer_size: int = 8 * 1024 * 1024):
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.file_index = file_index
+        self.buffer_size = buffer_size
+        self.size = MinIO.client.stat_object(bucket_name, file_index).size
+        self.pos = 0
+        self.buffer = b''
+        self.buffer_start = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        else:
+            raise ValueError(f"不支持的whence: {whence}")
+        if self.pos < 0:
+            raise ValueError("偏移量不能为负数")
+        return self.pos
+
+    def fill_buffer(self, length: int) -> None:
+        length = min(max(length, self.buffer_size), self.size - self.pos)
+        response = MinIO.client.get_object(self.bucket_name, self.file_index, offset=self.pos, length=length)
+        try:
+            self.buffer = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+        self.buffer_start = self.pos
+
+    def readinto(self, b) -> int:
+        # zipfile按返回长度判断是否读完，跨越缓存末尾时继续请求，直到读满或到达文件末尾
+        view = memoryview(b).cast('B')
+        total = 0
+        while total < len(view) and self.pos < self.size:
+            offset = self.pos - self.buffer_start
+            if offset < 0 or offset >= len(self.buffer):
+                self.fill_buffer(len(view) - total)
+                offset = 0
+                if not self.buffer:
+                    break
+            n = min(len(view) - total, len(self.buffer) - offset)
+            view[total:total + n] = self.buffer[offset:offset + n]
+            self.pos += n
+            total += n
+        return total